@@ -0,0 +1,299 @@
+# analysis.py (tokenize / diff each chat turn once; no FastAPI imports)
+import re
+from collections import Counter
+from functools import cached_property
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+
+from services.alignment import Alignment, align
+
+from .grammar import guess_reason
+
+MAX_BULLETS = 12
+
+_TOKEN_RE = re.compile(r"[A-Za-z']+|[0-9]+|[^\sA-Za-z0-9]")
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+_WS_RE = re.compile(r"\s+")
+_BULLET_SPAN_RE = re.compile(r"\*\*(.+?)\s*→\s*(.+?)\*\*")
+
+# ---------------- Tokenization & helpers ----------------
+
+def normalize_txt(x: str) -> str:
+    x = (x or "")
+    x = x.replace("’", "'").replace("“", "\"").replace("”", "\"")
+    x = _WS_RE.sub(" ", x)
+    return x.strip()
+
+def word_tokens(text: str) -> list[str]:
+    # Keep punctuation as separate tokens so we can detect , . ? edits
+    return _TOKEN_RE.findall(text or "")
+
+def token_spans(text: str) -> list[tuple[str, int, int]]:
+    # Same tokens as word_tokens, with their character offsets
+    return [(m.group(), m.start(), m.end()) for m in _TOKEN_RE.finditer(text or "")]
+
+def sentences(text: str) -> list[str]:
+    # Simple, robust sentence splitter for short learner texts
+    # Splits on ., ?, ! while keeping minimal noise
+    parts = _SENTENCE_SPLIT_RE.split((text or "").strip())
+    return [p for p in parts if p]
+
+def clean_corrected_version(text: str) -> str:
+    # Remove <<< >>> wrappers if the model emitted them
+    text = (text or "").strip()
+    text = re.sub(r"<<<|>>>", "", text)
+    text = re.sub(r"^<+|>+$", "", text).strip()
+    return text
+
+def extract_corrected_and_bullets(corrections_md: str) -> tuple[str, list[str]]:
+    if not corrections_md:
+        return "", []
+    s = corrections_md.replace("\r\n","\n")
+
+    m_cv = re.search(
+        r"Corrected\s+version\s*:\s*(.*?)(?:\n\s*\n|^\s*Issues\s*&\s*fixes\s*:|\Z)",
+        s, flags=re.IGNORECASE | re.DOTALL | re.MULTILINE
+    )
+    corrected = (m_cv.group(1).strip() if m_cv else "").strip()
+    corrected = clean_corrected_version(corrected)
+
+    m_if = re.search(
+        r"^\s*Issues\s*&\s*fixes\s*:\s*(.*)\Z",
+        s, flags=re.IGNORECASE | re.DOTALL | re.MULTILINE
+    )
+    bullets_block = m_if.group(1).strip() if m_if else ""
+    bullets = []
+    if bullets_block:
+        for line in bullets_block.splitlines():
+            if re.match(r"^\s*[-*]\s+", line):
+                bullets.append(line.strip())
+    return corrected, bullets
+
+# ---------------- POS mapping (coarse, analytics) ----------------
+
+_REASON_TO_POS = {
+    "article/determiner usage": "determiner",
+    "plural/3rd-person -s": "verb",            # broad backward-compatible bucket
+    "irregular past tense": "verb",
+    "regular past tense (-ed)": "verb",
+    "progressive aspect (-ing)": "verb",
+    "comparative/superlative form": "adjective",
+    "adverb form (-ly)": "adverb",
+    "question mark": "punctuation",
+    "period": "punctuation",
+    "comma": "punctuation",
+    "exclamation": "punctuation",
+    "apostrophe/contraction": "contraction",   # more specific than before (keeps compatibility)
+    "capitalization": "orthography",
+    "punctuation": "punctuation",
+
+    # NEW specific mappings
+    "modal verb": "verb.modal",
+    "auxiliary verb": "verb.auxiliary",
+    "preposition usage": "preposition",
+    "pronoun/person": "pronoun",
+    "possessive": "possessive",
+    "conjunction usage": "conjunction",
+    "colloquial → standard": "colloquialism",
+    "spelling/word form": "orthography",
+    "lexical/word choice": "lexical",
+    "grammar/word choice": "grammar",
+}
+
+def reason_to_pos(reason: str) -> str | None:
+    return _REASON_TO_POS.get(reason)
+
+# ---------------- Turn analysis ----------------
+
+class TextAnalysis:
+    """One text, tokenized and split into sentences once."""
+
+    __slots__ = ("text", "tokens", "sentence_count", "norm")
+
+    def __init__(self, text: str):
+        self.text = text or ""
+        self.tokens = word_tokens(self.text)
+        self.sentence_count = len(sentences(self.text))
+        self.norm = normalize_txt(self.text)
+
+
+class TurnAnalysis:
+    """
+    A (user_text, corrected) pair diffed once. The rerun guardrail, the
+    Issues & Fixes bullets, POS aggregation and the dataset row all read
+    from the same instance. Pass a TextAnalysis to share the user side
+    between the standard and the minimal pass.
+    """
+
+    def __init__(self, source: Union[TextAnalysis, str], corrected: str, max_bullets: int = MAX_BULLETS):
+        self.source = source if isinstance(source, TextAnalysis) else TextAnalysis(source)
+        self.target = TextAnalysis(corrected)
+        self.max_bullets = max_bullets
+
+    @property
+    def user_text(self) -> str:
+        return self.source.text
+
+    @property
+    def corrected(self) -> str:
+        return self.target.text
+
+    @property
+    def unchanged(self) -> bool:
+        return self.source.norm == self.target.norm
+
+    @property
+    def sentence_changed(self) -> bool:
+        return self.source.sentence_count != self.target.sentence_count
+
+    @cached_property
+    def alignment(self) -> Alignment:
+        return align(self.source.tokens, self.target.tokens)
+
+    @property
+    def opcodes(self) -> list:
+        return self.alignment.opcodes
+
+    @cached_property
+    def change_ratio(self) -> float:
+        """Fraction of tokens that changed, from the same alignment as the ops."""
+        return self.alignment.change_ratio
+
+    @cached_property
+    def _spans(self) -> List[Tuple[str, str, str, int, int, int, int]]:
+        a, b = self.source.tokens, self.target.tokens
+        spans = []
+        for tag, i1, i2, j1, j2 in self.opcodes:
+            if tag == "equal":
+                continue
+            src_span = " ".join(a[i1:i2]).strip() if tag != "insert" else ""
+            dst_span = " ".join(b[j1:j2]).strip() if tag != "delete" else ""
+            spans.append((tag, src_span, dst_span, i1, i2, j1, j2))
+        return spans
+
+    @property
+    def ops(self) -> List[Tuple[str, str, str]]:
+        """Non-equal opcodes as (op, before span, after span)."""
+        return [span[:3] for span in self._spans]
+
+    @cached_property
+    def edits(self) -> List["CorrectionOp"]:
+        """Labelled edits, capped at max_bullets. Everything user-facing is rendered from these."""
+        edits = []
+        for op, before, after, i1, i2, j1, j2 in self._spans:
+            if op == "replace" and normalize_txt(before) == normalize_txt(after):
+                continue
+            reason = guess_reason(before, after)
+            edits.append(CorrectionOp(op, before, after, reason, reason_to_pos(reason), i1, i2, j1, j2))
+            if len(edits) >= self.max_bullets:
+                break
+        return edits
+
+    def bullets(self) -> list[str]:
+        return [edit.bullet() for edit in self.edits]
+
+    def pos_counts(self) -> Counter:
+        return Counter(edit.pos for edit in self.edits if edit.pos)
+
+
+class CorrectionOp(NamedTuple):
+    """One labelled edit between user_text and corrected (token offsets, end-exclusive)."""
+
+    op: str              # replace | delete | insert
+    before: str          # "" for insert
+    after: str           # "" for delete
+    reason: str
+    pos: Optional[str]   # coarse POS bucket for analytics, None if unmapped
+    src_start: int
+    src_end: int
+    dst_start: int
+    dst_end: int
+
+    def bullet(self) -> str:
+        if self.op == "delete":
+            return f"- **{self.before} → (removed)** — {self.reason}"
+        if self.op == "insert":
+            return f"- **(missing) → {self.after}** — {self.reason}"
+        return f"- **{self.before} → {self.after}** — {self.reason}"
+
+
+def ops_payload(edits: List[CorrectionOp]) -> List[Dict[str, Any]]:
+    return [edit._asdict() for edit in edits]
+
+
+def corrections_markdown(corrected: str, bullets: list[str]) -> str:
+    fixes = "\n".join(bullets) if bullets else "- No corrections needed."
+    return f"#### Corrected version\n\n{corrected}\n\n#### Issues & Fixes\n\n{fixes}"
+
+# ---------------- Tiny context builder for replies ----------------
+
+CONTEXT_LINE_CHARS = 120
+
+def ellipsize(s: str, n: int) -> str:
+    s = (s or "").strip().replace("\n", " ")
+    return (s[:n-1] + "…") if len(s) > n else s
+
+def context_line(role: str, text: str) -> str:
+    """One history message as it appears in the reply prompt; "" for unknown roles."""
+    role = (role or "").strip().lower()
+    if role == "user":
+        return f"U: {ellipsize(text, CONTEXT_LINE_CHARS)}"
+    if role == "assistant":
+        return f"A: {ellipsize(text, CONTEXT_LINE_CHARS)}"
+    return ""
+
+def join_context(lines: Iterable[str], max_chars: int = 600) -> str:
+    ctx = "\n".join(line for line in lines if line).strip()
+    if len(ctx) > max_chars:
+        ctx = ctx[-max_chars:]
+    return ctx
+
+def summary_context(summary: str, lines: Iterable[str], max_chars: int = 600) -> str:
+    """The summary line always survives; the recent lines fill what is left of max_chars."""
+    head = f"Summary: {summary}"
+    budget = max_chars - len(head) - 1
+    recent = join_context(lines, budget) if budget > 0 else ""
+    return f"{head}\n{recent}" if recent else head
+
+def build_brief_context(history: list[dict], max_pairs: int = 6, max_chars: int = 600) -> str:
+    # SessionMem.context keeps the same string up to date turn by turn
+    if not history:
+        return ""
+    recent = history[-(max_pairs*2):]
+    return join_context((context_line(turn.get("role", ""), turn.get("text", "")) for turn in recent), max_chars)
+
+# ---------------- Model-authored markdown (legacy path) ----------------
+
+def filter_bullets_with_diffs(bullets: list[str], analysis: TurnAnalysis) -> list[str]:
+    diffs = [(normalize_txt(before), normalize_txt(after)) for _, before, after in analysis.ops]
+
+    def matches_any_diff(b):
+        m = _BULLET_SPAN_RE.search(b)
+        if not m:
+            return False
+        return (normalize_txt(m.group(1).strip()), normalize_txt(m.group(2).strip())) in diffs
+
+    return [b for b in bullets if matches_any_diff(b)]
+
+def sanitize_corrections_md(corrections_md: str, user_text: str) -> str:
+    """
+    (Kept if you ever feed model's own markdown. Currently we build bullets locally.)
+    """
+    corrected, bullets = extract_corrected_and_bullets(corrections_md)
+    corrected = corrected.strip()
+    user_norm = normalize_txt(user_text)
+    corr_norm = normalize_txt(corrected)
+
+    if corrected and corr_norm == user_norm:
+        return "Corrected version:\n" + corrected + "\n\nIssues & fixes:\n- No corrections needed."
+
+    if not corrected:
+        corrected = user_text
+
+    analysis = TurnAnalysis(user_text, corrected)
+    bullets = filter_bullets_with_diffs(bullets, analysis)
+    if not bullets:
+        bullets = analysis.bullets()
+    if not bullets:
+        return "Corrected version:\n" + corrected + "\n\nIssues & fixes:\n- No corrections needed."
+
+    return "Corrected version:\n" + corrected + "\n\nIssues & fixes:\n" + "\n".join(bullets)
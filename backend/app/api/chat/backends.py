@@ -0,0 +1,190 @@
+# backends.py (pool of Ollama backends with least-outstanding-requests routing)
+import asyncio
+import hashlib
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+
+
+class LLMUnavailable(Exception):
+    """Raised when no Ollama backend can take the request (all circuits open)."""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMDeadlineExceeded(Exception):
+    """Raised when an upstream call runs past the deadline set by the route handler."""
+
+
+# Circuit breaker states
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class Backend:
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0           # queued + running requests routed here
+        self.healthy = True            # last health check result
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0       # circuit open until (monotonic)
+        self.opens = 0                 # consecutive times the circuit opened (backoff)
+        self.probe_in_flight = False   # half-open: only one trial request at a time
+        self.requests = 0
+        self.failures = 0
+        self.last_check_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.ejects_skipped = 0        # circuit kept closed: it was the last backend serving
+
+    def state(self, now: float) -> str:
+        if self.ejected_until > now:
+            return OPEN
+        return HALF_OPEN if self.opens else CLOSED
+
+    def available(self, now: float) -> bool:
+        if not self.healthy:
+            return False
+        state = self.state(now)
+        return state == CLOSED or (state == HALF_OPEN and not self.probe_in_flight)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            "healthy": self.healthy,
+            "available": self.available(now),
+            "circuit": self.state(now),
+            "ejected_for_s": round(max(0.0, self.ejected_until - now), 1),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_check_at": self.last_check_at,
+            "last_error": self.last_error,
+            "ejects_skipped": self.ejects_skipped,
+        }
+
+
+def _is_backend_failure(exc: BaseException) -> bool:
+    # Connection errors, httpx timeouts and 5xx count against the backend; 4xx
+    # are our fault, and a turn deadline running out says nothing about its health
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+
+class BackendPool:
+    def __init__(
+        self,
+        urls: Iterable[str],
+        eject_after_failures: int = 3,
+        eject_s: float = 30.0,
+        max_eject_s: float = 300.0,
+        sticky: bool = False,
+        sticky_slack: int = 2,
+    ):
+        self.backends: List[Backend] = [Backend(u) for u in urls if u.strip()]
+        if not self.backends:
+            raise ValueError("BackendPool needs at least one URL")
+        self.eject_after_failures = max(1, eject_after_failures)
+        self.eject_s = eject_s
+        self.max_eject_s = max(eject_s, max_eject_s)
+        self.sticky = sticky
+        self.sticky_slack = sticky_slack
+
+    # ---- routing ----
+
+    def pick(self, session_key: Optional[str] = None, exclude: Iterable[Backend] = ()) -> Backend:
+        now = time.monotonic()
+        excluded = set(id(b) for b in exclude)
+        candidates = [b for b in self.backends if b.available(now) and id(b) not in excluded]
+        if not candidates:
+            # Fail fast instead of queueing on a sick backend
+            raise LLMUnavailable(
+                "no healthy Ollama backend available (circuit open)",
+                retry_after=self._retry_after(now),
+            )
+
+        least = min(candidates, key=lambda b: b.outstanding)
+        if self.sticky and session_key:
+            # Rendezvous hashing keeps a session on one backend (KV-cache locality)
+            # unless that backend is clearly busier than the least loaded one.
+            home = max(candidates, key=lambda b: _hrw_score(session_key, b.url))
+            if home.outstanding <= least.outstanding + self.sticky_slack:
+                return home
+        return least
+
+    def _retry_after(self, now: float) -> int:
+        reopen = [b.ejected_until - now for b in self.backends if b.ejected_until > now]
+        return max(1, math.ceil(min(reopen))) if reopen else 1
+
+    @asynccontextmanager
+    async def track(self, backend: Backend):
+        probe = backend.state(time.monotonic()) == HALF_OPEN
+        if probe:
+            backend.probe_in_flight = True
+        backend.outstanding += 1
+        backend.requests += 1
+        try:
+            yield backend
+        except BaseException as e:
+            if _is_backend_failure(e):
+                self.record_failure(backend, repr(e), probe)
+            raise
+        else:
+            self.record_success(backend)
+        finally:
+            backend.outstanding -= 1
+            if probe:
+                backend.probe_in_flight = False
+
+    def record_success(self, backend: Backend) -> None:
+        backend.consecutive_failures = 0
+        backend.opens = 0  # closes a half-open circuit
+
+    def record_failure(self, backend: Backend, error: str, probe: bool = False) -> None:
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        backend.last_error = error
+        if probe or backend.consecutive_failures >= self.eject_after_failures:
+            now = time.monotonic()
+            if not any(b is not backend and b.healthy and b.state(now) != OPEN for b in self.backends):
+                # Never eject the last backend that can still serve: failing
+                # requests beat a pool that rejects everything with 503
+                backend.ejects_skipped += 1
+                return
+            # Open (or re-open) the circuit with exponential backoff
+            backend.opens += 1
+            eject_s = min(self.max_eject_s, self.eject_s * (2 ** (backend.opens - 1)))
+            backend.ejected_until = now + eject_s
+
+    # ---- health checks ----
+
+    async def check(self, client: httpx.AsyncClient, backend: Backend, timeout_s: float = 3.0) -> bool:
+        try:
+            resp = await client.get(f"{backend.url}/api/tags", timeout=timeout_s)
+            resp.raise_for_status()
+        except Exception as e:
+            backend.healthy = False
+            backend.last_error = f"health check failed: {e!r}"
+        else:
+            # Reachability only; the circuit closes on a successful real request
+            backend.healthy = True
+        backend.last_check_at = time.time()
+        return backend.healthy
+
+    async def check_all(self, client: httpx.AsyncClient) -> None:
+        await asyncio.gather(*(self.check(client, b) for b in self.backends))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sticky_sessions": self.sticky,
+            "backends": {b.url: b.stats() for b in self.backends},
+        }
+
+
+def _hrw_score(key: str, url: str) -> int:
+    return int.from_bytes(hashlib.blake2b(f"{key}|{url}".encode("utf-8"), digest_size=8).digest(), "big")
@@ -2,7 +2,113 @@
 import os
 
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+# Comma-separated pool of Ollama backends; defaults to the single OLLAMA_URL
+OLLAMA_URLS = [u.strip() for u in os.getenv("OLLAMA_URLS", OLLAMA_URL).split(",") if u.strip()]
+OLLAMA_HEALTH_INTERVAL_S = float(os.getenv("OLLAMA_HEALTH_INTERVAL_S", "10"))
+OLLAMA_EJECT_AFTER_FAILURES = int(os.getenv("OLLAMA_EJECT_AFTER_FAILURES", "3"))
+OLLAMA_EJECT_S = float(os.getenv("OLLAMA_EJECT_S", "30"))
+OLLAMA_STICKY_SESSIONS = os.getenv("OLLAMA_STICKY_SESSIONS", "0") == "1"
+OLLAMA_STICKY_SLACK = int(os.getenv("OLLAMA_STICKY_SLACK", "2"))
+OLLAMA_CONNECT_TIMEOUT_S = float(os.getenv("OLLAMA_CONNECT_TIMEOUT_S", "5"))
+OLLAMA_MAX_EJECT_S = float(os.getenv("OLLAMA_MAX_EJECT_S", "300"))
+# Hedge a call to a second backend after its p95 latency (needs >1 backend)
+LLM_HEDGING = os.getenv("LLM_HEDGING", "1") == "1"
+# Upper bound on one chat turn (correction + reply); 0 disables deadlines
+CHAT_TURN_DEADLINE_S = float(os.getenv("CHAT_TURN_DEADLINE_S", "60"))
 LLM_MODEL = os.getenv("LLM_MODEL", "llama3.2:3b")
 
+# Model residency: keep_alive sent with every request, startup warmup, and a
+# background ping during LLM_KEEPALIVE_HOURS (e.g. "7-23"; empty = always)
+LLM_KEEP_ALIVE = os.getenv("LLM_KEEP_ALIVE", "30m")
+LLM_WARMUP = os.getenv("LLM_WARMUP", "1") == "1"
+LLM_KEEPALIVE_INTERVAL_S = float(os.getenv("LLM_KEEPALIVE_INTERVAL_S", "240"))
+LLM_KEEPALIVE_HOURS = os.getenv("LLM_KEEPALIVE_HOURS", "")
+
+# Shared HTTP client pool (one per process, opened in the app lifespan)
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "32"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "16"))
+OLLAMA_KEEPALIVE_EXPIRY_S = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY_S", "60"))
+
+# Admission control per backend (see scheduler.py)
+OLLAMA_MAX_CONCURRENCY = int(os.getenv("OLLAMA_MAX_CONCURRENCY", "4"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_MAX_QUEUE_WAIT_S = float(os.getenv("LLM_MAX_QUEUE_WAIT_S", "10"))
+
+# Share one upstream generation between identical in-flight requests
+LLM_SINGLEFLIGHT = os.getenv("LLM_SINGLEFLIGHT", "1") == "1"
+
+# Correction cache (keyed on normalized text, strictness tier, mode, model)
+CORRECTION_CACHE_SIZE = int(os.getenv("CORRECTION_CACHE_SIZE", "2048"))
+CORRECTION_CACHE_TTL_S = float(os.getenv("CORRECTION_CACHE_TTL_S", "3600"))
+
+# LRU of reason labels per (before, after) diff op; 0 disables it
+GRAMMAR_LABEL_CACHE_SIZE = int(os.getenv("GRAMMAR_LABEL_CACHE_SIZE", "4096"))
+
+# Generate the reply alongside the correction (it never reads the correction)
+CHAT_CONCURRENT_REPLY = os.getenv("CHAT_CONCURRENT_REPLY", "1") == "1"
+
+# Overlapping turns for one session: "cancel" the running one (and its upstream
+# requests), "queue" behind it, or "off" to let them run side by side
+CHAT_TURN_POLICY = os.getenv("CHAT_TURN_POLICY", "cancel")
+
+# Include the structured correction ops next to corrections_md (/chat and corrections_done)
+CHAT_STRUCTURED_OPS = os.getenv("CHAT_STRUCTURED_OPS", "1") == "1"
+
+# /stream merges consecutive deltas into one SSE event per flush window
+SSE_FLUSH_MS = float(os.getenv("SSE_FLUSH_MS", "30"))
+SSE_FLUSH_MAX_CHARS = int(os.getenv("SSE_FLUSH_MAX_CHARS", "512"))
+
+# Start the mode="minimal" correction alongside the standard one when a rerun looks likely
+SPECULATIVE_MINIMAL = os.getenv("SPECULATIVE_MINIMAL", "1") == "1"
+SPECULATIVE_MIN_TOKENS = int(os.getenv("SPECULATIVE_MIN_TOKENS", "30"))
+SPECULATIVE_RERUN_RATE = float(os.getenv("SPECULATIVE_RERUN_RATE", "0.5"))
+
 DATASET_DIR = os.getenv("DATASET_DIR", "dataset")
 os.makedirs(DATASET_DIR, exist_ok=True)
+# Dataset rows are written behind the request: a bounded queue (full = row
+# dropped), batches flushed every DATASET_FLUSH_MS or DATASET_FLUSH_BYTES,
+# an LRU of open files, and fsync on every "flush", on "close", or "never"
+DATASET_QUEUE_SIZE = int(os.getenv("DATASET_QUEUE_SIZE", "10000"))
+DATASET_FLUSH_MS = float(os.getenv("DATASET_FLUSH_MS", "1000"))
+DATASET_FLUSH_BYTES = int(os.getenv("DATASET_FLUSH_BYTES", "65536"))
+DATASET_MAX_OPEN_FILES = int(os.getenv("DATASET_MAX_OPEN_FILES", "64"))
+DATASET_FSYNC = os.getenv("DATASET_FSYNC", "close")
+# "sessions": one session-<id>.jsonl per session; "shards": the writer appends
+# straight into compressed daily shards (see shards.py, which also compacts)
+DATASET_LAYOUT = os.getenv("DATASET_LAYOUT", "sessions")
+DATASET_SHARD_DIR = os.getenv("DATASET_SHARD_DIR", os.path.join(DATASET_DIR, "shards"))
+DATASET_SHARD_MAX_BYTES = int(os.getenv("DATASET_SHARD_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Correction memory built offline from the dataset (python -m app.api.chat.correction_memory build);
+# empty path disables it. Only exact hits are served unless CORRECTION_MEMORY_NEAR=1; near-duplicates
+# need a fuzz.ratio of at least CORRECTION_MEMORY_MIN_SCORE and the same tokens as the remembered text.
+# The file is re-read every CORRECTION_MEMORY_RELOAD_S when it changes (0: load once at startup)
+CORRECTION_MEMORY_PATH = os.getenv("CORRECTION_MEMORY_PATH", os.path.join(DATASET_DIR, "correction_memory.msgpack"))
+CORRECTION_MEMORY_NEAR = os.getenv("CORRECTION_MEMORY_NEAR", "0") == "1"
+CORRECTION_MEMORY_MIN_SCORE = float(os.getenv("CORRECTION_MEMORY_MIN_SCORE", "92"))
+CORRECTION_MEMORY_RELOAD_S = float(os.getenv("CORRECTION_MEMORY_RELOAD_S", "30"))
+
+# In-memory sessions: idle and absolute expiry (0 disables), a background
+# sweep, and an LRU cap on live sessions; evicted ones are marked ended
+SESSION_IDLE_TTL_S = float(os.getenv("SESSION_IDLE_TTL_S", "3600"))
+SESSION_MAX_AGE_S = float(os.getenv("SESSION_MAX_AGE_S", "86400"))
+SESSION_SWEEP_INTERVAL_S = float(os.getenv("SESSION_SWEEP_INTERVAL_S", "60"))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "5000"))
+# memory: this process only; sqlite: one WAL-mode file shared by every worker on the host
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+# How long a statement waits on another worker's write lock (it runs on the session-db thread)
+SESSION_DB_BUSY_TIMEOUT_S = float(os.getenv("SESSION_DB_BUSY_TIMEOUT_S", "1.0"))
+
+# Reply-prompt context: the last CHAT_CONTEXT_PAIRS exchanges, capped at
+# CHAT_CONTEXT_MAX_CHARS; a session keeps only the messages that can reach it
+CHAT_CONTEXT_PAIRS = int(os.getenv("CHAT_CONTEXT_PAIRS", "6"))
+CHAT_CONTEXT_MAX_CHARS = int(os.getenv("CHAT_CONTEXT_MAX_CHARS", "600"))
+# Rolling summary (CHAT_SUMMARY_EVERY=0 disables it): once CHAT_SUMMARY_EVERY
+# more exchanges have scrolled past the last CHAT_SUMMARY_KEEP_PAIRS, a
+# background low-priority call folds them into a summary of at most
+# CHAT_SUMMARY_MAX_CHARS; the context is then summary + the unfolded turns,
+# still within CHAT_CONTEXT_MAX_CHARS
+CHAT_SUMMARY_EVERY = int(os.getenv("CHAT_SUMMARY_EVERY", "0"))
+CHAT_SUMMARY_KEEP_PAIRS = int(os.getenv("CHAT_SUMMARY_KEEP_PAIRS", "2"))
+CHAT_SUMMARY_MAX_CHARS = int(os.getenv("CHAT_SUMMARY_MAX_CHARS", "240"))
@@ -0,0 +1,330 @@
+# correction_memory.py (corrections remembered from the dataset, exact and near-duplicate)
+#
+#   cd backend
+#   python -m app.api.chat.correction_memory build [--min-count 1]
+#   python -m app.api.chat.correction_memory lookup --text "I go to school yesterday." [--strictness 0.5]
+#   python -m app.api.chat.correction_memory stats
+#
+# build reads every (user_text, corrected) row in DATASET_DIR (shards and
+# session files), keeps the majority correction per (whitespace-normalized
+# text, strictness tier) and writes one msgpack file atomically. The server
+# loads it at startup and re-reads it when the file changes.
+#
+# Near-duplicates (CORRECTION_MEMORY_NEAR=1, off by default) are looked up
+# through an inverted index of lowercased tokens (candidates share the
+# query's rarest tokens) and scored with fuzz.ratio. A near match is served
+# only when the query has exactly the source's tokens (it differs in spacing
+# around punctuation, say); the recorded edits are then replayed onto the
+# query's own text. A query with any token added, dropped or changed is a
+# miss: nothing says the recorded correction covers the words that differ.
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import msgpack
+from rapidfuzz import fuzz, process
+
+from services.alignment import align
+
+from .analysis import token_spans, word_tokens
+from .keys import normalize_for_cache, strictness_bucket
+from .config import (
+    CORRECTION_MEMORY_MIN_SCORE,
+    CORRECTION_MEMORY_NEAR,
+    CORRECTION_MEMORY_PATH,
+    CORRECTION_MEMORY_RELOAD_S,
+    DATASET_DIR,
+    DATASET_SHARD_DIR,
+)
+from .shards import iter_dataset
+
+_log = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+RAREST_TOKENS = 3       # posting lists consulted per query
+MAX_CANDIDATES = 256    # texts scored per query
+
+
+def _deep_size(obj: Any, seen: Optional[set] = None) -> int:
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_deep_size(x, seen) for x in obj)
+    return size
+
+
+class CorrectionMemory:
+    """One loaded memory file; immutable, swapped whole on reload."""
+
+    def __init__(self, data: Dict[str, Any]):
+        if data.get("v") != FORMAT_VERSION:
+            raise ValueError(f"unsupported correction memory version {data.get('v')!r}")
+        self.built_at: float = data.get("built_at", 0.0)
+        self.entries: List[Tuple[str, int, str, int]] = [tuple(e) for e in data["entries"]]
+        self.exact: Dict[Tuple[str, int], str] = {}
+        self.lowered: List[str] = []
+        self.postings: Dict[Tuple[int, str], List[int]] = {}
+        for i, (text, tier, corrected, _count) in enumerate(self.entries):
+            self.exact[(text, tier)] = corrected
+            low = text.lower()
+            self.lowered.append(low)
+            for tok in set(word_tokens(low)):
+                self.postings.setdefault((tier, tok), []).append(i)
+        self.approx_bytes = _deep_size(
+            (self.entries, self.exact, self.lowered, self.postings)
+        )
+
+    def near(self, text: str, tier: int, min_score: float) -> Optional[Tuple[int, float]]:
+        """Best entry (index, score) in the same tier scoring at least min_score."""
+        low = text.lower()
+        lists = sorted(
+            (p for p in (self.postings.get((tier, tok)) for tok in set(word_tokens(low))) if p),
+            key=len,
+        )
+        candidates: Dict[int, str] = {}
+        for ids in lists[:RAREST_TOKENS]:
+            for i in ids[:MAX_CANDIDATES - len(candidates)]:
+                candidates.setdefault(i, self.lowered[i])
+        if not candidates:
+            return None
+        best = process.extractOne(low, candidates, scorer=fuzz.ratio, score_cutoff=min_score)
+        return None if best is None else (best[2], best[1])
+
+    def transplant(self, text: str, i: int) -> Optional[str]:
+        """Entry i's edits applied to text, or None when they cannot be carried over safely."""
+        source, _tier, corrected, _count = self.entries[i]
+        a, c, q = token_spans(source), token_spans(corrected), token_spans(text)
+        a_toks, c_toks, q_toks = [t for t, _, _ in a], [t for t, _, _ in c], [t for t, _, _ in q]
+
+        # Any token the two texts do not share may be an error the recorded edits never saw
+        if q_toks != a_toks:
+            return None
+
+        patches = []
+        for tag, i1, i2, j1, j2 in align(a_toks, c_toks).opcodes:
+            if tag == "equal":
+                continue
+            # Same tokens, so source offsets are query offsets: swap the text between the edit's
+            # neighbouring tokens for the corrected text between the same neighbours
+            q_from = q[i1 - 1][2] if i1 > 0 else 0
+            q_to = q[i2][1] if i2 < len(q_toks) else len(text)
+            c_from = c[j1 - 1][2] if j1 > 0 else 0
+            c_to = c[j2][1] if j2 < len(c_toks) else len(corrected)
+            patches.append((q_from, q_to, corrected[c_from:c_to]))
+
+        out = text
+        for q_from, q_to, repl in reversed(patches):
+            out = out[:q_from] + repl + out[q_to:]
+        return out
+
+
+# ---- Build ----
+
+def build(
+    rows: Iterable[Dict[str, Any]], path: str = CORRECTION_MEMORY_PATH, min_count: int = 1,
+) -> Dict[str, Any]:
+    """Majority correction per (text, tier); ties and minority answers are left to the LLM."""
+    answers: Dict[Tuple[str, int], Counter] = {}
+    stats: Counter = Counter()
+    for row in rows:
+        user_text, corrected = row.get("user_text"), (row.get("corrected") or "").strip()
+        stats["rows"] += 1
+        if not user_text or not corrected:
+            stats["skipped"] += 1
+            continue
+        key = (normalize_for_cache(user_text), strictness_bucket(float(row.get("strictness") or 0.0)))
+        answers.setdefault(key, Counter())[corrected] += 1
+
+    entries: List[Tuple[str, int, str, int]] = []
+    for (text, tier), counts in answers.items():
+        (corrected, n), total = counts.most_common(1)[0], sum(counts.values())
+        if n < min_count or n * 2 <= total:
+            stats["ambiguous" if n * 2 <= total else "too_rare"] += 1
+            continue
+        entries.append((text, tier, corrected, n))
+
+    data = {
+        "v": FORMAT_VERSION, "built_at": time.time(), "rows": stats["rows"],
+        "entries": entries,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(msgpack.packb(data, use_bin_type=True))
+        f.flush()
+        os.fsync(f.fileno())
+    # Atomic swap: a reloading server sees the old file or the new one, never half of one
+    os.replace(tmp, path)
+    return {**stats, "texts": len(answers), "entries": len(entries), "bytes": os.path.getsize(path)}
+
+
+def load(path: str) -> CorrectionMemory:
+    with open(path, "rb") as f:
+        return CorrectionMemory(msgpack.unpackb(f.read(), raw=False, strict_map_key=False))
+
+
+# ---- Serving ----
+
+_memory: Optional[CorrectionMemory] = None
+_loaded: Optional[Tuple[int, int]] = None   # (mtime_ns, size) of the loaded file
+_loaded_at = 0.0
+_generation = 0
+_STATS: Counter = Counter()
+_watcher: Optional[asyncio.Task] = None
+
+
+def lookup(
+    text: str, tier: int, min_score: float = CORRECTION_MEMORY_MIN_SCORE, near: bool = CORRECTION_MEMORY_NEAR,
+) -> Optional[str]:
+    """text is the correction-cache key text (whitespace-normalized)."""
+    memory = _memory
+    if memory is None:
+        return None
+    corrected = memory.exact.get((text, tier))
+    if corrected is not None:
+        _STATS["exact_hits"] += 1
+        return corrected
+    match = memory.near(text, tier, min_score) if near else None
+    if match is not None:
+        corrected = memory.transplant(text, match[0])
+        if corrected is not None:
+            _STATS["near_hits"] += 1
+            return corrected
+        _STATS["near_rejected"] += 1
+    _STATS["misses"] += 1
+    return None
+
+
+def generation() -> int:
+    """Changes whenever a different memory is served (including none)."""
+    return _generation
+
+
+def _file_state(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+async def reload(path: str = CORRECTION_MEMORY_PATH) -> bool:
+    """Loads the file if it changed since the last load; a missing file disables the memory."""
+    global _memory, _loaded, _loaded_at, _generation
+    state = _file_state(path) if path else None
+    if state == _loaded:
+        return False
+    if state is None:
+        _memory, _loaded = None, None
+        _generation += 1
+        return True
+    try:
+        memory = await asyncio.to_thread(load, path)
+    except (OSError, ValueError, KeyError, TypeError, msgpack.UnpackException):
+        # Keep serving the previous memory; a half-copied file is retried on the next pass
+        _STATS["load_errors"] += 1
+        _log.exception("correction memory load failed: %s", path)
+        return False
+    _memory, _loaded, _loaded_at = memory, state, time.time()
+    _generation += 1
+    _STATS["loads"] += 1
+    return True
+
+
+async def _watch_loop() -> None:
+    while True:
+        await asyncio.sleep(CORRECTION_MEMORY_RELOAD_S)
+        await reload()
+
+
+async def startup() -> None:
+    global _watcher
+    if not CORRECTION_MEMORY_PATH:
+        return
+    await reload()
+    if CORRECTION_MEMORY_RELOAD_S > 0 and (_watcher is None or _watcher.done()):
+        _watcher = asyncio.create_task(_watch_loop())
+
+
+async def shutdown() -> None:
+    global _watcher
+    if _watcher is not None:
+        _watcher.cancel()
+        await asyncio.gather(_watcher, return_exceptions=True)
+        _watcher = None
+
+
+def memory_stats() -> Dict[str, Any]:
+    memory = _memory
+    return {
+        "path": CORRECTION_MEMORY_PATH,
+        "loaded": memory is not None,
+        "entries": len(memory.entries) if memory else 0,
+        "index_tokens": len(memory.postings) if memory else 0,
+        "approx_bytes": memory.approx_bytes if memory else 0,
+        "file_bytes": _loaded[1] if _loaded else 0,
+        "built_at": memory.built_at if memory else None,
+        "loaded_at": _loaded_at or None,
+        "near": CORRECTION_MEMORY_NEAR,
+        "min_score": CORRECTION_MEMORY_MIN_SCORE,
+        **_STATS,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Build and query the correction memory")
+    parser.add_argument("--path", default=CORRECTION_MEMORY_PATH)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("build", help="rebuild the memory from the dataset")
+    p.add_argument("--dataset", default=DATASET_DIR)
+    p.add_argument("--shards", default=DATASET_SHARD_DIR)
+    p.add_argument("--min-count", type=int, default=1, help="times a correction must have been served")
+
+    p = sub.add_parser("lookup", help="show what the memory returns for a text")
+    p.add_argument("--text", required=True)
+    p.add_argument("--strictness", type=float, default=0.5)
+    p.add_argument("--min-score", type=float, default=CORRECTION_MEMORY_MIN_SCORE)
+
+    sub.add_parser("stats", help="summarize the memory file")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "build":
+        start = time.perf_counter()
+        stats = build(iter_dataset(args.dataset, args.shards), args.path, args.min_count)
+        print(json.dumps({**stats, "seconds": round(time.perf_counter() - start, 2)}))
+        return 0
+
+    memory = load(args.path)
+    if args.cmd == "lookup":
+        text, tier = normalize_for_cache(args.text), strictness_bucket(args.strictness)
+        out: Dict[str, Any] = {"exact": memory.exact.get((text, tier))}
+        match = memory.near(text, tier, args.min_score)
+        if match is not None:
+            out.update(near=memory.entries[match[0]][0], score=round(match[1], 1),
+                       transplanted=memory.transplant(text, match[0]))
+        print(json.dumps(out, ensure_ascii=False))
+    else:
+        print(json.dumps({
+            "entries": len(memory.entries),
+            "index_tokens": len(memory.postings),
+            "approx_bytes": memory.approx_bytes,
+            "file_bytes": os.path.getsize(args.path),
+            "built_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(memory.built_at)),
+        }))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
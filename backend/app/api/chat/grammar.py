@@ -0,0 +1,352 @@
+# grammar.py (rule-based reason labels for correction diffs)
+import difflib
+import re
+from typing import Any, Dict, FrozenSet, Tuple
+
+from .cache import TTLCache
+from .config import GRAMMAR_LABEL_CACHE_SIZE
+
+# ---- lexicon tables ----
+
+_CONTRACTIONS = {
+    "i'm": "i am", "you're": "you are", "we're": "we are", "they're": "they are",
+    "he's": "he is", "she's": "she is", "it's": "it is", "it’s": "it is",
+    "i've": "i have", "you've": "you have", "we've": "we have", "they've": "they have",
+    "i'd": "i would", "you'd": "you would", "he'd": "he would", "she'd": "she would", "we'd": "we would", "they'd": "they would",
+    "i'll": "i will", "you'll": "you will", "he'll": "he will", "she'll": "she will", "we'll": "we will", "they'll": "they will",
+    "can't": "cannot", "won't": "will not", "don't": "do not", "doesn't": "does not", "didn't": "did not",
+    "isn't": "is not", "aren't": "are not", "wasn't": "was not", "weren't": "were not",
+    "shouldn't": "should not", "wouldn't": "would not", "couldn't": "could not",
+    "let's": "let us",
+}
+
+_IRREGULAR_PAST = {
+    "be": "was", "am": "was", "is": "was", "are": "were",
+    "begin": "began", "break": "broke", "bring": "brought", "build": "built",
+    "buy": "bought", "catch": "caught", "choose": "chose", "come": "came",
+    "cost": "cost", "cut": "cut", "do": "did", "draw": "drew",
+    "drink": "drank", "drive": "drove", "eat": "ate", "fall": "fell",
+    "feel": "felt", "fight": "fought", "find": "found", "fly": "flew",
+    "forget": "forgot", "forgive": "forgave", "get": "got", "give": "gave",
+    "go": "went", "grow": "grew", "have": "had", "hear": "heard",
+    "hold": "held", "keep": "kept", "know": "knew", "lay": "laid",
+    "lead": "led", "leave": "left", "lend": "lent", "let": "let",
+    "lose": "lost", "make": "made", "mean": "meant", "meet": "met",
+    "pay": "paid", "put": "put", "read": "read", "ride": "rode",
+    "ring": "rang", "rise": "rose", "run": "ran", "say": "said",
+    "see": "saw", "sell": "sold", "send": "sent", "set": "set",
+    "shake": "shook", "shine": "shone", "shoot": "shot", "show": "showed",
+    "sing": "sang", "sit": "sat", "sleep": "slept", "speak": "spoke",
+    "spend": "spent", "stand": "stood", "swim": "swam", "take": "took",
+    "teach": "taught", "tear": "tore", "tell": "told", "think": "thought",
+    "throw": "threw", "understand": "understood", "wear": "wore",
+    "win": "won", "write": "wrote", "bite": "bit", "blow": "blew",
+    "feed": "fed", "hang": "hung", "hide": "hid", "lie": "lay",
+    "light": "lit", "seek": "sought", "slide": "slid", "spoil": "spoilt",
+    "steal": "stole", "stick": "stuck", "sweep": "swept", "swing": "swung",
+    "arise": "arose", "bear": "bore", "bend": "bent", "bet": "bet",
+    "bleed": "bled", "breed": "bred", "burst": "burst", "creep": "crept",
+    "deal": "dealt", "dig": "dug", "freeze": "froze", "forbid": "forbade",
+    "hurt": "hurt", "kneel": "knelt", "lean": "leant", "smell": "smelt",
+    "sting": "stung", "strike": "struck", "swear": "swore", "wake": "woke",
+    "weave": "wove", "weep": "wept", "bind": "bound", "burn": "burnt",
+    "broadcast": "broadcast", "fit": "fit", "hit": "hit", "quit": "quit",
+    "shut": "shut", "spread": "spread", "split": "split", "upset": "upset",
+}
+
+
+_COLLOQUIAL = {
+    "gonna": "going to", "wanna": "want to", "gotta": "have to",
+    "kinda": "kind of", "sorta": "sort of", "lemme": "let me",
+}
+
+_IRREGULAR_ADJ = {
+    "good": ("better", "best"),
+    "well": ("better", "best"),
+    "bad": ("worse", "worst"),
+    "far": ("farther", "farthest"),
+    "further": ("further", "furthest"),
+    "little": ("less", "least"),
+    "few": ("fewer", "fewest"),
+    "many": ("more", "most"),
+    "much": ("more", "most"),
+    "late": ("later", "latest"),
+    "old": ("older", "oldest"),
+    "ill": ("worse", "worst"),
+    "fun": ("more fun", "most fun"),
+    "near": ("nearer", "nearest"),
+    "friendly": ("friendlier", "friendliest"),
+    "simple": ("simpler", "simplest"),
+    "gentle": ("gentler", "gentlest"),
+    "narrow": ("narrower", "narrowest"),
+    "clever": ("cleverer", "cleverest"),
+    "quiet": ("quieter", "quietest"),
+}
+
+_DETERMINERS = {
+    "a", "an", "the",
+    "this", "that", "these", "those",
+    "my", "your", "his", "her", "its", "our", "their",
+    "some", "any", "each", "every", "no", "another", "either", "neither", "both", "all", "several", "few", "many", "much", "little"
+}
+
+_MODALS = {"can", "could", "may", "might", "will", "would", "shall", "should", "must", "ought", "dare"}
+_PREPOSITIONS = {
+    "in","on","at","for","to","with","from","about","as","by","into","through",
+    "during","before","after","above","below","over","under","between","among","against","towards","upon","within","without","along","across"
+}
+_AUX_FORMS = {"am","is","are","was","were","be","been","being","have","has","had","do","does","did","will","would","shall","should","may","might","must","can","could"}
+_PRONOUNS = {"i","you","he","she","we","they","me","him","her","us","them","it","mine","yours","his","hers","ours","theirs"}
+_CONJUNCTIONS = {"and","or","but","so","because","although","though","yet","for","nor","since","unless","while","whereas"}
+
+_VOWELS = frozenset("aeiou")
+
+# ---- word-shape detectors ----
+
+def _punctuation_label(before: str, after: str) -> str:
+    # Look for the most-significant punctuation in the 'after' text (order matters)
+    txt = (after or "")
+    if "?" in txt: 
+        return "question mark"
+    if "." in txt:
+        return "period"
+    if "," in txt:
+        return "comma"
+    if "!" in txt:
+        return "exclamation"
+    if ":" in txt:
+        return "colon"
+    if ";" in txt:
+        return "semicolon"
+    return "punctuation"
+
+
+def _strip_common_suffixes(w: str) -> str:
+    wl = w.lower()
+    if wl.endswith("iest") and len(wl) > 4:   # happy -> happiest
+        return wl[:-4] + "y"
+    if wl.endswith("ier") and len(wl) > 3:    # happy -> happier
+        return wl[:-3] + "y"
+    if wl.endswith("est") and len(wl) > 3:    # big -> biggest
+        return wl[:-3]
+    if wl.endswith("er") and len(wl) > 2:     # big -> bigger
+        return wl[:-2]
+    if wl.endswith(("r", "st")) and wl[:-1] + "e" in ("large", "nice", "wise", "rude", "safe"):
+        return wl[:-1] + "e"
+    return wl
+
+def _is_regular_past_ed(b: str, a: str) -> bool:
+    bl, al = b.lower(), a.lower()
+    if not bl or not al:
+        return False
+    if bl.endswith("e") and al == bl + "d":
+        return True
+    if len(bl) >= 3 and bl[-1] not in _VOWELS and bl[-2] in _VOWELS and bl[-3] not in _VOWELS:
+        if al == bl + bl[-1] + "ed":
+            return True
+    if bl.endswith("y") and (len(bl) >= 2 and bl[-2] not in _VOWELS) and al == bl[:-1] + "ied":
+        return True
+    if al == bl + "ed":
+        return True
+    return False
+
+def _is_progressive_ing(b: str, a: str) -> bool:
+    bl, al = b.lower(), a.lower()
+    if not bl or not al:
+        return False
+    if bl.endswith("e") and al == bl[:-1] + "ing":
+        return True
+    if len(bl) >= 3 and bl[-1] not in _VOWELS and bl[-2] in _VOWELS and bl[-3] not in _VOWELS:
+        if al == bl + bl[-1] + "ing":
+            return True
+    if al == bl + "ing":
+        return True
+    return False
+
+def _is_plural_or_3rd_s(b: str, a: str) -> bool:
+    bl, al = b.lower(), a.lower()
+    if not bl or not al:
+        return False
+    if al == bl + "es":
+        return True
+    if bl.endswith("y") and (len(bl) >= 2 and bl[-2] not in _VOWELS) and al == bl[:-1] + "ies":
+        return True
+    if al == bl + "s":
+        return True
+    return False
+
+
+# ---- compiled classifier ----
+
+_WORD_RE = re.compile(r"[\w']+")
+_NON_WORD_RE = re.compile(r"[^\w]")
+_QUANTIFIED_RE = re.compile(r"(?:more|most|less|least)\s+\w+")
+_POSSESSIVE_RE = re.compile(r"\b(my|your|his|her|its|our|their|mine|yours|hers|ours|theirs)\b")
+_APOSTROPHES = str.maketrans("", "", "'’")
+
+
+class GrammarLexicon:
+    """
+    The lexicon tables compiled into lookup structures once, so labelling a
+    diff op is a handful of set/dict probes instead of table scans.
+    """
+
+    def __init__(self):
+        # (before, after) pairs in both directions
+        self.contraction_pairs: FrozenSet[Tuple[str, str]] = frozenset(
+            [(c, exp) for c, exp in _CONTRACTIONS.items()] + [(exp, c) for c, exp in _CONTRACTIONS.items()]
+        )
+        self.colloquial_re = re.compile("|".join(re.escape(c) for c in _COLLOQUIAL))
+        self.adjective_pairs: FrozenSet[Tuple[str, str]] = frozenset(
+            pair
+            for base, forms in _IRREGULAR_ADJ.items()
+            for form in forms
+            for pair in ((base, form), (form, base))
+        )
+        self.past_pairs: FrozenSet[Tuple[str, str]] = frozenset(_IRREGULAR_PAST.items())
+        lemmas_by_past: Dict[str, list] = {}
+        for lemma, past in _IRREGULAR_PAST.items():
+            lemmas_by_past.setdefault(past, []).append(lemma)
+        self.lemmas_by_past: Dict[str, Tuple[str, ...]] = {p: tuple(ls) for p, ls in lemmas_by_past.items()}
+        self.modals = frozenset(_MODALS)
+        self.aux_forms = frozenset(_AUX_FORMS)
+        self.prepositions = frozenset(_PREPOSITIONS)
+        self.pronouns = frozenset(_PRONOUNS)
+        self.conjunctions = frozenset(_CONJUNCTIONS)
+        self.determiners = frozenset(_DETERMINERS)
+
+    def _is_comparative_superlative(self, b: str, a: str) -> bool:
+        # b/a are stripped and lowercased
+        if not b or not a:
+            return False
+        if (b, a) in self.adjective_pairs:
+            return True
+        if a.endswith(("er", "est")) or b.endswith(("er", "est")):
+            stem_b = _strip_common_suffixes(b)
+            stem_a = _strip_common_suffixes(a)
+            if stem_a == stem_b and len(stem_a) >= 2:
+                return True
+        if _QUANTIFIED_RE.match(a) or _QUANTIFIED_RE.match(b):
+            return True
+        return (" than" in a) != (" than" in b)
+
+    def _is_irregular_past(self, b_l: str, a_l: str) -> bool:
+        if (b_l, a_l) in self.past_pairs:
+            return True
+        # Misspelled lemma -> irregular past: compare only against lemmas of this past form
+        for lemma in self.lemmas_by_past.get(a_l, ()):
+            sm = difflib.SequenceMatcher(None, b_l, lemma)
+            if sm.quick_ratio() >= 0.5 and sm.ratio() >= 0.5:
+                return True
+        return False
+
+    def classify(self, before: str, after: str) -> str:
+        b, a = before.strip(), after.strip()
+        b_l, a_l = b.lower(), a.lower()
+
+        # Contractions first (handles I’m -> I am etc.)
+        if (b_l, a_l) in self.contraction_pairs:
+            return "apostrophe/contraction"
+
+        # Colloquial → standard (must be very early)
+        if self.colloquial_re.search(b_l):
+            return "colloquial → standard"
+
+        if b_l == a_l and b != a:
+            return "capitalization"
+
+        # Apostrophe / contraction (fallback token-shape check)
+        if (
+            b != a
+            and ("'" in b or "'" in a or "’" in b or "’" in a)
+            and b.translate(_APOSTROPHES).lower() == a.translate(_APOSTROPHES).lower()
+        ):
+            return "apostrophe/contraction"
+
+        if _NON_WORD_RE.sub("", b_l) == _NON_WORD_RE.sub("", a_l):
+            return _punctuation_label(b, a)
+
+        # Deletion of 'more'/'most' (comparative markers removed)
+        if a_l == "" and b_l in ("more", "most"):
+            return "comparative/superlative form"
+
+        # Comparative / superlative (must be before deletion/lexical fallbacks)
+        if self._is_comparative_superlative(b_l, a_l):
+            return "comparative/superlative form"
+
+        # Function words: tokenize each side once and probe the sets.
+        # Modals are a subset of auxiliaries; detect modals first for specificity.
+        b_tokens = _WORD_RE.findall(b_l)
+        a_tokens = _WORD_RE.findall(a_l)
+        b_set, a_set = frozenset(b_tokens), frozenset(a_tokens)
+        if not (self.modals.isdisjoint(b_set) and self.modals.isdisjoint(a_set)):
+            return "modal verb"
+        if not (self.aux_forms.isdisjoint(b_set) and self.aux_forms.isdisjoint(a_set)):
+            return "auxiliary verb"
+        if (b_set & self.prepositions) != (a_set & self.prepositions):
+            return "preposition usage"
+        if (b_set & self.pronouns) != (a_set & self.pronouns):
+            return "pronoun/person"
+        if (
+            _POSSESSIVE_RE.search(b_l) or _POSSESSIVE_RE.search(a_l)
+            or b_l.endswith(("'s", "s'")) or a_l.endswith(("'s", "s'"))
+        ):
+            return "possessive"
+        if not (self.conjunctions.isdisjoint(b_set) and self.conjunctions.isdisjoint(a_set)):
+            return "conjunction usage"
+
+        # Irregular past tense (must precede spelling/lexical)
+        if self._is_irregular_past(b_l, a_l):
+            return "irregular past tense"
+
+        if _is_regular_past_ed(b, a):
+            return "regular past tense (-ed)"
+
+        if _is_progressive_ing(b, a):
+            return "progressive aspect (-ing)"
+
+        if _is_plural_or_3rd_s(b, a):
+            return "plural/3rd-person -s"
+
+        # Determiners (trigger only if the determiner set actually changes)
+        if (b_set & self.determiners) != (a_set & self.determiners):
+            return "article/determiner usage"
+
+        if a_l.endswith("ly") and b_l + "ly" == a_l:
+            return "adverb form (-ly)"
+
+        # Spelling / word form (high similarity, short edits)
+        if abs(len(b) - len(a)) <= 2:
+            sm = difflib.SequenceMatcher(None, b_l, a_l)
+            if sm.quick_ratio() >= 0.75 and sm.ratio() >= 0.75:
+                return "spelling/word form"
+
+        # Lexical / word choice (single-token semantic swaps)
+        if len(b_tokens) == 1 and len(a_tokens) == 1:
+            sm = difflib.SequenceMatcher(None, b_tokens[0], a_tokens[0])
+            if sm.real_quick_ratio() < 0.6 or sm.ratio() < 0.6:
+                return "lexical/word choice"
+
+        return "grammar/word choice"
+
+
+LEXICON = GrammarLexicon()
+
+# A few pairs (its → it's, i → I, a → an, go → went) dominate real traffic
+_labels = TTLCache(maxsize=GRAMMAR_LABEL_CACHE_SIZE)
+
+
+def guess_reason(before: str, after: str) -> str:
+    """Reason label for one diff op (before -> after); '' marks an insertion/deletion side."""
+    # classify() only ever sees the stripped spans, so they are the complete key;
+    # case and apostrophes must stay in it (capitalization/contraction labels)
+    key = (before.strip(), after.strip())
+    label = _labels.get(key)
+    if label is None:
+        label = LEXICON.classify(*key)
+        _labels.put(key, label)
+    return label
+
+
+def label_cache_stats() -> Dict[str, Any]:
+    return _labels.stats()
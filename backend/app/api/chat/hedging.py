@@ -0,0 +1,172 @@
+# hedging.py (hedged requests across the backend pool)
+import asyncio
+from collections import Counter, deque
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional
+
+from .backends import Backend, BackendPool, LLMUnavailable
+from .streaming import BufferedStream
+
+
+class LatencyTracker:
+    """Sliding window of recent latencies per call kind, used to pick hedge delays."""
+
+    def __init__(self, window: int = 256, min_samples: int = 20, quantile: float = 0.95, min_delay_s: float = 0.05):
+        self.window = window
+        self.min_samples = min_samples
+        self.quantile = quantile
+        self.min_delay_s = min_delay_s
+        self._samples: Dict[str, Deque[float]] = {}
+
+    def observe(self, kind: str, seconds: float) -> None:
+        samples = self._samples.get(kind)
+        if samples is None:
+            samples = self._samples[kind] = deque(maxlen=self.window)
+        samples.append(seconds)
+
+    def hedge_delay(self, kind: str) -> Optional[float]:
+        """p95 of recent latencies, or None until there are enough samples."""
+        samples = self._samples.get(kind)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        ordered = sorted(samples)
+        idx = min(len(ordered) - 1, int(self.quantile * len(ordered)))
+        return max(self.min_delay_s, ordered[idx])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            kind: {"samples": len(samples), "hedge_delay_ms": round(1000 * (self.hedge_delay(kind) or 0.0), 1)}
+            for kind, samples in self._samples.items()
+        }
+
+
+HEDGE_STATS: Counter = Counter()
+
+
+def _alternate(pool: BackendPool, session_id: Optional[str], primary: Backend) -> Optional[Backend]:
+    try:
+        return pool.pick(session_id, exclude=[primary])
+    except LLMUnavailable:
+        return None
+
+
+async def hedged_call(
+    pool: BackendPool,
+    tracker: LatencyTracker,
+    kind: str,
+    attempt: Callable[[Backend], Awaitable[Any]],
+    session_id: Optional[str] = None,
+    enabled: bool = True,
+) -> Any:
+    """
+    Runs attempt() on the routed backend. If it has not answered after the
+    p95 delay (or fails first), a second attempt goes to another backend;
+    the first good answer wins and the other attempt is cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    primary = pool.pick(session_id)
+    primary_task = asyncio.create_task(attempt(primary))
+    tasks = {primary_task}
+    delay = tracker.hedge_delay(kind) if enabled else None
+    hedged = False
+    last_exc: Optional[BaseException] = None
+    try:
+        if enabled and len(pool.backends) > 1:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            first = next(iter(done), None)
+            if first is None or first.exception() is not None:
+                alt = _alternate(pool, session_id, primary)
+                if alt is not None:
+                    hedged = True
+                    HEDGE_STATS["hedged" if first is None else "failover"] += 1
+                    tasks.add(asyncio.create_task(attempt(alt)))
+
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    tracker.observe(kind, loop.time() - started)
+                    if hedged and t is not primary_task:
+                        HEDGE_STATS["hedge_wins"] += 1
+                    return t.result()
+                last_exc = t.exception()
+        raise last_exc
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+
+
+async def _first_item(stream: BufferedStream):
+    try:
+        return True, await stream.__anext__()
+    except StopAsyncIteration:
+        return False, None
+
+
+async def hedged_stream(
+    pool: BackendPool,
+    tracker: LatencyTracker,
+    kind: str,
+    attempt: Callable[[Backend], AsyncIterator[str]],
+    session_id: Optional[str] = None,
+    enabled: bool = True,
+) -> AsyncGenerator[str, None]:
+    """
+    Streaming variant: hedges on time-to-first-token. Whichever backend
+    produces the first delta keeps the stream; the other one is cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    primary = pool.pick(session_id)
+    streams: Dict[asyncio.Task, BufferedStream] = {}
+
+    def launch(backend: Backend) -> None:
+        stream = BufferedStream(attempt(backend))
+        streams[asyncio.create_task(_first_item(stream))] = stream
+
+    launch(primary)
+    winner: Optional[BufferedStream] = None
+    try:
+        if enabled and len(pool.backends) > 1:
+            delay = tracker.hedge_delay(kind)
+            done, _ = await asyncio.wait(set(streams), timeout=delay)
+            first = next(iter(done), None)
+            if first is None or first.exception() is not None:
+                alt = _alternate(pool, session_id, primary)
+                if alt is not None:
+                    HEDGE_STATS["hedged" if first is None else "failover"] += 1
+                    launch(alt)
+
+        primary_task = next(iter(streams))
+        pending = set(streams)
+        last_exc: Optional[BaseException] = None
+        has_item, item = False, None
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for t in done:
+                if t.exception() is None:
+                    winner = streams[t]
+                    has_item, item = t.result()
+                    break
+                last_exc = t.exception()
+        if winner is None:
+            raise last_exc
+
+        tracker.observe(kind, loop.time() - started)
+        if streams[primary_task] is not winner:
+            HEDGE_STATS["hedge_wins"] += 1
+        for t, stream in streams.items():
+            if stream is not winner:
+                t.cancel()
+                stream.cancel()
+
+        if has_item:
+            yield item
+            async for chunk in winner:
+                yield chunk
+    finally:
+        for t, stream in streams.items():
+            t.cancel()
+            stream.cancel()
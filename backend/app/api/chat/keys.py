@@ -0,0 +1,15 @@
+# keys.py (lookup keys shared by the correction cache and the correction memory)
+import re
+
+# One representative strictness per bucket (warmup primes each prompt)
+STRICTNESS_TIERS = (0.0, 0.6, 0.8)
+
+
+def normalize_for_cache(text: str) -> str:
+    # Whitespace only: case and quote style change the diff bullets, so they stay in the key.
+    return re.sub(r"\s+", " ", text or "").strip()
+
+
+def strictness_bucket(strictness: float) -> int:
+    # Mirrors the thresholds used by llm_client._correction_guidelines: same bucket -> same prompt.
+    return int(strictness >= 0.6) + int(strictness >= 0.8)
@@ -1,7 +1,180 @@
-import json
+import asyncio
+import time
 import httpx
-from typing import AsyncGenerator, Optional
-from .config import OLLAMA_URL, LLM_MODEL
+from contextlib import aclosing, asynccontextmanager
+from typing import AsyncGenerator, Dict, List, Optional, Sequence
+from . import config, correction_memory
+from .cache import TTLCache
+from .keys import STRICTNESS_TIERS, normalize_for_cache, strictness_bucket
+from .singleflight import SingleFlight
+from .streaming import NDJSONContent
+from .backends import Backend, BackendPool, LLMUnavailable, LLMDeadlineExceeded
+from .hedging import LatencyTracker, HEDGE_STATS, hedged_call, hedged_stream
+from .scheduler import (
+    AdmissionScheduler,
+    LLMOverloaded,
+    PRIORITY_CORRECTION,
+    PRIORITY_REPLY,
+    PRIORITY_MINIMAL,
+    PRIORITY_SUMMARY,
+)
+from .config import (
+    OLLAMA_URLS,
+    OLLAMA_HEALTH_INTERVAL_S,
+    OLLAMA_EJECT_AFTER_FAILURES,
+    OLLAMA_EJECT_S,
+    OLLAMA_STICKY_SESSIONS,
+    OLLAMA_STICKY_SLACK,
+    OLLAMA_CONNECT_TIMEOUT_S,
+    OLLAMA_MAX_EJECT_S,
+    LLM_HEDGING,
+    OLLAMA_MAX_CONNECTIONS,
+    OLLAMA_MAX_KEEPALIVE,
+    OLLAMA_KEEPALIVE_EXPIRY_S,
+    CORRECTION_CACHE_SIZE,
+    CORRECTION_CACHE_TTL_S,
+    OLLAMA_MAX_CONCURRENCY,
+    LLM_MAX_QUEUE,
+    LLM_MAX_QUEUE_WAIT_S,
+    LLM_KEEP_ALIVE,
+    LLM_WARMUP,
+    LLM_KEEPALIVE_INTERVAL_S,
+    LLM_KEEPALIVE_HOURS,
+    LLM_SINGLEFLIGHT,
+)
+
+# ---- Shared HTTP client (opened/closed by the app lifespan) ----
+_client: Optional[httpx.AsyncClient] = None
+
+def _new_client() -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=OLLAMA_MAX_CONNECTIONS,
+        max_keepalive_connections=OLLAMA_MAX_KEEPALIVE,
+        keepalive_expiry=OLLAMA_KEEPALIVE_EXPIRY_S,
+    )
+    # No read timeout here: per-request deadlines bound generation time instead
+    return httpx.AsyncClient(timeout=httpx.Timeout(None, connect=OLLAMA_CONNECT_TIMEOUT_S), limits=limits)
+
+def _get_client() -> httpx.AsyncClient:
+    # Lazily open one if the lifespan hook did not run (scripts, tests).
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _new_client()
+    return _client
+
+_background: List[asyncio.Task] = []
+
+async def startup(warm_briefs: Sequence[str] = ()) -> None:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _new_client()
+    # Warmup runs in the background so a down Ollama does not block app startup
+    if LLM_WARMUP:
+        _background.append(asyncio.create_task(warmup(warm_briefs)))
+    if LLM_KEEPALIVE_INTERVAL_S > 0:
+        _background.append(asyncio.create_task(_keepalive_loop()))
+    if OLLAMA_HEALTH_INTERVAL_S > 0:
+        _background.append(asyncio.create_task(_health_loop()))
+
+async def shutdown() -> None:
+    global _client
+    for task in _background:
+        task.cancel()
+    await asyncio.gather(*_background, return_exceptions=True)
+    _background.clear()
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+# ---- Backend pool (least-outstanding-requests routing, auto-ejection) ----
+_pool = BackendPool(
+    OLLAMA_URLS,
+    eject_after_failures=OLLAMA_EJECT_AFTER_FAILURES,
+    eject_s=OLLAMA_EJECT_S,
+    max_eject_s=OLLAMA_MAX_EJECT_S,
+    sticky=OLLAMA_STICKY_SESSIONS,
+    sticky_slack=OLLAMA_STICKY_SLACK,
+)
+
+_latency = LatencyTracker()
+
+def deadline_after(seconds: float) -> Optional[float]:
+    """Event-loop time `seconds` from now (None disables the deadline)."""
+    return asyncio.get_running_loop().time() + seconds if seconds > 0 else None
+
+@asynccontextmanager
+async def _until(deadline: Optional[float]):
+    # Never wrap a `yield` of a generator in this: the timeout targets the current task
+    if deadline is None:
+        yield
+        return
+    try:
+        async with asyncio.timeout_at(deadline):
+            yield
+    except TimeoutError:
+        raise LLMDeadlineExceeded("LLM call exceeded the turn deadline") from None
+
+async def _health_loop() -> None:
+    while True:
+        await _pool.check_all(_get_client())
+        await asyncio.sleep(OLLAMA_HEALTH_INTERVAL_S)
+
+# ---- Admission control (one scheduler per backend URL) ----
+_schedulers: Dict[str, AdmissionScheduler] = {}
+
+def _scheduler_for(url: str) -> AdmissionScheduler:
+    sched = _schedulers.get(url)
+    if sched is None:
+        sched = AdmissionScheduler(url, OLLAMA_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_MAX_QUEUE_WAIT_S)
+        _schedulers[url] = sched
+    return sched
+
+def check_admission(session_id: Optional[str] = None) -> None:
+    """Raises LLMOverloaded/LLMUnavailable if a new turn would only fail later."""
+    _scheduler_for(_pool.pick(session_id).url).check_admission()
+
+# ---- Coalescing of identical in-flight requests ----
+_flights = SingleFlight(LLMDeadlineExceeded)
+
+def _correction_priority(mode: str) -> int:
+    return PRIORITY_MINIMAL if mode == "minimal" else PRIORITY_CORRECTION
+
+def _model() -> str:
+    # Read at call time so a changed LLM_MODEL is picked up (and invalidates the cache).
+    return config.LLM_MODEL
+
+# ---- Correction cache ----
+_correction_cache = TTLCache(maxsize=CORRECTION_CACHE_SIZE, ttl_s=CORRECTION_CACHE_TTL_S)
+_correction_cache_model: Optional[tuple] = None
+
+def _correction_key(user_text: str, strictness: float, mode: str, model: str) -> tuple:
+    global _correction_cache_model
+    # A reloaded correction memory may answer differently than the entries it cached
+    generation = (model, correction_memory.generation())
+    if generation != _correction_cache_model:
+        _correction_cache.clear()
+        _correction_cache_model = generation
+    return (normalize_for_cache(user_text), strictness_bucket(strictness), mode, model)
+
+def _cached_correction(key: tuple) -> Optional[str]:
+    cached = _correction_cache.get(key)
+    if cached is None and key[2] == "standard":
+        # The memory holds what users were served; the minimal pass always asks the model
+        cached = correction_memory.lookup(key[0], key[1])
+        if cached is not None:
+            _correction_cache.put(key, cached)
+    return cached
+
+def get_stats() -> dict:
+    return {
+        "model": _model(),
+        "correction_cache": _correction_cache.stats(),
+        "correction_memory": correction_memory.memory_stats(),
+        "pool": _pool.stats(),
+        "hedging": {"enabled": LLM_HEDGING, **HEDGE_STATS, "delays": _latency.stats()},
+        "schedulers": {url: sched.stats() for url, sched in _schedulers.items()},
+        "singleflight": _flights.stats(),
+    }
 
 # ---- Non-stream opts (kept for /chat) ----
 def _opts_correction(num_ctx=1024, num_predict=256, temperature=0.1):
@@ -10,6 +183,9 @@ def _opts_correction(num_ctx=1024, num_predict=256, temperature=0.1):
 def _opts_reply(num_ctx=1024, num_predict=120, temperature=0.6):
     return {"num_ctx": num_ctx, "num_predict": num_predict, "temperature": temperature}
 
+def _opts_summary(num_ctx=1024, num_predict=96, temperature=0.2):
+    return {"num_ctx": num_ctx, "num_predict": num_predict, "temperature": temperature}
+
 # ---- Prompt builders (unchanged from earlier guardrails) ----
 def _correction_guidelines(strictness: float, mode: str) -> str:
     allow_sentence_reform = strictness >= 0.8 and mode == "standard"
@@ -71,12 +247,50 @@ REPLY_USER = """User message:
 Now output ONLY your reply as plain text.
 """
 
+SUMMARY_SYSTEM = """You keep short running notes on a role-play conversation with a language learner.
+Merge the previous notes and the new turns (U: learner, A: partner) into ONE updated note.
+Rules:
+- Keep what the reply needs for coherence: facts the learner stated, choices made, names, open questions.
+- Drop greetings, small talk and anything about grammar or corrections.
+- Never invent details.
+- Keep it under {MAX_CHARS} characters, third person, PLAIN TEXT ONLY.
+"""
+
+SUMMARY_USER = """Previous notes:
+<<<{SUMMARY}>>>
+
+New turns:
+<<<{TURNS}>>>
+
+Now output ONLY the updated note as plain text.
+"""
+
 def _format_context_block(context: str) -> str:
     context = (context or "").strip()
     return f"Context (recent turns):\n{context}\n\n" if context else ""
 
 # ---------- Non-stream (kept) ----------
-async def _chat_plain(model: str, system: str, user: str, options: dict) -> str:
+def _flight_key(model: str, system: str, user: str, options: dict, priority: int) -> tuple:
+    # Priority decides where the shared call queues, so it is part of what is shared
+    return (model, system, user, tuple(sorted(options.items())), priority)
+
+async def _chat_plain(
+    model: str, system: str, user: str, options: dict,
+    priority: int = PRIORITY_REPLY, session_id: Optional[str] = None, deadline: Optional[float] = None,
+) -> str:
+    if not LLM_SINGLEFLIGHT:
+        return await _chat_plain_upstream(model, system, user, options, priority, session_id, deadline)
+    # Double-submits share the generation that is already running
+    return await _flights.do(
+        _flight_key(model, system, user, options, priority),
+        lambda: _chat_plain_upstream(model, system, user, options, priority, session_id, deadline),
+        deadline,
+    )
+
+async def _chat_plain_upstream(
+    model: str, system: str, user: str, options: dict, priority: int,
+    session_id: Optional[str], deadline: Optional[float],
+) -> str:
     payload = {
         "model": model,
         "messages": [
@@ -85,31 +299,83 @@ async def _chat_plain(model: str, system: str, user: str, options: dict) -> str:
         ],
         "stream": False,
         "options": options,
+        "keep_alive": LLM_KEEP_ALIVE,
     }
-    async with httpx.AsyncClient(timeout=None) as client:
-        resp = await client.post(f"{OLLAMA_URL}/api/chat", json=payload)
-        resp.raise_for_status()
-        data = resp.json()
-        return (data.get("message", {}) or {}).get("content", "") or data.get("response", "") or ""
 
-async def correct_text(user_text: str, strictness: float, mode: str = "standard") -> str:
+    async def attempt(backend: Backend) -> dict:
+        async with _pool.track(backend), _scheduler_for(backend.url).slot(priority, deadline):
+            async with _until(deadline):
+                resp = await _get_client().post(f"{backend.url}/api/chat", json=payload)
+                resp.raise_for_status()
+                return resp.json()
+
+    data = await hedged_call(_pool, _latency, f"plain:{priority}", attempt, session_id, LLM_HEDGING)
+    return (data.get("message", {}) or {}).get("content", "") or data.get("response", "") or ""
+
+async def correct_text(
+    user_text: str, strictness: float, mode: str = "standard",
+    session_id: Optional[str] = None, deadline: Optional[float] = None,
+) -> str:
+    model = _model()
+    key = _correction_key(user_text, strictness, mode, model)
+    cached = _cached_correction(key)
+    if cached is not None:
+        return cached
+
     system = CORRECT_SYSTEM.format(GUIDELINES=_correction_guidelines(strictness, mode))
     prompt = CORRECT_USER.format(USER_TEXT=user_text)
-    return (await _chat_plain(LLM_MODEL, system, prompt, _opts_correction())).strip()
+    corrected = (await _chat_plain(
+        model, system, prompt, _opts_correction(), _correction_priority(mode), session_id, deadline,
+    )).strip()
+    if corrected:
+        _correction_cache.put(key, corrected)
+    return corrected
 
-async def generate_reply(user_text: str, scenario_brief: str, context: str = "") -> str:
+async def generate_reply(
+    user_text: str, scenario_brief: str, context: str = "",
+    session_id: Optional[str] = None, deadline: Optional[float] = None,
+) -> str:
     system = REPLY_SYSTEM.format(
         SCENARIO_BRIEF=scenario_brief,
         CONTEXT_BLOCK=_format_context_block(context),
     )
     prompt = REPLY_USER.format(USER_TEXT=user_text)
-    return (await _chat_plain(LLM_MODEL, system, prompt, _opts_reply())).strip()
+    return (await _chat_plain(_model(), system, prompt, _opts_reply(), PRIORITY_REPLY, session_id, deadline)).strip()
+
+async def summarize_history(
+    summary: str, lines: Sequence[str], max_chars: int,
+    session_id: Optional[str] = None, deadline: Optional[float] = None,
+) -> str:
+    """Folds context lines into the previous summary; queued behind every interactive call."""
+    system = SUMMARY_SYSTEM.format(MAX_CHARS=max_chars)
+    prompt = SUMMARY_USER.format(SUMMARY=summary or "(none)", TURNS="\n".join(lines))
+    return (await _chat_plain(_model(), system, prompt, _opts_summary(), PRIORITY_SUMMARY, session_id, deadline)).strip()
 
 # ---------- STREAMING (new) ----------
-async def _chat_stream(model: str, system: str, user: str, options: dict) -> AsyncGenerator[str, None]:
+async def _chat_stream(
+    model: str, system: str, user: str, options: dict,
+    priority: int = PRIORITY_REPLY, session_id: Optional[str] = None, deadline: Optional[float] = None,
+) -> AsyncGenerator[str, None]:
     """
     Yields incremental deltas (strings) from Ollama /api/chat with stream=True.
+    Identical in-flight streams share one upstream generation.
     """
+    if LLM_SINGLEFLIGHT:
+        source = _flights.stream(
+            _flight_key(model, system, user, options, priority),
+            lambda: _chat_stream_upstream(model, system, user, options, priority, session_id, deadline),
+            deadline,
+        )
+    else:
+        source = _chat_stream_upstream(model, system, user, options, priority, session_id, deadline)
+    async with aclosing(source):
+        async for chunk in source:
+            yield chunk
+
+async def _chat_stream_upstream(
+    model: str, system: str, user: str, options: dict, priority: int,
+    session_id: Optional[str], deadline: Optional[float],
+) -> AsyncGenerator[str, None]:
     payload = {
         "model": model,
         "messages": [
@@ -118,35 +384,176 @@ async def _chat_stream(model: str, system: str, user: str, options: dict) -> Asy
         ],
         "stream": True,
         "options": options,
+        "keep_alive": LLM_KEEP_ALIVE,
     }
-    async with httpx.AsyncClient(timeout=None) as client:
-        async with client.stream("POST", f"{OLLAMA_URL}/api/chat", json=payload) as resp:
-            resp.raise_for_status()
-            async for line in resp.aiter_lines():
-                if not line:
-                    continue
-                # Ollama streams JSON lines
-                try:
-                    obj = json.loads(line)
-                except Exception:
-                    continue
-                if "message" in obj and obj["message"] and "content" in obj["message"]:
-                    chunk = obj["message"]["content"] or ""
+
+    async def attempt(backend: Backend) -> AsyncGenerator[str, None]:
+        async with _pool.track(backend), _scheduler_for(backend.url).slot(priority, deadline):
+            client = _get_client()
+            async with _until(deadline):
+                resp = await client.send(client.build_request("POST", f"{backend.url}/api/chat", json=payload), stream=True)
+            try:
+                resp.raise_for_status()
+                # Ollama streams JSON lines; split the raw bytes ourselves
+                parser = NDJSONContent()
+                reads = resp.aiter_bytes()
+                while True:
+                    # Deadline applies per read so it never spans our own yield
+                    async with _until(deadline):
+                        data = await anext(reads, None)
+                    chunk = parser.flush() if data is None else parser.feed(data)
                     if chunk:
                         yield chunk
-                # when obj.get("done") == True, stream ends
+                    if data is None:
+                        break
+            finally:
+                await resp.aclose()
+
+    source = hedged_stream(_pool, _latency, f"ttft:{priority}", attempt, session_id, LLM_HEDGING)
+    async with aclosing(source):
+        async for chunk in source:
+            yield chunk
+
+async def stream_correct_text(
+    user_text: str, strictness: float, mode: str = "standard",
+    session_id: Optional[str] = None, deadline: Optional[float] = None,
+) -> AsyncGenerator[str, None]:
+    model = _model()
+    key = _correction_key(user_text, strictness, mode, model)
+    cached = _cached_correction(key)
+    if cached is not None:
+        # Replay the cached correction as a single delta
+        yield cached
+        return
 
-async def stream_correct_text(user_text: str, strictness: float, mode: str = "standard") -> AsyncGenerator[str, None]:
     system = CORRECT_SYSTEM.format(GUIDELINES=_correction_guidelines(strictness, mode))
     prompt = CORRECT_USER.format(USER_TEXT=user_text)
-    async for delta in _chat_stream(LLM_MODEL, system, prompt, _opts_correction()):
-        yield delta
+    acc = []
+    source = _chat_stream(model, system, prompt, _opts_correction(), _correction_priority(mode), session_id, deadline)
+    async with aclosing(source):
+        async for delta in source:
+            acc.append(delta)
+            yield delta
+    # Only cache streams that ran to completion
+    corrected = "".join(acc).strip()
+    if corrected:
+        _correction_cache.put(key, corrected)
 
-async def stream_reply(user_text: str, scenario_brief: str, context: str = "") -> AsyncGenerator[str, None]:
+async def stream_reply(
+    user_text: str, scenario_brief: str, context: str = "",
+    session_id: Optional[str] = None, deadline: Optional[float] = None,
+) -> AsyncGenerator[str, None]:
     system = REPLY_SYSTEM.format(
         SCENARIO_BRIEF=scenario_brief,
         CONTEXT_BLOCK=_format_context_block(context),
     )
     prompt = REPLY_USER.format(USER_TEXT=user_text)
-    async for delta in _chat_stream(LLM_MODEL, system, prompt, _opts_reply()):
-        yield delta
+    source = _chat_stream(_model(), system, prompt, _opts_reply(), PRIORITY_REPLY, session_id, deadline)
+    async with aclosing(source):
+        async for delta in source:
+            yield delta
+
+# ---------- Warmup / keep-alive ----------
+def _new_residency() -> dict:
+    return {
+        "model": None,
+        "loaded": False,           # model load request succeeded
+        "primed": [],              # system prompts evaluated once after load
+        "pinned": False,           # inside LLM_KEEPALIVE_HOURS and last ping succeeded
+        "last_warmup_at": None,
+        "last_ping_at": None,
+        "last_error": None,
+    }
+
+_residency: Dict[str, dict] = {b.url: _new_residency() for b in _pool.backends}
+
+def _within_keepalive_hours(hour: int) -> bool:
+    spec = (LLM_KEEPALIVE_HOURS or "").strip()
+    if not spec:
+        return True
+    try:
+        start, end = (int(x) for x in spec.split("-", 1))
+    except ValueError:
+        return True
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end  # wraps past midnight, e.g. "22-6"
+
+async def _load_model(backend: Backend, model: str) -> None:
+    # An empty prompt makes Ollama load the model and apply keep_alive without generating
+    resp = await _get_client().post(
+        f"{backend.url}/api/generate",
+        json={"model": model, "prompt": "", "keep_alive": LLM_KEEP_ALIVE},
+    )
+    resp.raise_for_status()
+
+async def _prime(backend: Backend, model: str, system: str) -> None:
+    # One-token generation so the fixed system prefix has been evaluated at least once
+    payload = {
+        "model": model,
+        "messages": [{"role": "system", "content": system}, {"role": "user", "content": "Hi"}],
+        "stream": False,
+        "options": {**_opts_correction(), "num_predict": 1},
+        "keep_alive": LLM_KEEP_ALIVE,
+    }
+    resp = await _get_client().post(f"{backend.url}/api/chat", json=payload)
+    resp.raise_for_status()
+
+async def _warmup_backend(backend: Backend, model: str, prefixes: list) -> None:
+    state = _residency[backend.url]
+    state.update(model=model, loaded=False, primed=[], last_error=None)
+    try:
+        await _load_model(backend, model)
+        state["loaded"] = True
+        state["pinned"] = LLM_KEEPALIVE_INTERVAL_S > 0 and _within_keepalive_hours(time.localtime().tm_hour)
+        for name, system in prefixes:
+            await _prime(backend, model, system)
+            state["primed"].append(name)
+    except Exception as e:
+        state["last_error"] = f"warmup failed: {e!r}"
+    state["last_warmup_at"] = time.time()
+
+async def warmup(warm_briefs: Sequence[str] = ()) -> dict:
+    """Preload LLM_MODEL and prime the CORRECT_SYSTEM / REPLY_SYSTEM prefixes on every backend."""
+    model = _model()
+    prefixes = []
+    for mode in ("standard", "minimal"):
+        for tier, strictness in enumerate(STRICTNESS_TIERS):
+            system = CORRECT_SYSTEM.format(GUIDELINES=_correction_guidelines(strictness, mode))
+            # The minimal guidelines do not depend on strictness: prime that prompt once
+            if all(system != primed for _, primed in prefixes):
+                prefixes.append((f"correct:{mode}:{tier}", system))
+    prefixes += [
+        ("reply:%d" % i, REPLY_SYSTEM.format(SCENARIO_BRIEF=brief, CONTEXT_BLOCK=""))
+        for i, brief in enumerate(warm_briefs)
+    ]
+    await asyncio.gather(*(_warmup_backend(b, model, prefixes) for b in _pool.backends))
+    return get_residency()
+
+async def _ping(backend: Backend) -> None:
+    state = _residency[backend.url]
+    try:
+        model = _model()
+        await _load_model(backend, model)
+        state.update(model=model, loaded=True, pinned=True, last_ping_at=time.time())
+    except Exception as e:
+        state.update(pinned=False, last_error=f"keep-alive failed: {e!r}")
+
+async def _keepalive_loop() -> None:
+    while True:
+        await asyncio.sleep(LLM_KEEPALIVE_INTERVAL_S)
+        if not _within_keepalive_hours(time.localtime().tm_hour):
+            # Let Ollama's own keep_alive expire outside the configured window
+            for state in _residency.values():
+                state["pinned"] = False
+            continue
+        await asyncio.gather(*(_ping(b) for b in _pool.backends))
+
+def get_residency() -> dict:
+    return {
+        "loaded": any(state["loaded"] for state in _residency.values()),
+        "keep_alive": LLM_KEEP_ALIVE,
+        "keepalive_hours": LLM_KEEPALIVE_HOURS or "always",
+        "within_keepalive_hours": _within_keepalive_hours(time.localtime().tm_hour),
+        "backends": {url: {**state, "primed": list(state["primed"])} for url, state in _residency.items()},
+    }
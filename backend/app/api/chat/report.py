@@ -1,9 +1,214 @@
-# report.py (lean for LLM-only)
-import json, os
-from typing import Dict, Any
-from .config import DATASET_DIR
+# report.py (lean for LLM-only; write-behind JSONL dataset writer)
+import asyncio, json, logging, os
+from collections import Counter, OrderedDict
+from typing import Any, Dict, IO, List, Optional, Tuple
+from .config import (
+    DATASET_DIR,
+    DATASET_FLUSH_BYTES,
+    DATASET_FLUSH_MS,
+    DATASET_FSYNC,
+    DATASET_LAYOUT,
+    DATASET_MAX_OPEN_FILES,
+    DATASET_QUEUE_SIZE,
+    DATASET_SHARD_DIR,
+)
+from .shards import ShardAppender, row_day
+
+_log = logging.getLogger(__name__)
+
+class DatasetWriter:
+    """
+    Rows are encoded on the request path and queued; one background task
+    batches them (DATASET_FLUSH_MS / DATASET_FLUSH_BYTES) and writes each
+    batch in a worker thread, so a slow disk never blocks the event loop.
+    Open files are kept in an LRU of DATASET_MAX_OPEN_FILES handles; with a
+    ShardAppender each batch goes into the current daily shard instead, one
+    member per session. fsync policy: "flush" after every batch, "close" when
+    a handle is closed, "never".
+    """
+
+    def __init__(
+        self, root: str, max_queue: int, max_open: int, flush_s: float, flush_bytes: int, fsync: str,
+        shards: Optional[ShardAppender] = None,
+    ):
+        if fsync not in ("flush", "close", "never"):
+            raise ValueError(f"unknown DATASET_FSYNC {fsync!r} (expected flush, close or never)")
+        self.root = root
+        self.max_open = max(1, max_open)
+        self.flush_s = flush_s
+        self.flush_bytes = flush_bytes
+        self.fsync = fsync
+        self.shards = shards
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._files: "OrderedDict[str, IO[str]]" = OrderedDict()   # touched only by the writer thread
+        self._task: Optional[asyncio.Task] = None
+        self._stats: Counter = Counter()
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def path_for(self, session_id: str) -> str:
+        return os.path.join(self.root, f"session-{session_id}.jsonl")
+
+    def submit(self, session_id: str, obj: Dict[str, Any]) -> bool:
+        """Queues one row; returns False (and counts a drop) when the queue is full."""
+        line = json.dumps(obj, ensure_ascii=False) + "\n"
+        try:
+            self._queue.put_nowait((session_id, line, obj))
+        except asyncio.QueueFull:
+            self._stats["dropped"] += 1
+            return False
+        self._stats["queued"] += 1
+        return True
+
+    def start(self) -> None:
+        if not self.running:
+            self._task = asyncio.create_task(self._run())
+
+    async def drain(self) -> None:
+        """Writes everything queued so far, then stops the task and closes (and fsyncs) every file."""
+        if self._task is not None:
+            await self._queue.put(None)
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self._close_all)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stop = False
+        while not stop:
+            item = await self._queue.get()
+            if item is None:
+                break
+            batch, size = [item], len(item[1])
+            flush_at = loop.time() + self.flush_s
+            while size < self.flush_bytes:
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), max(0.0, flush_at - loop.time()))
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+                size += len(item[1])
+            await asyncio.to_thread(self._write_batch, batch)
+
+    def _write_batch(self, batch: List[Tuple[str, str, Dict[str, Any]]]) -> None:
+        by_session: Dict[str, List[str]] = {}
+        first_rows: Dict[str, Dict[str, Any]] = {}
+        for session_id, line, obj in batch:
+            by_session.setdefault(session_id, []).append(line)
+            first_rows.setdefault(session_id, obj)
+        for session_id, lines in by_session.items():
+            try:
+                if self.shards is not None:
+                    row = first_rows[session_id]
+                    self.shards.append(
+                        row_day(row), session_id, row.get("scenario_id", ""), row.get("level", ""), lines,
+                    )
+                else:
+                    self._write_lines(self.path_for(session_id), lines)
+                self._stats["written"] += len(lines)
+            except OSError:
+                self._stats["errors"] += len(lines)
+                _log.exception("dataset write failed for session %s", session_id)
+                if self.shards is None:
+                    self._close(self.path_for(session_id))
+        self._stats["flushes"] += 1
+
+    def _write_lines(self, path: str, lines: List[str]) -> None:
+        f = self._open(path)
+        f.write("".join(lines))
+        f.flush()
+        while self._moved(path, f):
+            # shards.compact() renamed the file while we wrote and may have read it
+            # before these lines: write them again to a fresh file (at worst a duplicate)
+            self._stats["rewritten"] += len(lines)
+            f = self._open(path)
+            f.write("".join(lines))
+            f.flush()
+        if self.fsync == "flush":
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _moved(path: str, f: IO[str]) -> bool:
+        """True once path no longer names the file behind this handle."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return True
+        own = os.fstat(f.fileno())
+        return (st.st_ino, st.st_dev) != (own.st_ino, own.st_dev)
+
+    def _open(self, path: str) -> IO[str]:
+        f = self._files.get(path)
+        if f is not None and self._moved(path, f):
+            # shards.compact() renamed it away: rows written to this handle would be lost
+            self._files.pop(path).close()
+            self._stats["reopened"] += 1
+            f = None
+        if f is not None:
+            self._files.move_to_end(path)
+            return f
+        while len(self._files) >= self.max_open:
+            self._close(next(iter(self._files)))
+        f = self._files[path] = open(path, "a", encoding="utf-8")
+        return f
+
+    def _close(self, path: str) -> None:
+        f = self._files.pop(path, None)
+        if f is None:
+            return
+        try:
+            f.flush()
+            if self.fsync != "never":
+                os.fsync(f.fileno())
+        except OSError:
+            _log.exception("dataset fsync failed for %s", path)
+        finally:
+            f.close()
+
+    def _close_all(self) -> None:
+        for path in list(self._files):
+            self._close(path)
+        if self.shards is not None:
+            self.shards.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "queue_depth": self._queue.qsize(),
+            "layout": "shards" if self.shards is not None else "sessions",
+            "open_files": len(self._files),
+            "fsync": self.fsync,
+            **self._stats,
+        }
+
+_writer = DatasetWriter(
+    DATASET_DIR,
+    max_queue=DATASET_QUEUE_SIZE,
+    max_open=DATASET_MAX_OPEN_FILES,
+    flush_s=DATASET_FLUSH_MS / 1000.0,
+    flush_bytes=DATASET_FLUSH_BYTES,
+    fsync=DATASET_FSYNC,
+    # One shard prefix per worker process: each shard file has a single writer
+    shards=ShardAppender(DATASET_SHARD_DIR, "w{pid}", fsync=DATASET_FSYNC) if DATASET_LAYOUT == "shards" else None,
+)
 
 def append_jsonl(session_id: str, obj: Dict[str, Any]):
-    path = os.path.join(DATASET_DIR, f"session-{session_id}.jsonl")
-    with open(path, "a", encoding="utf-8") as f:
-        f.write(json.dumps(obj, ensure_ascii=False) + "\n")
+    # Outside the app lifespan (scripts) there is no writer task: write directly
+    if _writer.running:
+        _writer.submit(session_id, obj)
+        return
+    _writer._write_batch([(session_id, json.dumps(obj, ensure_ascii=False) + "\n", obj)])
+
+async def startup() -> None:
+    _writer.start()
+
+async def shutdown() -> None:
+    await _writer.drain()
+
+def dataset_stats() -> Dict[str, Any]:
+    return _writer.stats()
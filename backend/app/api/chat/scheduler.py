@@ -0,0 +1,153 @@
+# scheduler.py (priority admission control for Ollama calls)
+import asyncio
+import heapq
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+# Lower value = served first
+PRIORITY_CORRECTION = 0   # interactive (streaming) correction
+PRIORITY_REPLY = 1        # conversational reply
+PRIORITY_MINIMAL = 2      # mode="minimal" guardrail reruns
+PRIORITY_SUMMARY = 3      # background rolling conversation summaries
+
+PRIORITY_NAMES = {
+    PRIORITY_CORRECTION: "correction",
+    PRIORITY_REPLY: "reply",
+    PRIORITY_MINIMAL: "minimal",
+    PRIORITY_SUMMARY: "summary",
+}
+
+
+class LLMOverloaded(Exception):
+    """Raised when a call is shed instead of queued (maps to 429/503 + Retry-After)."""
+
+    def __init__(self, message: str, status_code: int = 503, retry_after: int = 1):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionScheduler:
+    """
+    Caps concurrent upstream calls for one backend. Waiters are served by
+    priority class (then FIFO); a waiter that exceeds max_wait_s is shed.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, max_wait_s: Optional[float]):
+        self.name = name
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.max_queue = max(0, int(max_queue))
+        self.max_wait_s = max_wait_s if max_wait_s and max_wait_s > 0 else None
+
+        self._active = 0
+        self._waiting = 0
+        self._seq = 0
+        self._queue: List[Tuple[int, int, asyncio.Future]] = []
+
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self._wait_total_s = 0.0
+        self._wait_max_s = 0.0
+        self._hold_ewma_s = 0.0
+
+    # ---- admission ----
+
+    def _retry_after(self) -> int:
+        # Rough time for the current backlog to drain through the available slots
+        per_call = self._hold_ewma_s or 1.0
+        backlog = (self._waiting + 1) / self.max_concurrency
+        return max(1, math.ceil(per_call * backlog))
+
+    def check_admission(self) -> None:
+        """Fail fast (before opening an SSE stream) when the queue is already full."""
+        if self._active >= self.max_concurrency and self._waiting >= self.max_queue:
+            self.shed_queue_full += 1
+            raise LLMOverloaded(
+                f"LLM queue full on {self.name}", status_code=429, retry_after=self._retry_after()
+            )
+
+    async def acquire(self, priority: int = PRIORITY_REPLY, deadline: Optional[float] = None) -> float:
+        """deadline is an event-loop time; the queue wait never runs past it."""
+        start = time.monotonic()
+        if self._active < self.max_concurrency and not self._waiting:
+            self._active += 1
+            self._record_wait(0.0)
+            return 0.0
+
+        self.check_admission()
+
+        loop = asyncio.get_running_loop()
+        max_wait = self.max_wait_s
+        if deadline is not None:
+            remaining = max(0.0, deadline - loop.time())
+            max_wait = remaining if max_wait is None else min(max_wait, remaining)
+
+        fut = loop.create_future()
+        self._seq += 1
+        heapq.heappush(self._queue, (priority, self._seq, fut))
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(fut, max_wait)
+        except BaseException as e:
+            if fut.done() and not fut.cancelled():
+                # Slot was handed over just as we gave up; pass it on
+                self.release()
+            else:
+                fut.cancel()
+                self._waiting -= 1
+            if isinstance(e, asyncio.TimeoutError):
+                self.shed_timeout += 1
+                raise LLMOverloaded(
+                    f"LLM queue wait exceeded {round(max_wait, 2)}s on {self.name}",
+                    status_code=503,
+                    retry_after=self._retry_after(),
+                ) from None
+            raise
+
+        waited = time.monotonic() - start
+        self._record_wait(waited)
+        return waited
+
+    def release(self) -> None:
+        while self._queue:
+            _, _, fut = heapq.heappop(self._queue)
+            if not fut.done():
+                # Hand the slot straight to the next waiter
+                self._waiting -= 1
+                fut.set_result(None)
+                return
+        self._active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_REPLY, deadline: Optional[float] = None):
+        await self.acquire(priority, deadline)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            held = time.monotonic() - started
+            self._hold_ewma_s = held if not self._hold_ewma_s else (0.8 * self._hold_ewma_s + 0.2 * held)
+            self.release()
+
+    # ---- metrics ----
+
+    def _record_wait(self, waited: float) -> None:
+        self.admitted += 1
+        self._wait_total_s += waited
+        self._wait_max_s = max(self._wait_max_s, waited)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._active,
+            "queue_depth": self._waiting,
+            "admitted": self.admitted,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+            "wait_avg_ms": round(1000 * self._wait_total_s / self.admitted, 1) if self.admitted else 0.0,
+            "wait_max_ms": round(1000 * self._wait_max_s, 1),
+            "hold_ewma_ms": round(1000 * self._hold_ewma_s, 1),
+        }
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Literal, Dict, Any
+from typing import Literal, Dict, Any, List, Optional
 
 class StartRequest(BaseModel):
     level: Literal["A1","A2","B1","B2","C1","C2"] = "C1"
@@ -14,9 +14,21 @@ class ChatRequest(BaseModel):
     session_id: str
     user_text: str
 
+class CorrectionOpOut(BaseModel):
+    op: Literal["replace", "delete", "insert"]
+    before: str
+    after: str
+    reason: str
+    pos: Optional[str] = None
+    src_start: int
+    src_end: int
+    dst_start: int
+    dst_end: int
+
 class ChatResponse(BaseModel):
     corrections_md: str
     bot_reply: str
+    ops: Optional[List[CorrectionOpOut]] = None
 
 class EndRequest(BaseModel):
     session_id: str
@@ -1,27 +1,480 @@
-# session_store.py (lean)
-import time, uuid
-from typing import Dict, Any, List
+# session_store.py (lean; pluggable backend, idle/absolute expiry and an LRU cap)
+import asyncio, logging, os, sqlite3, sys, time, uuid
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Tuple
+
+import msgpack
+
+from .analysis import context_line, ellipsize, join_context, summary_context
+from .config import (
+    CHAT_CONTEXT_MAX_CHARS,
+    CHAT_CONTEXT_PAIRS,
+    CHAT_SUMMARY_EVERY,
+    CHAT_SUMMARY_KEEP_PAIRS,
+    CHAT_SUMMARY_MAX_CHARS,
+    SESSION_BACKEND,
+    SESSION_DB_BUSY_TIMEOUT_S,
+    SESSION_DB_PATH,
+    SESSION_IDLE_TTL_S,
+    SESSION_MAX_AGE_S,
+    SESSION_MAX_COUNT,
+    SESSION_SWEEP_INTERVAL_S,
+)
+
+_log = logging.getLogger(__name__)
+
+# With rolling summaries, room for the kept pairs plus two folds' worth, so a late summary loses nothing
+_HISTORY_PAIRS = (
+    max(CHAT_CONTEXT_PAIRS, CHAT_SUMMARY_KEEP_PAIRS + 2 * CHAT_SUMMARY_EVERY) if CHAT_SUMMARY_EVERY > 0
+    else CHAT_CONTEXT_PAIRS
+)
 
 class SessionMem:
-    def __init__(self, scenario_card: dict, level: str, strictness: float):
+    __slots__ = (
+        "id", "user_id", "created_at", "last_seen", "level", "strictness", "scenario_card",
+        "history", "turns", "reruns", "summary", "folded", "messages", "version", "_context_lines", "_context",
+    )
+
+    def __init__(self, scenario_card: dict, level: str, strictness: float, user_id: str = ""):
         self.id = str(uuid.uuid4())
-        self.created_at = time.time()
+        self.user_id = user_id   # owner, so an evicted session can be marked ended
+        # Wall-clock seconds: a shared backend compares them across processes
+        self.created_at = self.last_seen = time.time()
         self.level = level
         self.strictness = strictness
         self.scenario_card = scenario_card
-        self.history: List[Dict[str, str]] = []  # [{role:"user|assistant", "text": "..."}]
+        # Ring buffers: only the messages the reply context can still show
+        self.history: Deque[Dict[str, str]] = deque(maxlen=2 * _HISTORY_PAIRS)  # {role:"user|assistant", "text": "..."}
+        self._context_lines: Deque[str] = deque(maxlen=2 * _HISTORY_PAIRS)    # context_line() per message
+        self._context: Optional[str] = ""
+        self.turns = 0     # corrected turns
+        self.reruns = 0    # turns where the guardrail asked for a minimal rerun
+        self.summary = ""  # rolling summary of the first `folded` messages
+        self.folded = 0
+        self.messages = 0  # messages ever added (history keeps only the last ones)
+        self.version = 0   # row version this copy was read at (shared backends)
+
+    def add_turn(self, user_text: str, reply_text: str) -> None:
+        for role, text in (("user", user_text), ("assistant", reply_text)):
+            self._append(role, text)
+        self._context = None
+
+    def _append(self, role: str, text: str) -> None:
+        self.history.append({"role": role, "text": text})
+        self._context_lines.append(context_line(role, text))
+        self.messages += 1
+
+    @property
+    def context(self) -> str:
+        """
+        Reply-prompt context: without a summary, the same string
+        build_brief_context() gives for this history; with one, the summary
+        followed by the messages it does not cover yet.
+        """
+        if self._context is None:
+            if self.summary:
+                first = max(0, self.folded - (self.messages - len(self._context_lines)))
+                lines = list(self._context_lines)[first:]
+                self._context = summary_context(self.summary, lines, CHAT_CONTEXT_MAX_CHARS)
+            else:
+                self._context = join_context(self._context_lines, CHAT_CONTEXT_MAX_CHARS)
+        return self._context
 
-SESSIONS: Dict[str, SessionMem] = {}
+    def fold_due(self) -> Optional[Tuple[int, List[str]]]:
+        """(new `folded`, context lines to fold) once CHAT_SUMMARY_EVERY exchanges are past the kept pairs."""
+        if CHAT_SUMMARY_EVERY <= 0:
+            return None
+        upto = self.messages - 2 * CHAT_SUMMARY_KEEP_PAIRS
+        if upto - self.folded < 2 * CHAT_SUMMARY_EVERY:
+            return None
+        lines = list(self._context_lines)
+        start = self.messages - len(lines)
+        return upto, lines[max(0, self.folded - start):upto - start]
 
-def new_session(scenario_card: dict, level: str, strictness: float) -> SessionMem:
-    s = SessionMem(scenario_card, level, strictness)
-    SESSIONS[s.id] = s
+    def apply_summary(self, summary: str, upto: int) -> bool:
+        if upto <= self.folded or not summary.strip():
+            return False   # stale (a later fold landed first) or empty
+        self.summary = ellipsize(summary, CHAT_SUMMARY_MAX_CHARS)
+        self.folded = upto
+        self._context = None
+        return True
+
+    def merge(self, stored: "SessionMem") -> None:
+        """
+        Folds in the copy another worker saved since this one was read: each
+        field keeps whichever side got further (more messages, a later fold,
+        higher counters). Two turns added concurrently to one session cannot
+        both survive; the copy with more messages wins.
+        """
+        self.version = stored.version
+        if stored.messages > self.messages:
+            self.history, self._context_lines, self.messages = stored.history, stored._context_lines, stored.messages
+        if stored.folded > self.folded:
+            self.summary, self.folded = stored.summary, stored.folded
+        self.turns = max(self.turns, stored.turns)
+        self.reruns = max(self.reruns, stored.reruns)
+        self.last_seen = max(self.last_seen, stored.last_seen)
+        self._context = None
+
+    def expiry_reason(self, now: float) -> Optional[str]:
+        if SESSION_IDLE_TTL_S > 0 and now - self.last_seen > SESSION_IDLE_TTL_S:
+            return "idle"
+        if SESSION_MAX_AGE_S > 0 and now - self.created_at > SESSION_MAX_AGE_S:
+            return "max_age"
+        return None
+
+    def approx_bytes(self) -> int:
+        """Rough footprint: the object, its history and the strings it holds (the scenario card is shared)."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.history) + sys.getsizeof(self._context_lines)
+        for turn in self.history:
+            size += sys.getsizeof(turn) + sum(sys.getsizeof(v) for v in turn.values())
+        size += sum(sys.getsizeof(line) for line in self._context_lines)
+        size += sys.getsizeof(self.summary)
+        return size + (sys.getsizeof(self._context) if self._context else 0)
+
+# ---- Serialization (for backends that store sessions outside the process) ----
+_ROLE_CODES = {"user": "u", "assistant": "a"}
+_ROLES = {v: k for k, v in _ROLE_CODES.items()}
+_SCENARIOS: Dict[str, dict] = {}
+
+def register_scenarios(cards: Iterable[dict]) -> None:
+    """Known cards are stored by id instead of in full."""
+    for card in cards:
+        _SCENARIOS[card["id"]] = card
+
+def pack_session(s: SessionMem) -> bytes:
+    card = s.scenario_card
+    card_ref = card["id"] if _SCENARIOS.get(card.get("id")) is card else card
+    history = []
+    for turn in s.history:
+        history += (_ROLE_CODES.get(turn["role"], turn["role"]), turn["text"])
+    return msgpack.packb(
+        [2, s.id, s.user_id, s.level, s.strictness, card_ref, s.turns, s.reruns, history,
+         s.summary, s.folded, s.messages],
+        use_bin_type=True,
+    )
+
+def unpack_session(data: bytes, created_at: float, last_seen: float, version: int = 0) -> SessionMem:
+    fields = msgpack.unpackb(data, raw=False)
+    sid, user_id, level, strictness, card_ref, turns, reruns, history = fields[1:9]
+    card = _SCENARIOS.get(card_ref, {}) if isinstance(card_ref, str) else card_ref
+    s = SessionMem(card, level, strictness, user_id)
+    s.id, s.created_at, s.last_seen, s.turns, s.reruns = sid, created_at, last_seen, turns, reruns
+    s.version = version
+    for i in range(0, len(history), 2):
+        s._append(_ROLES.get(history[i], history[i]), history[i + 1])
+    if fields[0] >= 2:   # version 1 rows predate summaries
+        s.summary, s.folded, s.messages = fields[9:12]
+    s._context = None
     return s
 
-def get_session(session_id: str) -> SessionMem:
-    if session_id not in SESSIONS:
+# ---- Backends ----
+class SessionBackend:
+    """
+    Where live sessions are kept. Sessions handed out by get() may be copies,
+    so callers save() them after a mutation; save() never revives a session
+    that was ended or evicted in the meantime. When another copy was saved
+    first, save() writes nothing and returns the stored session to merge.
+    Every call goes through run(), which blocking backends move off the event loop.
+    """
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return fn(*args)
+
+    def add(self, s: SessionMem) -> None: ...
+    def get(self, session_id: str) -> Optional[SessionMem]: ...
+    def touch(self, s: SessionMem) -> None: ...
+    def save(self, s: SessionMem) -> Optional[SessionMem]: ...
+    def remove(self, session_id: str) -> bool: ...                 # True if this call removed it
+    def evict_lru(self, max_count: int) -> List[SessionMem]: ...   # least recently used beyond max_count
+    def expire(self, now: float) -> List[SessionMem]: ...          # removed because expiry_reason() is set
+    def stats(self) -> Dict[str, Any]: ...
+    def close(self) -> None: ...
+
+class MemorySessionBackend(SessionBackend):
+    """One process: sessions are shared by reference, so save() has nothing to do."""
+
+    def __init__(self):
+        self.sessions: "OrderedDict[str, SessionMem]" = OrderedDict()  # least recently used first
+
+    def add(self, s: SessionMem) -> None:
+        self.sessions[s.id] = s
+
+    def get(self, session_id: str) -> Optional[SessionMem]:
+        return self.sessions.get(session_id)
+
+    def touch(self, s: SessionMem) -> None:
+        if s.id in self.sessions:
+            self.sessions.move_to_end(s.id)
+
+    def save(self, s: SessionMem) -> Optional[SessionMem]:
+        return None
+
+    def remove(self, session_id: str) -> bool:
+        return self.sessions.pop(session_id, None) is not None
+
+    def evict_lru(self, max_count: int) -> List[SessionMem]:
+        evicted = []
+        while len(self.sessions) > max_count:
+            evicted.append(self.sessions.popitem(last=False)[1])
+        return evicted
+
+    def expire(self, now: float) -> List[SessionMem]:
+        expired = [s for s in self.sessions.values() if s.expiry_reason(now)]
+        for s in expired:
+            del self.sessions[s.id]
+        return expired
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "live": len(self.sessions),
+            "approx_bytes": sum(s.approx_bytes() for s in self.sessions.values()),
+        }
+
+    def close(self) -> None:
+        pass
+
+class SQLiteSessionBackend(SessionBackend):
+    """
+    One SQLite file in WAL mode shared by every worker on the host. Rows hold
+    msgpack blobs and a version; each statement is its own short transaction.
+    All statements run on one dedicated thread per process, which owns the
+    connection, so a busy lock (SESSION_DB_BUSY_TIMEOUT_S) never stalls the
+    event loop. save() is a compare-and-set on the version.
+    """
+
+    _COLUMNS = "id, created_at, last_seen, data, version"
+
+    def __init__(self, path: str, busy_timeout_s: float = SESSION_DB_BUSY_TIMEOUT_S):
+        self.path = path
+        self.busy_timeout_s = busy_timeout_s
+        self._conn: Optional[sqlite3.Connection] = None
+        self._thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-db")
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._thread, fn, *args)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Opened lazily so each worker process gets its own connection
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            conn = sqlite3.connect(
+                self.path, isolation_level=None, check_same_thread=False, timeout=self.busy_timeout_s,
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, created_at REAL NOT NULL, last_seen REAL NOT NULL, data BLOB NOT NULL, "
+                "version INTEGER NOT NULL DEFAULT 0)"
+            )
+            if "version" not in {row[1] for row in conn.execute("PRAGMA table_info(sessions)")}:
+                # Files created before compare-and-set saves
+                conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions(last_seen)")
+            self._conn = conn
+        return self._conn
+
+    def _unpack_rows(self, rows) -> List[SessionMem]:
+        return [
+            unpack_session(data, created_at, last_seen, version)
+            for _, created_at, last_seen, data, version in rows
+        ]
+
+    def add(self, s: SessionMem) -> None:
+        self.conn.execute(
+            "INSERT INTO sessions (id, created_at, last_seen, data) VALUES (?, ?, ?, ?)",
+            (s.id, s.created_at, s.last_seen, pack_session(s)),
+        )
+
+    def get(self, session_id: str) -> Optional[SessionMem]:
+        rows = self.conn.execute(f"SELECT {self._COLUMNS} FROM sessions WHERE id = ?", (session_id,)).fetchall()
+        return self._unpack_rows(rows)[0] if rows else None
+
+    def touch(self, s: SessionMem) -> None:
+        self.conn.execute("UPDATE sessions SET last_seen = ? WHERE id = ?", (s.last_seen, s.id))
+
+    def save(self, s: SessionMem) -> Optional[SessionMem]:
+        row = self.conn.execute(
+            "UPDATE sessions SET last_seen = ?, data = ?, version = version + 1 "
+            "WHERE id = ? AND version = ? RETURNING version",
+            (s.last_seen, pack_session(s), s.id, s.version),
+        ).fetchone()
+        if row is not None:
+            s.version = row[0]
+            return None
+        # Another worker saved first (merge and retry), or the row is gone (stays gone)
+        return self.get(s.id)
+
+    def remove(self, session_id: str) -> bool:
+        return bool(self.conn.execute("DELETE FROM sessions WHERE id = ? RETURNING id", (session_id,)).fetchall())
+
+    def evict_lru(self, max_count: int) -> List[SessionMem]:
+        # RETURNING hands each row to exactly one worker, so it is notified once
+        rows = self.conn.execute(
+            f"DELETE FROM sessions WHERE id IN "
+            f"(SELECT id FROM sessions ORDER BY last_seen DESC LIMIT -1 OFFSET ?) RETURNING {self._COLUMNS}",
+            (max_count,),
+        ).fetchall()
+        return self._unpack_rows(rows)
+
+    def expire(self, now: float) -> List[SessionMem]:
+        idle_before = now - SESSION_IDLE_TTL_S if SESSION_IDLE_TTL_S > 0 else float("-inf")
+        born_before = now - SESSION_MAX_AGE_S if SESSION_MAX_AGE_S > 0 else float("-inf")
+        rows = self.conn.execute(
+            f"DELETE FROM sessions WHERE last_seen < ? OR created_at < ? RETURNING {self._COLUMNS}",
+            (idle_before, born_before),
+        ).fetchall()
+        return self._unpack_rows(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        live, data_bytes = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sessions").fetchone()
+        return {"backend": "sqlite", "path": self.path, "live": live, "approx_bytes": data_bytes}
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+def make_backend(kind: str) -> SessionBackend:
+    if kind == "memory":
+        return MemorySessionBackend()
+    if kind == "sqlite":
+        return SQLiteSessionBackend(SESSION_DB_PATH)
+    raise ValueError(f"unknown SESSION_BACKEND {kind!r} (expected memory or sqlite)")
+
+_backend: SessionBackend = make_backend(SESSION_BACKEND)
+
+# ---- Eviction notifications ----
+EvictHook = Callable[[SessionMem, str], None]
+_on_evict: Optional[EvictHook] = None
+_EVICTIONS: Dict[str, int] = {"idle": 0, "max_age": 0, "capacity": 0}
+
+def set_evict_hook(hook: Optional[EvictHook]) -> None:
+    """Called as hook(session, reason) for every session dropped without /session/end."""
+    global _on_evict
+    _on_evict = hook
+
+def _evicted(sessions: List[SessionMem], reason: Optional[str] = None, now: float = 0.0) -> List[Tuple[SessionMem, str]]:
+    out = []
+    for s in sessions:
+        r = reason or s.expiry_reason(now) or "idle"
+        _EVICTIONS[r] += 1
+        out.append((s, r))
+    return out
+
+def _notify(evicted: List[Tuple[SessionMem, str]]) -> None:
+    if _on_evict is None:
+        return
+    for s, reason in evicted:
+        try:
+            _on_evict(s, reason)
+        except Exception:
+            _log.exception("evict hook failed for session %s", s.id)
+
+_notifying: "set[asyncio.Task]" = set()
+
+def _notify_later(evicted: List[Tuple[SessionMem, str]]) -> None:
+    """
+    Runs the hook in a worker thread, like the sweeper: it does blocking
+    Firestore writes, and the request that triggered the eviction is not
+    the one that owned the session.
+    """
+    if not evicted or _on_evict is None:
+        return
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        _notify(evicted)   # no event loop (scripts): nothing to block
+        return
+    task = asyncio.create_task(asyncio.to_thread(_notify, evicted))
+    _notifying.add(task)
+    task.add_done_callback(_notifying.discard)
+
+# ---- Public API ----
+_SAVE_ATTEMPTS = 3
+_SAVES: Counter = Counter()
+
+async def new_session(scenario_card: dict, level: str, strictness: float, user_id: str = "") -> SessionMem:
+    s = SessionMem(scenario_card, level, strictness, user_id)
+    await _backend.run(_backend.add, s)
+    if SESSION_MAX_COUNT > 0:
+        _notify_later(_evicted(await _backend.run(_backend.evict_lru, SESSION_MAX_COUNT), "capacity"))
+    return s
+
+async def get_session(session_id: str) -> SessionMem:
+    s = await _backend.run(_backend.get, session_id)
+    if s is None:
         raise KeyError("Session not found")
-    return SESSIONS[session_id]
+    now = time.time()
+    reason = s.expiry_reason(now)
+    if reason:
+        if await _backend.run(_backend.remove, session_id):
+            _notify_later(_evicted([s], reason))
+        raise KeyError("Session expired")
+    s.last_seen = now
+    await _backend.run(_backend.touch, s)
+    return s
+
+async def save_session(s: SessionMem) -> None:
+    """Persist turns/history after a mutation (a no-op for the in-memory backend)."""
+    for _ in range(_SAVE_ATTEMPTS):
+        stored = await _backend.run(_backend.save, s)
+        if stored is None:
+            return
+        # Merged here, on the event loop, where every other reader of s runs
+        s.merge(stored)
+        _SAVES["merged"] += 1
+    _SAVES["gave_up"] += 1
+    _log.warning("session %s: save kept conflicting, dropped this copy's changes", s.id)
+
+async def end_session(session_id: str) -> None:
+    await _backend.run(_backend.remove, session_id)
+
+# ---- Expiry sweeper (started/stopped by the app lifespan) ----
+_sweeper: Optional[asyncio.Task] = None
+
+async def sweep() -> List[Tuple[SessionMem, str]]:
+    """Drop every expired session; returns (session, reason) without notifying."""
+    now = time.time()
+    return _evicted(await _backend.run(_backend.expire, now), now=now)
+
+async def _sweep_loop() -> None:
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL_S)
+        try:
+            expired = await sweep()
+        except sqlite3.Error:
+            _log.exception("session sweep failed")
+            continue
+        if expired:
+            # The hook does blocking Firestore writes; keep them off the event loop
+            await asyncio.to_thread(_notify, expired)
+
+async def startup() -> None:
+    global _sweeper
+    if SESSION_SWEEP_INTERVAL_S > 0 and (_sweeper is None or _sweeper.done()):
+        _sweeper = asyncio.create_task(_sweep_loop())
+
+async def shutdown() -> None:
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        await asyncio.gather(_sweeper, return_exceptions=True)
+        _sweeper = None
+    # Eviction markers already handed off still get written
+    await asyncio.gather(*_notifying, return_exceptions=True)
+    await _backend.run(_backend.close)
 
-def end_session(session_id: str):
-    SESSIONS.pop(session_id, None)
+async def session_stats() -> Dict[str, Any]:
+    return {
+        **await _backend.run(_backend.stats),
+        "max": SESSION_MAX_COUNT,
+        "idle_ttl_s": SESSION_IDLE_TTL_S,
+        "max_age_s": SESSION_MAX_AGE_S,
+        "evicted": dict(_EVICTIONS),
+        "saves": dict(_SAVES),
+    }
@@ -0,0 +1,323 @@
+# shards.py (compressed daily dataset shards with a sidecar turn index)
+#
+#   cd backend
+#   python -m app.api.chat.shards compact [--min-age-s SESSION_IDLE_TTL_S] [--keep]
+#   python -m app.api.chat.shards lookup --session ID | --scenario ID | --level B1 [--day 2026-10-18]
+#   python -m app.api.chat.shards stats
+#
+# Layout: <DATASET_SHARD_DIR>/<YYYY-MM-DD>/<prefix>-<nnnn>.jsonl.gz. A shard is a
+# concatenation of gzip members (so gzip/zcat read it whole), one member
+# per session file or per writer batch. Next to each shard, <name>.idx.jsonl
+# has one line per member: session_id, scenario_id, level, offset, length,
+# rows, and for compacted files the source identity. A lookup reads the small
+# index files and seeks straight to the members.
+import argparse
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, IO, Iterator, List, Optional, Tuple
+
+from .config import DATASET_DIR, DATASET_SHARD_DIR, DATASET_SHARD_MAX_BYTES, SESSION_IDLE_TTL_S
+
+SHARD_SUFFIX = ".jsonl.gz"
+INDEX_SUFFIX = ".idx.jsonl"
+COMPACTING_SUFFIX = ".compacting"
+_DAY_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+# A file idle this long belongs to an expired session, so no more rows are coming
+# (a late row still is not lost: see compact())
+COMPACT_MIN_AGE_S = SESSION_IDLE_TTL_S if SESSION_IDLE_TTL_S > 0 else 3600.0
+
+
+def row_day(row: Dict[str, Any], fallback: float = 0.0) -> str:
+    ts = str(row.get("ts") or "")
+    if _DAY_RE.match(ts[:10]):
+        return ts[:10]
+    return time.strftime("%Y-%m-%d", time.localtime(fallback or time.time()))
+
+
+class ShardAppender:
+    """
+    Appends gzip members to size-bounded shards. Exactly one appender may use
+    a given prefix at a time; "{pid}" in the prefix is filled in when a shard
+    is opened, so the hot writer gets one prefix per worker process. fsync has
+    the DATASET_FSYNC meanings: "flush" after every member, "close", "never".
+    """
+
+    def __init__(self, root: str, prefix: str, max_bytes: int = DATASET_SHARD_MAX_BYTES, fsync: str = "close"):
+        self.root = root
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self._open: Dict[str, Tuple[str, IO[bytes], IO[str]]] = {}   # day -> (shard name, shard, index)
+
+    def _shard_for(self, day: str) -> Tuple[str, IO[bytes], IO[str]]:
+        current = self._open.get(day)
+        if current is not None and current[1].tell() < self.max_bytes:
+            return current
+        if current is not None:
+            self._close_day(day)
+        day_dir = os.path.join(self.root, day)
+        os.makedirs(day_dir, exist_ok=True)
+        prefix = self.prefix.format(pid=os.getpid())
+        parts = sorted(glob.glob(os.path.join(day_dir, f"{prefix}-[0-9][0-9][0-9][0-9]{SHARD_SUFFIX}")))
+        n = int(os.path.basename(parts[-1])[len(prefix) + 1:][:4]) if parts else 0
+        if parts and os.path.getsize(parts[-1]) >= self.max_bytes:
+            n += 1
+        name = f"{day}/{prefix}-{n:04d}{SHARD_SUFFIX}"
+        path = os.path.join(self.root, name)
+        shard = open(path, "ab")
+        index = open(path[:-len(SHARD_SUFFIX)] + INDEX_SUFFIX, "a", encoding="utf-8")
+        self._open[day] = (name, shard, index)
+        return self._open[day]
+
+    def append(
+        self, day: str, session_id: str, scenario_id: str, level: str, lines: List[str], source: str = "",
+    ) -> Dict[str, Any]:
+        """Writes lines (JSONL, newline-terminated) as one member and indexes it."""
+        name, shard, index = self._shard_for(day)
+        member = gzip.compress("".join(lines).encode("utf-8"), mtime=0)
+        offset = shard.seek(0, os.SEEK_END)
+        shard.write(member)
+        shard.flush()
+        if self.fsync == "flush":
+            os.fsync(shard.fileno())
+        # Index after the data: a crash leaves at worst unindexed bytes, never a dangling entry
+        entry = {
+            "session_id": session_id, "scenario_id": scenario_id, "level": level,
+            "shard": name, "offset": offset, "length": len(member), "rows": len(lines),
+        }
+        if source:
+            entry["source"] = source
+        index.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        index.flush()
+        if self.fsync == "flush":
+            os.fsync(index.fileno())
+        return entry
+
+    def _close_day(self, day: str) -> None:
+        _, shard, index = self._open.pop(day)
+        for f in (shard, index):
+            f.flush()
+            if self.fsync != "never":
+                os.fsync(f.fileno())
+            f.close()
+
+    def close(self) -> None:
+        for day in list(self._open):
+            self._close_day(day)
+
+
+# ---- Reading ----
+
+def iter_index(root: str, day: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    pattern = os.path.join(root, day or "*", "*" + INDEX_SUFFIX)
+    for path in sorted(glob.glob(pattern)):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a crash
+
+
+def read_member(root: str, entry: Dict[str, Any]) -> List[Dict[str, Any]]:
+    with open(os.path.join(root, entry["shard"]), "rb") as f:
+        f.seek(entry["offset"])
+        data = gzip.decompress(f.read(entry["length"]))
+    return [json.loads(line) for line in data.decode("utf-8").splitlines() if line.strip()]
+
+
+def lookup(
+    root: str, session_id: Optional[str] = None, scenario_id: Optional[str] = None,
+    level: Optional[str] = None, day: Optional[str] = None,
+) -> Iterator[Dict[str, Any]]:
+    """Rows matching every given key, read by seeking to the indexed members."""
+    for entry in iter_index(root, day):
+        if session_id and entry.get("session_id") != session_id:
+            continue
+        if scenario_id and entry.get("scenario_id") != scenario_id:
+            continue
+        if level and entry.get("level") != level:
+            continue
+        yield from read_member(root, entry)
+
+
+def iter_rows(root: str) -> Iterator[Dict[str, Any]]:
+    """Every indexed row, member by member."""
+    for entry in iter_index(root):
+        yield from read_member(root, entry)
+
+
+def iter_dataset(dataset_dir: str = DATASET_DIR, root: str = DATASET_SHARD_DIR) -> Iterator[Dict[str, Any]]:
+    """Shard rows, then the session files not compacted yet."""
+    yield from iter_rows(root)
+    leftovers, fresh = _session_files(dataset_dir)
+    indexed = _indexed_sources(root) if leftovers else set()
+    for leftover, path in [(True, p) for p in leftovers] + [(False, p) for p in fresh]:
+        data, st = _read_stable(path)
+        if leftover and _source_id(path, st, data) in indexed:
+            continue  # compacted by a run that crashed before unlinking it
+        yield from _parse_lines(data)[1]
+
+
+# ---- Compaction ----
+
+def _session_files(dataset_dir: str) -> Tuple[List[str], List[str]]:
+    """(files a crashed compaction left renamed, live session-*.jsonl files)"""
+    pattern = os.path.join(dataset_dir, "session-*.jsonl")
+    return sorted(glob.glob(pattern + COMPACTING_SUFFIX)), sorted(glob.glob(pattern))
+
+
+def _indexed_sources(root: str) -> set:
+    return {e["source"] for e in iter_index(root) if e.get("source")}
+
+
+def _source_id(path: str, st: os.stat_result, data: bytes) -> str:
+    # Name + inode + content: a file that grew, or a new file under the same name, is a new source
+    name = os.path.basename(path)
+    if name.endswith(COMPACTING_SUFFIX):
+        name = name[:-len(COMPACTING_SUFFIX)]
+    return f"{name}:{st.st_ino}:{len(data)}:{hashlib.sha256(data).hexdigest()[:32]}"
+
+
+def _read_stable(path: str, attempts: int = 5) -> Tuple[bytes, os.stat_result]:
+    """Reads the whole file, again if it changed while being read."""
+    for _ in range(attempts):
+        before = os.stat(path)
+        with open(path, "rb") as f:
+            data = f.read()
+        after = os.stat(path)
+        if after.st_size == len(data) and after.st_mtime_ns == before.st_mtime_ns:
+            break
+    return data, after
+
+
+def _parse_lines(data: bytes) -> Tuple[List[str], List[Dict[str, Any]]]:
+    lines, rows = [], []
+    for line in data.decode("utf-8", errors="replace").splitlines(keepends=True):
+        try:
+            row = json.loads(line)
+        except ValueError:
+            continue  # torn last line from a crash
+        if isinstance(row, dict):
+            lines.append(line if line.endswith("\n") else line + "\n")
+            rows.append(row)
+    return lines, rows
+
+
+def compact(
+    dataset_dir: str = DATASET_DIR, root: str = DATASET_SHARD_DIR, min_age_s: float = COMPACT_MIN_AGE_S,
+    max_bytes: int = DATASET_SHARD_MAX_BYTES, keep: bool = False,
+) -> Counter:
+    """
+    Rolls session-*.jsonl files not modified for min_age_s into daily shards
+    (by the first row's ts) and deletes them once data and index are fsynced.
+
+    Each file is first renamed to *.compacting, so the writer opens a fresh
+    file for any later row, and then read until two stats agree. A row the
+    writer still puts into the renamed file is written again to the fresh
+    file (DatasetWriter checks the path after every write). A live writer
+    never loses a row this way, but a row can end up both in a shard and in
+    the next session file. Each index entry records its source (name,
+    inode, size, sha256). A file that a crashed run already indexed is
+    therefore only unlinked, and one that changed since is compacted again.
+    With keep=True files are read in place and left alone.
+    """
+    stats: Counter = Counter()
+    indexed = _indexed_sources(root)
+    appender = ShardAppender(root, "compact", max_bytes, fsync="flush")
+    cutoff = time.time() - min_age_s
+    leftovers, fresh = _session_files(dataset_dir)
+    try:
+        # Leftovers first: renaming a live file must never overwrite one
+        for leftover, path in [(True, p) for p in leftovers] + [(False, p) for p in fresh]:
+            work = path
+            if not leftover:
+                if os.path.getmtime(path) > cutoff:
+                    stats["skipped_recent"] += 1
+                    continue
+                if not keep:
+                    work = path + COMPACTING_SUFFIX
+                    os.rename(path, work)
+            else:
+                stats["resumed"] += 1
+            data, st = _read_stable(work)
+            lines, rows = _parse_lines(data)
+            source = _source_id(work, st, data)
+            if rows:
+                first = rows[0]
+                session_id = first.get("session_id") or os.path.basename(path)[len("session-"):].split(".jsonl")[0]
+                if source in indexed:
+                    stats["already_compacted"] += 1
+                else:
+                    appender.append(
+                        row_day(first, st.st_mtime), session_id,
+                        first.get("scenario_id", ""), first.get("level", ""), lines, source,
+                    )
+                    indexed.add(source)
+                    stats["sessions"] += 1
+                    stats["rows"] += len(rows)
+                    stats["bytes_in"] += len(data)
+            if not keep:
+                os.remove(work)
+                stats["files_removed"] += 1
+    finally:
+        appender.close()
+    return stats
+
+
+def shard_stats(root: str) -> Dict[str, Any]:
+    shards = glob.glob(os.path.join(root, "*", "*" + SHARD_SUFFIX))
+    entries = list(iter_index(root))
+    return {
+        "days": len({os.path.basename(os.path.dirname(p)) for p in shards}),
+        "shards": len(shards),
+        "bytes": sum(os.path.getsize(p) for p in shards),
+        "members": len(entries),
+        "rows": sum(e.get("rows", 0) for e in entries),
+        "sessions": len({e.get("session_id") for e in entries}),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compact and query the chat dataset shards")
+    parser.add_argument("--dataset", default=DATASET_DIR)
+    parser.add_argument("--shards", default=DATASET_SHARD_DIR)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("compact", help="roll session-*.jsonl files into daily shards")
+    p.add_argument("--min-age-s", type=float, default=COMPACT_MIN_AGE_S, help="leave files modified more recently")
+    p.add_argument("--max-bytes", type=int, default=DATASET_SHARD_MAX_BYTES)
+    p.add_argument("--keep", action="store_true", help="do not delete compacted session files")
+
+    p = sub.add_parser("lookup", help="print the rows of matching sessions as JSONL")
+    p.add_argument("--session")
+    p.add_argument("--scenario")
+    p.add_argument("--level")
+    p.add_argument("--day")
+
+    sub.add_parser("stats", help="summarize the shards")
+    args = parser.parse_args(argv)
+
+    if args.cmd == "compact":
+        start = time.perf_counter()
+        stats = compact(args.dataset, args.shards, args.min_age_s, args.max_bytes, args.keep)
+        print(json.dumps({**stats, "seconds": round(time.perf_counter() - start, 2)}))
+    elif args.cmd == "lookup":
+        if not (args.session or args.scenario or args.level or args.day):
+            parser.error("lookup needs --session, --scenario, --level or --day")
+        for row in lookup(args.shards, args.session, args.scenario, args.level, args.day):
+            print(json.dumps(row, ensure_ascii=False))
+    else:
+        print(json.dumps(shard_stats(args.shards)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
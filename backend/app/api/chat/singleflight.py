@@ -0,0 +1,166 @@
+# singleflight.py (coalesce identical in-flight LLM requests)
+import asyncio
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+_END = object()
+
+
+def _remaining(deadline: Optional[float]) -> Optional[float]:
+    return None if deadline is None else max(0.0, deadline - asyncio.get_running_loop().time())
+
+
+def _covers(flight_deadline: Optional[float], deadline: Optional[float]) -> bool:
+    """A flight can serve a caller only if it is allowed to run at least as long as the caller."""
+    return flight_deadline is None or (deadline is not None and deadline <= flight_deadline)
+
+
+class _PlainFlight:
+    def __init__(self, task: asyncio.Task, deadline: Optional[float]):
+        self.task = task
+        self.deadline = deadline
+        self.waiters = 0
+
+
+class _StreamFlight:
+    """One upstream stream fanned out to any number of subscribers."""
+
+    def __init__(self, source: AsyncIterator[str], deadline: Optional[float]):
+        self.deadline = deadline
+        self.chunks: List[str] = []          # replayed to late subscribers
+        self.end: Any = None                 # _END or the upstream exception once finished
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.refs = 0                        # started subscriptions not yet closed
+        self.on_finish: Callable[[], None] = lambda: None
+        self.task = asyncio.create_task(self._run(source))
+
+    async def _run(self, source: AsyncIterator[str]) -> None:
+        end: Any = _END
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                for q in self.subscribers:
+                    q.put_nowait(chunk)
+        except asyncio.CancelledError:
+            end = RuntimeError("shared LLM stream was cancelled")
+            raise
+        except Exception as e:
+            end = e
+        finally:
+            self.on_finish()
+            self.end = end
+            for q in self.subscribers:
+                q.put_nowait(end)
+
+    async def subscribe(
+        self, deadline: Optional[float], deadline_error: Callable[[str], Exception],
+    ) -> AsyncGenerator[str, None]:
+        # The ref is taken here, on first iteration: a generator that is never
+        # started never runs its finally, so it must never hold one
+        self.refs += 1
+        q: asyncio.Queue = asyncio.Queue()
+        for chunk in self.chunks:
+            q.put_nowait(chunk)
+        if self.end is not None:
+            q.put_nowait(self.end)
+        self.subscribers.add(q)
+        try:
+            while True:
+                try:
+                    # The shared stream may outlive this subscriber's own deadline
+                    item = await asyncio.wait_for(q.get(), _remaining(deadline))
+                except asyncio.TimeoutError:
+                    raise deadline_error("shared LLM stream passed this request's deadline") from None
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            self.subscribers.discard(q)
+            self.refs -= 1
+            if self.refs <= 0 and not self.task.done():
+                # Last subscriber left: stop the upstream generation
+                self.on_finish()
+                self.task.cancel()
+
+
+class SingleFlight:
+    """
+    Identical requests that arrive while one is already running share its
+    result (plain) or its token stream (streaming) instead of going upstream again.
+    The flight runs under its leader's deadline (event-loop time): a caller
+    whose deadline is later than that goes upstream on its own ("bypassed"),
+    and every caller still gives up at its own deadline with deadline_error.
+    Callers put everything that changes how the call runs (e.g. priority) in the key.
+    """
+
+    def __init__(self, deadline_error: Callable[[str], Exception] = TimeoutError):
+        self.deadline_error = deadline_error
+        self._plain: Dict[Hashable, _PlainFlight] = {}
+        self._streams: Dict[Hashable, _StreamFlight] = {}
+        self.leaders = 0
+        self.followers = 0
+        self.bypassed = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]], deadline: Optional[float] = None) -> Any:
+        flight = self._plain.get(key)
+        if flight is not None and not _covers(flight.deadline, deadline):
+            self.bypassed += 1
+            return await fn()
+        if flight is None:
+            flight = _PlainFlight(asyncio.create_task(fn()), deadline)
+            self._plain[key] = flight
+            flight.task.add_done_callback(lambda t, k=key, f=flight: self._drop_plain(k, f))
+            self.leaders += 1
+        else:
+            self.followers += 1
+
+        flight.waiters += 1
+        try:
+            # shield: one caller giving up must not cancel the shared call
+            return await asyncio.wait_for(asyncio.shield(flight.task), _remaining(deadline))
+        except asyncio.TimeoutError:
+            if flight.task.done():
+                raise   # the shared call itself timed out
+            raise self.deadline_error("shared LLM call passed this request's deadline") from None
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                self._drop_plain(key, flight)
+                flight.task.cancel()
+
+    def _drop_plain(self, key: Hashable, flight: _PlainFlight) -> None:
+        if self._plain.get(key) is flight:
+            del self._plain[key]
+        # Nobody may be left to read it; avoid "exception was never retrieved"
+        if flight.task.done() and not flight.task.cancelled():
+            flight.task.exception()
+
+    def stream(
+        self, key: Hashable, factory: Callable[[], AsyncIterator[str]], deadline: Optional[float] = None,
+    ) -> AsyncIterator[str]:
+        flight = self._streams.get(key)
+        if flight is not None and not _covers(flight.deadline, deadline):
+            self.bypassed += 1
+            return factory()
+        if flight is None:
+            flight = _StreamFlight(factory(), deadline)
+            flight.on_finish = lambda k=key, f=flight: self._drop_stream(k, f)
+            self._streams[key] = flight
+            self.leaders += 1
+        else:
+            self.followers += 1
+        return flight.subscribe(deadline, self.deadline_error)
+
+    def _drop_stream(self, key: Hashable, flight: _StreamFlight) -> None:
+        if self._streams.get(key) is flight:
+            del self._streams[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight_plain": len(self._plain),
+            "in_flight_streams": len(self._streams),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "bypassed": self.bypassed,
+        }
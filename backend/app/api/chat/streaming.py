@@ -0,0 +1,166 @@
+# streaming.py (helpers for the SSE pipeline)
+import asyncio
+import json
+import time
+from collections import Counter, deque
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, AsyncIterator, Deque, Dict, Optional
+
+_END = object()
+
+
+class BufferedStream:
+    """
+    Starts consuming an async generator right away in a background task and
+    buffers its items until someone iterates. Errors are re-raised to the reader.
+    cancel() stops the task, which also closes the upstream generator.
+    """
+
+    def __init__(self, source: AsyncIterator[str]):
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self.received = 0
+        self._task: Optional[asyncio.Task] = asyncio.create_task(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[str]) -> None:
+        try:
+            async for item in source:
+                self.received += 1
+                self._queue.put_nowait(item)
+        except Exception as e:
+            self._queue.put_nowait(e)
+        finally:
+            self._queue.put_nowait(_END)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        item = await self._queue.get()
+        if item is _END:
+            self._queue.put_nowait(_END)  # keep later reads terminated too
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    async def batches(self, window_s: float = 0.0, max_chars: int = 0) -> AsyncGenerator[str, None]:
+        """
+        Iterates like the stream itself, but joins consecutive items: after the
+        first one of a batch it keeps collecting for up to window_s (or until
+        max_chars) and yields them as one string. The very first batch never
+        waits, so time to first token is unchanged. Whatever is already
+        buffered is always merged.
+        """
+        loop = asyncio.get_running_loop()
+        window = 0.0
+        while True:
+            item = await self._queue.get()
+            tail: Any = None
+            if item is _END or isinstance(item, Exception):
+                parts, tail = [], item
+            else:
+                parts, size = [item], len(item)
+                flush_at = loop.time() + window
+                while not max_chars or size < max_chars:
+                    if self._queue.empty():
+                        remaining = flush_at - loop.time()
+                        if remaining <= 0:
+                            break
+                        await asyncio.sleep(remaining)
+                        if self._queue.empty():
+                            break
+                    item = self._queue.get_nowait()
+                    if item is _END or isinstance(item, Exception):
+                        tail = item
+                        break
+                    parts.append(item)
+                    size += len(item)
+            if parts:
+                yield "".join(parts)
+                window = window_s
+            if tail is _END:
+                self._queue.put_nowait(_END)
+                return
+            if tail is not None:
+                raise tail
+
+    def cancel(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+
+# ---- Ollama NDJSON ----
+
+_CONTENT_KEY = b'"content"'
+_EMPTY_CONTENT = b'"content":""'
+
+
+def _line_content(line: bytes) -> str:
+    # Cheap byte checks first: blank lines and the final done line carry no text
+    if _CONTENT_KEY not in line or _EMPTY_CONTENT in line:
+        return ""
+    try:
+        obj = json.loads(line)  # bytes in, no separate decode pass
+    except ValueError:
+        return ""
+    message = obj.get("message") if isinstance(obj, dict) else None
+    return (message.get("content") or "") if isinstance(message, dict) else ""
+
+
+class NDJSONContent:
+    """Splits raw /api/chat stream bytes into lines and returns the message contents."""
+
+    def __init__(self):
+        self._tail = b""
+
+    def feed(self, chunk: bytes) -> str:
+        data = self._tail + chunk if self._tail else chunk
+        lines = data.split(b"\n")
+        self._tail = lines.pop()
+        return "".join([_line_content(line) for line in lines])
+
+    def flush(self) -> str:
+        tail, self._tail = self._tail, b""
+        return _line_content(tail) if tail.strip() else ""
+
+
+# ---- per-stream metrics ----
+
+SSE_TOTALS: Counter = Counter()
+_RECENT_STREAMS: Deque[Dict[str, Any]] = deque(maxlen=50)
+
+
+class SSEMeter:
+    """Counts the SSE events/bytes one response writes and the upstream deltas merged into them."""
+
+    def __init__(self):
+        self.events = 0
+        self.bytes = 0
+        self.deltas = 0
+        self.started = time.monotonic()
+
+    async def wrap(self, events: AsyncIterator[bytes]) -> AsyncGenerator[bytes, None]:
+        try:
+            async with aclosing(events):
+                async for payload in events:
+                    self.events += 1
+                    self.bytes += len(payload)
+                    yield payload
+        finally:
+            self._record()
+
+    def _record(self) -> None:
+        SSE_TOTALS["streams"] += 1
+        SSE_TOTALS["events"] += self.events
+        SSE_TOTALS["bytes"] += self.bytes
+        SSE_TOTALS["deltas"] += self.deltas
+        _RECENT_STREAMS.append({
+            "events": self.events,
+            "bytes": self.bytes,
+            "deltas": self.deltas,
+            "duration_ms": round(1000 * (time.monotonic() - self.started), 1),
+        })
+
+
+def sse_stats() -> Dict[str, Any]:
+    return {"totals": dict(SSE_TOTALS), "recent": list(_RECENT_STREAMS)}
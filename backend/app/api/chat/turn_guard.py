@@ -0,0 +1,114 @@
+# turn_guard.py (one running turn per session: supersede the previous one or queue behind it)
+import asyncio
+from collections import Counter
+from typing import Any, Dict, List, Set
+
+
+class TurnSuperseded(Exception):
+    """A newer turn for the same session replaced this one."""
+
+
+class Turn:
+    """
+    One /chat or /stream turn. Work attached with attach() (BufferedStreams,
+    tasks) is cancelled when the turn is superseded, which also closes the
+    upstream Ollama requests it was reading.
+    """
+
+    __slots__ = ("session_id", "waited", "_superseded", "_finished", "_attached")
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.waited = False   # started after an earlier turn finished; re-read the session
+        self._superseded = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._attached: List[Any] = []
+
+    @property
+    def superseded(self) -> bool:
+        return self._superseded.is_set()
+
+    def attach(self, *work: Any) -> None:
+        for item in work:
+            if item is None:
+                continue
+            if self.superseded:
+                item.cancel()
+            else:
+                self._attached.append(item)
+
+    def check(self) -> None:
+        if self.superseded:
+            raise TurnSuperseded(self.session_id)
+
+    def _supersede(self) -> int:
+        self._superseded.set()
+        cancelled = 0
+        for item in self._attached:
+            done = getattr(item, "done", None)
+            if done is None or not done():
+                item.cancel()
+                cancelled += 1
+        self._attached.clear()
+        return cancelled
+
+
+class TurnGuard:
+    """
+    policy="cancel": a new turn supersedes the running one and starts once it has unwound.
+    policy="queue":  a new turn waits until the running one finishes.
+    policy="off":    turns run independently (the old behaviour).
+    Per process: with a shared session backend, two workers can still overlap.
+    """
+
+    def __init__(self, policy: str = "cancel"):
+        if policy not in ("cancel", "queue", "off"):
+            raise ValueError(f"unknown turn policy {policy!r} (expected cancel, queue or off)")
+        self.policy = policy
+        self._latest: Dict[str, Turn] = {}
+        self._stats: Counter = Counter()
+        self._pending: Set[asyncio.Future] = set()
+
+    async def begin(self, session_id: str) -> Turn:
+        """Registers a turn; raises TurnSuperseded if a newer one replaces it while it waits."""
+        turn = Turn(session_id)
+        self._stats["turns"] += 1
+        if self.policy == "off":
+            return turn
+        prev = self._latest.get(session_id)
+        self._latest[session_id] = turn
+        if prev is None or prev._finished.is_set():
+            return turn
+
+        if self.policy == "cancel":
+            self._stats["superseded"] += 1
+            self._stats["cancelled_work"] += prev._supersede()
+        else:
+            self._stats["queued"] += 1
+        turn.waited = True
+        # Even when superseded itself, wait for the previous turn so turns unwind in order
+        try:
+            await prev._finished.wait()
+        except BaseException:
+            # Later turns wait on this one: release them only after prev is done as well
+            task = asyncio.ensure_future(self._end_after(prev, turn))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+            raise
+        if turn.superseded:
+            self.end(turn)
+            turn.check()
+        return turn
+
+    async def _end_after(self, prev: Turn, turn: Turn) -> None:
+        await prev._finished.wait()
+        self.end(turn)
+
+    def end(self, turn: Turn) -> None:
+        turn._attached.clear()
+        turn._finished.set()
+        if self._latest.get(turn.session_id) is turn:
+            del self._latest[turn.session_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"policy": self.policy, "active": len(self._latest), **self._stats}
@@ -15,12 +15,11 @@ from firebase_admin.firestore import SERVER_TIMESTAMP
 
 from services.pronunciation_stats import update_pronunciation_error_map
 from services.practice_sentences import get_single_practice_sentence
+from services.alignment import align
 
 
-import difflib
 from fastapi import File, Form, HTTPException, UploadFile
 from fastapi.responses import JSONResponse
-from jiwer import wer
 from vosk import KaldiRecognizer
 from fastapi import APIRouter
 from .config import (
@@ -149,10 +148,6 @@ def _recognize_words(wav_path: Path) -> Dict:
     hyp = " ".join(w.get("word", "") for w in words).strip()
     return {"text": hyp, "words": words}
 
-def _align_tokens(ref_tokens: List[str], hyp_tokens: List[str]):
-    sm = difflib.SequenceMatcher(a=ref_tokens, b=hyp_tokens, autojunk=False)
-    return sm.get_opcodes()
-
 def _build_hyp_index_map(hyp_words: List[Dict]) -> Dict[int, Dict]:
     return {i: w for i, w in enumerate(hyp_words)}
 
@@ -317,12 +312,15 @@ async def score_audio(
             "hints": ["I couldn’t hear enough speech. Try again closer to the mic and speak clearly."]
         })
 
+    # One alignment pass gives both the WER and the per-word opcodes
+    alignment = align(ref_tokens, hyp_tokens, autojunk=False)
+
     # Base score (WER)
-    base_overall = round(100 * (1 - wer(" ".join(ref_tokens), " ".join(hyp_tokens))))
+    base_overall = round(100 * (1 - alignment.wer))
     base_overall = max(0, min(100, base_overall))
 
     # Alignment + per-word labels
-    opcodes = _align_tokens(ref_tokens, hyp_tokens)
+    opcodes = alignment.opcodes
     hyp_index_map = _build_hyp_index_map(hyp_words)
 
     reference_tokens_output: List[Dict] = []
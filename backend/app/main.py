@@ -1,12 +1,30 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from app.core.cors import setup_cors
 from app.api.quiz.router import router as quiz_router
-from app.api.chat.router import router as chat_router
+from app.api.chat.router import router as chat_router, SCENARIOS, cancel_summaries
 from app.api.pronunciation.router import router as pronunciation_router
 from app.api.users.router import router as users_router
-
-
-app = FastAPI(title="Language Learning Backend")
+from app.api.chat import correction_memory, llm_client, report, session_store
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await llm_client.startup(warm_briefs=[card["brief"] for card in SCENARIOS.values()])
+    await session_store.startup()
+    await report.startup()
+    await correction_memory.startup()
+    try:
+        yield
+    finally:
+        await correction_memory.shutdown()
+        await report.shutdown()
+        await session_store.shutdown()
+        await cancel_summaries()
+        await llm_client.shutdown()
+
+
+app = FastAPI(title="Language Learning Backend", lifespan=lifespan)
 
 setup_cors(app)
 
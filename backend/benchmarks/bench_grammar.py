@@ -0,0 +1,106 @@
+# bench_grammar.py (compiled grammar classifier vs the frozen legacy one)
+#
+#   cd backend
+#   python -m benchmarks.bench_grammar [--dataset DIR] [--repeat N]
+#
+# Labels every (before, after) pair with both implementations, fails if any
+# label differs, then reports the time per call for each. "memoized" is the
+# guess_reason() entry point with its label LRU warm.
+import argparse
+import difflib
+import os
+import re
+import sys
+import time
+
+from app.api.chat import grammar
+from benchmarks import corpus, legacy_grammar
+
+
+def _word_tokens(text: str) -> list:
+    # Same tokenizer as the chat router
+    return re.findall(r"[A-Za-z']+|[0-9]+|[^\sA-Za-z0-9]", text or "")
+
+
+def _diff_pairs(src: str, dst: str):
+    a, b = _word_tokens(src), _word_tokens(dst)
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(a=a, b=b).get_opcodes():
+        if tag != "equal":
+            yield " ".join(a[i1:i2]).strip(), " ".join(b[j1:j2]).strip()
+
+
+def dataset_pairs(dataset_dir: str) -> list:
+    pairs = []
+    for user_text, corrected in corpus.dataset_pairs(dataset_dir):
+        pairs.extend(_diff_pairs(user_text, corrected))
+    return pairs
+
+
+def synthetic_pairs() -> list:
+    """Pairs that hit every rule, built from the lexicon tables themselves."""
+    pairs = []
+    for c, exp in grammar._CONTRACTIONS.items():
+        pairs += [(c, exp), (exp, c), (c.replace("'", ""), c), (c.capitalize(), exp)]
+    for lemma, past in grammar._IRREGULAR_PAST.items():
+        pairs += [(lemma, past), (lemma + "ed", past), (lemma[:-1] or lemma, past), (past, lemma)]
+    for base, (comp, sup) in grammar._IRREGULAR_ADJ.items():
+        pairs += [(base, comp), (sup, base), ("more " + base, comp), (base + "er", comp)]
+    for c, exp in grammar._COLLOQUIAL.items():
+        pairs += [(c, exp), ("i " + c, "i " + exp)]
+    words = sorted(
+        grammar._MODALS | grammar._AUX_FORMS | grammar._PREPOSITIONS | grammar._PRONOUNS
+        | grammar._CONJUNCTIONS | grammar._DETERMINERS
+    )
+    for i, w in enumerate(words):
+        other = words[(i * 7 + 3) % len(words)]
+        pairs += [(w, other), (w, ""), ("", w), (w + " house", other + " house"), (w + "'s", w)]
+    for w in ("walk", "stop", "study", "make", "run", "box", "city", "quick", "happy", "big"):
+        pairs += [
+            (w, w + "ed"), (w, w + "ing"), (w, w + "s"), (w, w + "es"), (w, w + "ly"),
+            (w, w[:-1] + "ies"), (w, w + w[-1] + "ing"), (w, w.upper()), (w + ",", w + "."),
+            (w, w + "?"), (w, "elephant"), (w + " than", w), (w + "x", w),
+        ]
+    return pairs
+
+
+def _time_per_call(fn, pairs: list, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for before, after in pairs:
+            fn(before, after)
+        best = min(best, time.perf_counter() - start)
+    return best / len(pairs)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Compare the compiled grammar classifier with the legacy one")
+    parser.add_argument("--dataset", default=os.getenv("DATASET_DIR", "dataset"))
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    pairs = synthetic_pairs() + dataset_pairs(args.dataset)
+    mismatches = [
+        (b, a, old, new)
+        for b, a in pairs
+        for old, new in [(legacy_grammar._guess_reason(b, a), grammar.guess_reason(b, a))]
+        if old != new
+    ]
+    for b, a, old, new in mismatches[:20]:
+        print(f"MISMATCH {b!r} -> {a!r}: legacy={old!r} compiled={new!r}")
+    if mismatches:
+        print(f"{len(mismatches)} of {len(pairs)} labels differ")
+        return 1
+
+    legacy_s = _time_per_call(legacy_grammar._guess_reason, pairs, args.repeat)
+    compiled_s = _time_per_call(grammar.LEXICON.classify, pairs, args.repeat)
+    memo_s = _time_per_call(grammar.guess_reason, pairs, args.repeat)
+    print(f"pairs:    {len(pairs)} (all labels identical)")
+    print(f"legacy:   {legacy_s * 1e6:8.2f} us/call")
+    print(f"compiled: {compiled_s * 1e6:8.2f} us/call  ({legacy_s / compiled_s:.1f}x)")
+    print(f"memoized: {memo_s * 1e6:8.2f} us/call  ({legacy_s / memo_s:.1f}x, {grammar.label_cache_stats()})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
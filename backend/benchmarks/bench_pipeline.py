@@ -0,0 +1,173 @@
+# bench_pipeline.py (offline micro-benchmarks for the correction-analysis pipeline)
+#
+#   cd backend
+#   python -m benchmarks.bench_pipeline                  # report, compare with the baseline if present
+#   python -m benchmarks.bench_pipeline --save-baseline  # record the current numbers
+#
+# Each stage runs over the same corpus: recorded (user_text, corrected) pairs
+# from DATASET_DIR, topped up with synthetic ones. Per stage it reports
+# ops/sec, p50/p99 latency per call and the peak traced memory of one pass.
+# With a baseline it exits 1 when ops/sec drops, or peak memory grows, by
+# more than --threshold (p99: twice that).
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from app.api.chat import grammar
+from app.api.chat.analysis import TurnAnalysis, build_brief_context, sanitize_corrections_md
+from benchmarks.corpus import load_pairs
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# (report key, direction, slack): +1 means higher is better; tail latency
+# is the noisiest number, so p99 gets twice the --threshold
+_METRICS = (("ops_per_s", +1, 1.0), ("p99_us", -1, 2.0), ("peak_kib", -1, 1.0))
+
+
+# ---- stages ----
+
+def _stage_inputs(pairs: List[Tuple[str, str]]) -> Dict[str, Tuple[Callable, list]]:
+    op_pairs = [(before, after) for u, c in pairs for _, before, after in TurnAnalysis(u, c).ops]
+    histories = []
+    history: List[dict] = []
+    for u, c in pairs:
+        history = (history + [{"role": "user", "text": u}, {"role": "assistant", "text": c}])[-24:]
+        histories.append(history)
+    model_md = [
+        (f"Corrected version: {c}\n\nIssues & fixes:\n" + "\n".join(TurnAnalysis(u, c).bullets()), u)
+        for u, c in pairs
+    ]
+
+    def guess_reason(item):
+        # The compiled classifier itself; the label LRU would hide detector cost
+        return grammar.LEXICON.classify(*item)
+
+    def bullets(item):
+        return TurnAnalysis(*item).bullets()
+
+    def change_ratio(item):
+        return TurnAnalysis(*item).change_ratio
+
+    def brief_context(item):
+        return build_brief_context(item, max_pairs=6, max_chars=600)
+
+    def sanitize(item):
+        return sanitize_corrections_md(*item)
+
+    return {
+        "guess_reason": (guess_reason, op_pairs),
+        "bullets": (bullets, pairs),
+        "change_ratio": (change_ratio, pairs),
+        "brief_context": (brief_context, histories),
+        "sanitize_corrections_md": (sanitize, model_md),
+    }
+
+
+def _percentile(sorted_ns: List[int], q: float) -> float:
+    idx = min(len(sorted_ns) - 1, int(q * len(sorted_ns)))
+    return sorted_ns[idx] / 1000.0
+
+
+def run_stage(fn: Callable, items: list, repeat: int) -> Dict[str, float]:
+    samples: List[int] = []
+    total_ns = 0
+    clock = time.perf_counter_ns
+    gc_was_enabled = gc.isenabled()
+    gc.disable()  # like timeit: collector pauses would dominate p99
+    try:
+        for _ in range(repeat):
+            # Start every pass with a cold label cache so passes are comparable
+            grammar._labels.clear()
+            for item in items:
+                start = clock()
+                fn(item)
+                elapsed = clock() - start
+                samples.append(elapsed)
+                total_ns += elapsed
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+    samples.sort()
+
+    grammar._labels.clear()
+    tracemalloc.start()
+    for item in items:
+        fn(item)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "calls": len(samples),
+        "ops_per_s": round(len(samples) / (total_ns / 1e9), 1) if total_ns else 0.0,
+        "p50_us": round(_percentile(samples, 0.50), 2),
+        "p99_us": round(_percentile(samples, 0.99), 2),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+# ---- baseline ----
+
+def compare(results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float) -> List[str]:
+    regressions = []
+    for stage, current in results.items():
+        base = baseline.get(stage)
+        if not base:
+            continue
+        for key, direction, slack in _METRICS:
+            old, new = base.get(key), current.get(key)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if direction * change < -threshold * slack:
+                regressions.append(f"{stage}.{key}: {old} -> {new} ({change:+.0%})")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the chat correction-analysis pipeline")
+    parser.add_argument("--dataset", default=os.getenv("DATASET_DIR", "dataset"))
+    parser.add_argument("--min-pairs", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed relative regression")
+    parser.add_argument("--stage", action="append", help="only run these stages")
+    args = parser.parse_args(argv)
+
+    pairs = load_pairs(args.dataset, args.min_pairs)
+    stages = _stage_inputs(pairs)
+    results = {}
+    for name, (fn, items) in stages.items():
+        if args.stage and name not in args.stage:
+            continue
+        results[name] = run_stage(fn, items, args.repeat)
+
+    print(f"corpus: {len(pairs)} pairs")
+    print(f"{'stage':<26}{'calls':>8}{'ops/s':>12}{'p50 us':>10}{'p99 us':>10}{'peak KiB':>10}")
+    for name, r in results.items():
+        print(f"{name:<26}{r['calls']:>8}{r['ops_per_s']:>12}{r['p50_us']:>10}{r['p99_us']:>10}{r['peak_kib']:>10}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("no baseline; run with --save-baseline to record one")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for line in regressions:
+        print(f"REGRESSION {line}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
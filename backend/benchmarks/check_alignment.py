@@ -0,0 +1,75 @@
+# check_alignment.py (regression check: rapidfuzz alignment vs the previous difflib opcodes)
+#
+#   cd backend
+#   python -m benchmarks.check_alignment [--dataset DIR] [--min-agreement 0.9]
+#
+# Runs both engines over a regression corpus (DATASET_DIR rows plus seeded
+# synthetic learner edits) and reports how often opcodes and chat bullets
+# agree. Fails if WER ever differs from jiwer or agreement drops below the bar.
+# difflib stays the default ALIGN_ENGINE until bullets agree on 100% of pairs;
+# --show-diffs prints the pairs whose bullets would change under rapidfuzz.
+import argparse
+import os
+import sys
+import time
+
+from services.alignment import align
+from app.api.chat.analysis import TurnAnalysis, word_tokens
+from benchmarks.corpus import dataset_pairs, synthetic_pairs
+
+
+def _bullets(user_text: str, corrected: str, engine: str) -> list:
+    analysis = TurnAnalysis(user_text, corrected)
+    analysis.alignment = align(analysis.source.tokens, analysis.target.tokens, engine)
+    return analysis.bullets()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Check rapidfuzz alignment against difflib")
+    parser.add_argument("--dataset", default=os.getenv("DATASET_DIR", "dataset"))
+    parser.add_argument("--min-agreement", type=float, default=0.9)
+    parser.add_argument("--show-diffs", action="store_true", help="print pairs whose bullets differ")
+    args = parser.parse_args(argv)
+
+    try:
+        from jiwer import wer as jiwer_wer
+    except ImportError:
+        jiwer_wer = None
+
+    pairs = dataset_pairs(args.dataset) + synthetic_pairs()
+    token_pairs = [(word_tokens(a), word_tokens(b)) for a, b in pairs]
+
+    opcode_agree = bullet_agree = wer_bad = 0
+    for (user_text, corrected), (a, b) in zip(pairs, token_pairs):
+        fast, legacy = align(a, b, "rapidfuzz"), align(a, b, "difflib")
+        opcode_agree += fast.opcodes == legacy.opcodes
+        fast_bullets, legacy_bullets = _bullets(user_text, corrected, "rapidfuzz"), _bullets(user_text, corrected, "difflib")
+        bullet_agree += fast_bullets == legacy_bullets
+        if args.show_diffs and fast_bullets != legacy_bullets:
+            print(f"BULLETS {user_text!r} -> {corrected!r}\n  difflib   {legacy_bullets}\n  rapidfuzz {fast_bullets}")
+        if jiwer_wer is not None and a:
+            expected = jiwer_wer(" ".join(a), " ".join(b))
+            if abs(expected - fast.wer) > 1e-9:
+                wer_bad += 1
+                print(f"WER MISMATCH {a!r} / {b!r}: jiwer={expected} alignment={fast.wer}")
+
+    timings = {}
+    for engine in ("difflib", "rapidfuzz"):
+        start = time.perf_counter()
+        for a, b in token_pairs:
+            align(a, b, engine)
+        timings[engine] = (time.perf_counter() - start) / len(token_pairs)
+
+    n = len(pairs)
+    print(f"pairs:             {n}")
+    print(f"opcodes identical: {opcode_agree / n:.1%}")
+    print(f"bullets identical: {bullet_agree / n:.1%}"
+          + ("" if bullet_agree == n else "  (keep ALIGN_ENGINE=difflib)"))
+    print(f"wer vs jiwer:      {'skipped (jiwer not installed)' if jiwer_wer is None else f'{wer_bad} mismatches'}")
+    print(f"difflib:           {timings['difflib'] * 1e6:8.2f} us/pair")
+    print(f"rapidfuzz:         {timings['rapidfuzz'] * 1e6:8.2f} us/pair")
+    return 1 if wer_bad or opcode_agree / n < args.min_agreement else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+# check_correction_memory.py (regression check: which near-duplicates the correction memory may serve)
+#
+#   cd backend
+#   python -m benchmarks.check_correction_memory
+#
+# Builds a small memory in a temp dir and runs fixed queries through exact
+# lookup and near-duplicate transplant. A near match may only be served when
+# the query has the remembered text's exact tokens; every other difference
+# (an added, dropped, changed or re-cased word) must fall back to the LLM.
+# Exits 1 on the first case that disagrees.
+import os
+import sys
+import tempfile
+
+# Imported after the env is set: config.py reads it once
+os.environ.setdefault("DATASET_DIR", tempfile.mkdtemp(prefix="check-memory-"))
+
+from app.api.chat import correction_memory  # noqa: E402
+
+ROWS = [
+    ("I go to the store yesterday and buyed some apples.", "I went to the store yesterday and bought some apples."),
+    ("I would like an apple.", "I would like an apple."),
+    ("i want a coffee", "I want a coffee."),
+    ("Where is the train station ,please?", "Where is the train station, please?"),
+]
+
+# (query, expected transplant or None for a miss)
+CASES = [
+    # Same tokens, different spacing: the edits carry over onto the query's own text
+    ("I go to the store yesterday and buyed some apples .", "I went to the store yesterday and bought some apples ."),
+    # Spacing-only edits are not token edits: the query keeps its own spacing
+    ("Where is the train station , please?", "Where is the train station , please?"),
+    ("i want a coffee", "I want a coffee."),
+    # "apple" is correct elsewhere in the memory, but "some apple" is still an error here
+    ("I go to the store yesterday and buyed some apple.", None),
+    # A dropped article is an error the remembered correction never fixed
+    ("I go to store yesterday and buyed some apples.", None),
+    # An added word, a changed word, a change of case
+    ("I go to the big store yesterday and buyed some apples.", None),
+    ("I go to the shop yesterday and buyed some apples.", None),
+    ("I want a coffee", None),
+]
+
+
+def main(argv=None) -> int:
+    path = os.path.join(tempfile.mkdtemp(prefix="check-memory-"), "memory.msgpack")
+    rows = [{"user_text": u, "corrected": c, "strictness": 0.5} for u, c in ROWS]
+    correction_memory.build(rows, path)
+    memory = correction_memory.load(path)
+
+    failed = 0
+    for user_text, corrected in ROWS:
+        if memory.exact.get((user_text, 0)) != corrected:
+            failed += 1
+            print(f"EXACT MISS  {user_text!r}")
+    for query, expected in CASES:
+        match = memory.near(query, 0, 80)
+        got = memory.transplant(query, match[0]) if match is not None else None
+        if got != expected:
+            failed += 1
+            print(f"MISMATCH    {query!r}\n  expected {expected!r}\n  got      {got!r}")
+
+    print(f"cases: {len(ROWS) + len(CASES)}  failed: {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+# corpus.py (offline corpora shared by the benchmark scripts)
+import glob
+import json
+import os
+import random
+from typing import Dict, Iterator, List, Tuple
+
+_SENTENCES = [
+    "I go to the store yesterday and buyed some apples.",
+    "She don't like when people is late for the meeting.",
+    "We was planning to visit my grandmother on the weekend, but it rain.",
+    "Can you tell me where is the station?",
+    "He have been working here since three years.",
+    "My friend and me goes to school by bus every days.",
+    "There is many reasons why I want to learn english.",
+    "If I would have time, I will call you tomorrow.",
+]
+_SWAPS = {
+    "go": "went", "buyed": "bought", "don't": "doesn't", "is": "are", "was": "were",
+    "rain": "rained", "have": "has", "since": "for", "me": "I", "goes": "go",
+    "days": "day", "english": "English", "would": "had", "will": "would",
+}
+
+
+def dataset_files(dataset_dir: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(dataset_dir, "*.jsonl")))
+
+
+def dataset_rows(dataset_dir: str) -> Iterator[Dict]:
+    """
+    Rows written by the chat routes: compacted shards under <dir>/shards
+    first, then the session-*.jsonl files; bad lines are skipped.
+    """
+    # Imported here: config.py reads the environment on import (see benchmarks.replay)
+    from app.api.chat.shards import iter_rows
+
+    yield from iter_rows(os.path.join(dataset_dir, "shards"))
+    for path in dataset_files(dataset_dir):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(row, dict):
+                    yield row
+
+
+def dataset_pairs(dataset_dir: str) -> List[Tuple[str, str]]:
+    return [
+        (row["user_text"], row["corrected"])
+        for row in dataset_rows(dataset_dir)
+        if row.get("user_text") and row.get("corrected")
+    ]
+
+
+def synthetic_pairs(n: int = 2000, seed: int = 7) -> List[Tuple[str, str]]:
+    """Seeded learner sentences with typical corrections, drops and insertions."""
+    rng = random.Random(seed)
+    pairs = []
+    for _ in range(n):
+        src = rng.choice(_SENTENCES)
+        out = []
+        for w in src.split():
+            r = rng.random()
+            if r < 0.05:
+                continue
+            out.append(_SWAPS.get(w, w) if r < 0.5 else w)
+            if rng.random() < 0.04:
+                out.append(rng.choice(["the", "a", "really", ","]))
+        pairs.append((src, " ".join(out)))
+    return pairs
+
+
+def load_pairs(dataset_dir: str, min_pairs: int = 0) -> List[Tuple[str, str]]:
+    """Recorded pairs first; topped up with synthetic ones when there are fewer than min_pairs."""
+    pairs = dataset_pairs(dataset_dir)
+    if len(pairs) < min_pairs:
+        pairs += synthetic_pairs(min_pairs - len(pairs))
+    return pairs
@@ -0,0 +1,368 @@
+# legacy_grammar.py (frozen copy of the original router._guess_reason, the reference for bench_grammar.py)
+# Do not edit: the compiled classifier in app/api/chat/grammar.py must reproduce these labels exactly.
+import difflib
+import re
+
+_CONTRACTIONS = {
+    "i'm": "i am", "you're": "you are", "we're": "we are", "they're": "they are",
+    "he's": "he is", "she's": "she is", "it's": "it is", "it’s": "it is",
+    "i've": "i have", "you've": "you have", "we've": "we have", "they've": "they have",
+    "i'd": "i would", "you'd": "you would", "he'd": "he would", "she'd": "she would", "we'd": "we would", "they'd": "they would",
+    "i'll": "i will", "you'll": "you will", "he'll": "he will", "she'll": "she will", "we'll": "we will", "they'll": "they will",
+    "can't": "cannot", "won't": "will not", "don't": "do not", "doesn't": "does not", "didn't": "did not",
+    "isn't": "is not", "aren't": "are not", "wasn't": "was not", "weren't": "were not",
+    "shouldn't": "should not", "wouldn't": "would not", "couldn't": "could not",
+    "let's": "let us",
+}
+
+def _looks_like_contraction_change(b: str, a: str) -> bool:
+    bl, al = b.lower().strip(), a.lower().strip()
+    # direct map or reverse map
+    if bl in _CONTRACTIONS and _CONTRACTIONS[bl] == al:
+        return True
+    for c, exp in _CONTRACTIONS.items():
+        if bl == exp and al == c:
+            return True
+    return False
+
+_IRREGULAR_PAST = {
+    "be": "was", "am": "was", "is": "was", "are": "were",
+    "begin": "began", "break": "broke", "bring": "brought", "build": "built",
+    "buy": "bought", "catch": "caught", "choose": "chose", "come": "came",
+    "cost": "cost", "cut": "cut", "do": "did", "draw": "drew",
+    "drink": "drank", "drive": "drove", "eat": "ate", "fall": "fell",
+    "feel": "felt", "fight": "fought", "find": "found", "fly": "flew",
+    "forget": "forgot", "forgive": "forgave", "get": "got", "give": "gave",
+    "go": "went", "grow": "grew", "have": "had", "hear": "heard",
+    "hold": "held", "keep": "kept", "know": "knew", "lay": "laid",
+    "lead": "led", "leave": "left", "lend": "lent", "let": "let",
+    "lose": "lost", "make": "made", "mean": "meant", "meet": "met",
+    "pay": "paid", "put": "put", "read": "read", "ride": "rode",
+    "ring": "rang", "rise": "rose", "run": "ran", "say": "said",
+    "see": "saw", "sell": "sold", "send": "sent", "set": "set",
+    "shake": "shook", "shine": "shone", "shoot": "shot", "show": "showed",
+    "sing": "sang", "sit": "sat", "sleep": "slept", "speak": "spoke",
+    "spend": "spent", "stand": "stood", "swim": "swam", "take": "took",
+    "teach": "taught", "tear": "tore", "tell": "told", "think": "thought",
+    "throw": "threw", "understand": "understood", "wear": "wore",
+    "win": "won", "write": "wrote", "bite": "bit", "blow": "blew",
+    "feed": "fed", "hang": "hung", "hide": "hid", "lie": "lay",
+    "light": "lit", "seek": "sought", "slide": "slid", "spoil": "spoilt",
+    "steal": "stole", "stick": "stuck", "sweep": "swept", "swing": "swung",
+    "arise": "arose", "bear": "bore", "bend": "bent", "bet": "bet",
+    "bleed": "bled", "breed": "bred", "burst": "burst", "creep": "crept",
+    "deal": "dealt", "dig": "dug", "freeze": "froze", "forbid": "forbade",
+    "hurt": "hurt", "kneel": "knelt", "lean": "leant", "smell": "smelt",
+    "sting": "stung", "strike": "struck", "swear": "swore", "wake": "woke",
+    "weave": "wove", "weep": "wept", "bind": "bound", "burn": "burnt",
+    "broadcast": "broadcast", "fit": "fit", "hit": "hit", "quit": "quit",
+    "shut": "shut", "spread": "spread", "split": "split", "upset": "upset",
+}
+
+
+_COLLOQUIAL = {
+    "gonna": "going to", "wanna": "want to", "gotta": "have to",
+    "kinda": "kind of", "sorta": "sort of", "lemme": "let me",
+}
+
+def _punctuation_label(before: str, after: str) -> str:
+    # Look for the most-significant punctuation in the 'after' text (order matters)
+    txt = (after or "")
+    if "?" in txt: 
+        return "question mark"
+    if "." in txt:
+        return "period"
+    if "," in txt:
+        return "comma"
+    if "!" in txt:
+        return "exclamation"
+    if ":" in txt:
+        return "colon"
+    if ";" in txt:
+        return "semicolon"
+    return "punctuation"
+
+
+_IRREGULAR_ADJ = {
+    "good": ("better", "best"),
+    "well": ("better", "best"),
+    "bad": ("worse", "worst"),
+    "far": ("farther", "farthest"),
+    "further": ("further", "furthest"),
+    "little": ("less", "least"),
+    "few": ("fewer", "fewest"),
+    "many": ("more", "most"),
+    "much": ("more", "most"),
+    "late": ("later", "latest"),
+    "old": ("older", "oldest"),
+    "ill": ("worse", "worst"),
+    "fun": ("more fun", "most fun"),
+    "near": ("nearer", "nearest"),
+    "friendly": ("friendlier", "friendliest"),
+    "simple": ("simpler", "simplest"),
+    "gentle": ("gentler", "gentlest"),
+    "narrow": ("narrower", "narrowest"),
+    "clever": ("cleverer", "cleverest"),
+    "quiet": ("quieter", "quietest"),
+}
+
+def _strip_common_suffixes(w: str) -> str:
+    wl = w.lower()
+    if wl.endswith("iest") and len(wl) > 4:   # happy -> happiest
+        return wl[:-4] + "y"
+    if wl.endswith("ier") and len(wl) > 3:    # happy -> happier
+        return wl[:-3] + "y"
+    if wl.endswith("est") and len(wl) > 3:    # big -> biggest
+        return wl[:-3]
+    if wl.endswith("er") and len(wl) > 2:     # big -> bigger
+        return wl[:-2]
+    if wl.endswith(("r", "st")) and wl[:-1] + "e" in ("large", "nice", "wise", "rude", "safe"):
+        return wl[:-1] + "e"
+    return wl
+
+def _is_comparative_superlative(before: str, after: str) -> bool:
+    b = before.lower().strip()
+    a = after.lower().strip()
+    if not b or not a:
+        return False
+    if b in _IRREGULAR_ADJ:
+        comp, sup = _IRREGULAR_ADJ[b]
+        if a == comp or a == sup:
+            return True
+    for base, (comp, sup) in _IRREGULAR_ADJ.items():
+        if b in (comp, sup) and a == base:
+            return True
+    if a.endswith(("er", "est")) or b.endswith(("er", "est")):
+        stem_b = _strip_common_suffixes(b)
+        stem_a = _strip_common_suffixes(a)
+        if stem_a == stem_b and len(stem_a) >= 2:
+            return True
+    if re.match(r"^(more|most)\s+\w+", a) or re.match(r"^(more|most)\s+\w+", b):
+        return True
+    if re.match(r"^(less|least)\s+\w+", a) or re.match(r"^(least|less)\s+\w+", b):
+        return True
+    if (" than" in a and " than" not in b) or (" than" in b and " than" not in a):
+        return True
+    return False
+
+_VOWELS = set("aeiou")
+
+def _is_regular_past_ed(b: str, a: str) -> bool:
+    bl, al = b.lower(), a.lower()
+    if not bl or not al:
+        return False
+    if bl.endswith("e") and al == bl + "d":
+        return True
+    if len(bl) >= 3 and bl[-1] not in _VOWELS and bl[-2] in _VOWELS and bl[-3] not in _VOWELS:
+        if al == bl + bl[-1] + "ed":
+            return True
+    if bl.endswith("y") and (len(bl) >= 2 and bl[-2] not in _VOWELS) and al == bl[:-1] + "ied":
+        return True
+    if al == bl + "ed":
+        return True
+    return False
+
+def _is_progressive_ing(b: str, a: str) -> bool:
+    bl, al = b.lower(), a.lower()
+    if not bl or not al:
+        return False
+    if bl.endswith("e") and al == bl[:-1] + "ing":
+        return True
+    if len(bl) >= 3 and bl[-1] not in _VOWELS and bl[-2] in _VOWELS and bl[-3] not in _VOWELS:
+        if al == bl + bl[-1] + "ing":
+            return True
+    if al == bl + "ing":
+        return True
+    return False
+
+def _is_plural_or_3rd_s(b: str, a: str) -> bool:
+    bl, al = b.lower(), a.lower()
+    if not bl or not al:
+        return False
+    if al == bl + "es":
+        return True
+    if bl.endswith("y") and (len(bl) >= 2 and bl[-2] not in _VOWELS) and al == bl[:-1] + "ies":
+        return True
+    if al == bl + "s":
+        return True
+    return False
+
+_DETERMINERS = {
+    "a", "an", "the",
+    "this", "that", "these", "those",
+    "my", "your", "his", "her", "its", "our", "their",
+    "some", "any", "each", "every", "no", "another", "either", "neither", "both", "all", "several", "few", "many", "much", "little"
+}
+
+def _is_article_or_determiner_token(w: str) -> bool:
+    return w.lower() in _DETERMINERS
+
+# ---------------- New lightweight grammatical detectors ----------------
+
+_MODALS = {"can", "could", "may", "might", "will", "would", "shall", "should", "must", "ought", "dare"}
+_PREPOSITIONS = {
+    "in","on","at","for","to","with","from","about","as","by","into","through",
+    "during","before","after","above","below","over","under","between","among","against","towards","upon","within","without","along","across"
+}
+_AUX_FORMS = {"am","is","are","was","were","be","been","being","have","has","had","do","does","did","will","would","shall","should","may","might","must","can","could"}
+_PRONOUNS = {"i","you","he","she","we","they","me","him","her","us","them","it","mine","yours","his","hers","ours","theirs"}
+_CONJUNCTIONS = {"and","or","but","so","because","although","though","yet","for","nor","since","unless","while","whereas"}
+
+
+def _token_is_in_set(span: str, the_set: set[str]) -> bool:
+    if not span or not the_set:
+        return False
+    # check each token separately
+    for t in re.findall(r"[\w']+", span.lower()):
+        if t in the_set:
+            return True
+    return False
+
+
+def _is_modal_change(b: str, a: str) -> bool:
+    return _token_is_in_set(b, _MODALS) or _token_is_in_set(a, _MODALS)
+
+def _is_preposition_change(b: str, a: str) -> bool:
+    b_preps = {t for t in re.findall(r"[\w']+", b.lower()) if t in _PREPOSITIONS}
+    a_preps = {t for t in re.findall(r"[\w']+", a.lower()) if t in _PREPOSITIONS}
+    return b_preps != a_preps
+
+
+def _is_auxiliary_change(b: str, a: str) -> bool:
+    # if either side contains an auxiliary-form token (be/have/do/modal)
+    return _token_is_in_set(b, _AUX_FORMS) or _token_is_in_set(a, _AUX_FORMS)
+
+def _is_pronoun_change(b: str, a: str) -> bool:
+    # Detect pronoun swaps or pronoun vs non-pronoun substitutions
+    if _token_is_in_set(b, _PRONOUNS) and _token_is_in_set(a, _PRONOUNS):
+        # if both contain pronouns, check if they differ
+        b_tokens = {t for t in re.findall(r"[\w']+", b.lower()) if t in _PRONOUNS}
+        a_tokens = {t for t in re.findall(r"[\w']+", a.lower()) if t in _PRONOUNS}
+        return bool(b_tokens ^ a_tokens)  # XOR: true if sets differ
+    return (_token_is_in_set(b, _PRONOUNS) and not _token_is_in_set(a, _PRONOUNS)) or (_token_is_in_set(a, _PRONOUNS) and not _token_is_in_set(b, _PRONOUNS))
+
+def _is_possessive_change(b: str, a: str) -> bool:
+    bb = (b or "").lower()
+    aa = (a or "").lower()
+    # possessive pronouns or possessive 's
+    if re.search(r"\b(my|your|his|her|its|our|their|mine|yours|hers|ours|theirs)\b", bb) or re.search(r"\b(my|your|his|her|its|our|their|mine|yours|hers|ours|theirs)\b", aa):
+        return True
+    if bb.endswith("'s") or aa.endswith("'s") or bb.endswith("s'") or aa.endswith("s'"):
+        return True
+    return False
+
+
+def _is_conjunction_change(b: str, a: str) -> bool:
+    return _token_is_in_set(b, _CONJUNCTIONS) or _token_is_in_set(a, _CONJUNCTIONS)
+
+# ----------------- Guess reason (expanded) -----------------
+
+def _guess_reason(before: str, after: str) -> str:
+    import difflib
+
+    b, a = before.strip(), after.strip()
+    b_l, a_l = b.lower(), a.lower()
+
+    # 0) Contractions first (handles I’m -> I am etc.)
+    if _looks_like_contraction_change(b, a):
+        return "apostrophe/contraction"
+
+    # 0.5) Colloquial → standard (must be very early)
+    for c, exp in _COLLOQUIAL.items():
+        if c in b_l:
+            return "colloquial → standard"
+
+    # 1) Capitalization
+    if b_l == a_l and b != a:
+        return "capitalization"
+
+    # 2) Apostrophe / contraction (fallback token-shape check)
+    if (
+        b.replace("’", "'").lower().replace("'", "")
+        == a.replace("’", "'").lower().replace("'", "")
+        and (("'" in b) or ("'" in a) or ("’" in b) or ("’" in a))
+        and b != a
+    ):
+        return "apostrophe/contraction"
+
+    # 3) Specific punctuation
+    if re.sub(r"[^\w]", "", b_l) == re.sub(r"[^\w]", "", a_l):
+        return _punctuation_label(b, a)
+
+    # QUICK FIX: handle deletion of 'more'/'most' (comparative markers removed)
+    if a_l == "" and b_l in ("more", "most"):
+        return "comparative/superlative form"
+
+    # 4) Comparative / superlative (must be before deletion/lexical fallbacks)
+    if _is_comparative_superlative(b, a):
+        return "comparative/superlative form"
+
+    # --- Finer-grained functional word detection ---
+    # NOTE: Modals are a subset of auxiliaries; detect modals first for specificity.
+    if _is_modal_change(b, a):
+        return "modal verb"
+    if _is_auxiliary_change(b, a):
+        return "auxiliary verb"
+    if _is_preposition_change(b, a):
+        return "preposition usage"
+    if _is_pronoun_change(b, a):
+        return "pronoun/person"
+    if _is_possessive_change(b, a):
+        return "possessive"
+    if _is_conjunction_change(b, a):
+        return "conjunction usage"
+
+    # 5) Irregular past tense (must precede spelling/lexical)
+    # Exact match (correct lemma -> irregular past)
+    if b_l in _IRREGULAR_PAST and a_l == _IRREGULAR_PAST[b_l]:
+        return "irregular past tense"
+    # Handle common misspellings: if 'after' is an irregular past form,
+    # check whether 'before' is similar to the corresponding lemma.
+    if a_l in set(_IRREGULAR_PAST.values()):
+        # find candidate lemmas that map to this past form
+        for lemma, past in _IRREGULAR_PAST.items():
+            if past == a_l:
+                sm = difflib.SequenceMatcher(None, b_l, lemma)
+                if sm.ratio() >= 0.5:  # conservative similarity threshold
+                    return "irregular past tense"
+
+    # 6) Regular past tense
+    if _is_regular_past_ed(b, a):
+        return "regular past tense (-ed)"
+
+    # 7) Progressive aspect (-ing)
+    if _is_progressive_ing(b, a):
+        return "progressive aspect (-ing)"
+
+    # 8) Plural / 3rd-person -s
+    if _is_plural_or_3rd_s(b, a):
+        return "plural/3rd-person -s"
+
+    # 9) Determiners (trigger only if determiner set actually changes)
+    b_dets = {t for t in re.findall(r"[\w']+", b_l) if t in _DETERMINERS}
+    a_dets = {t for t in re.findall(r"[\w']+", a_l) if t in _DETERMINERS}
+    if b_dets != a_dets:
+        return "article/determiner usage"
+
+    # 10) Adverb -ly
+    if a_l.endswith("ly") and b_l + "ly" == a_l:
+        return "adverb form (-ly)"
+
+    # 11) Spelling / word form (high similarity, short edits)
+    if abs(len(b) - len(a)) <= 2:
+        sm = difflib.SequenceMatcher(None, b_l, a_l)
+        if sm.ratio() >= 0.75:
+            return "spelling/word form"
+
+    # 12) Lexical / word choice (single-token semantic swaps)
+    b_tokens = re.findall(r"[\w']+", b_l)
+    a_tokens = re.findall(r"[\w']+", a_l)
+    if len(b_tokens) == 1 and len(a_tokens) == 1:
+        sm = difflib.SequenceMatcher(None, b_tokens[0], a_tokens[0])
+        if sm.ratio() < 0.6:
+            return "lexical/word choice"
+
+    # 13) Default catch-all
+    return "grammar/word choice"
+
+
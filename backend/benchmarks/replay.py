@@ -0,0 +1,359 @@
+# replay.py (offline session replay through /chat and /stream against a stub Ollama)
+#
+#   cd backend
+#   python -m benchmarks.replay [--dataset DIR] [--mode chat|stream|both]
+#                               [--token-ms 20] [--prefill-ms 80] [--concurrency 4]
+#                               [--memory dataset/correction_memory.msgpack]
+#
+# Recorded session-*.jsonl turns are replayed session by session through the
+# real chat router (served over HTTP by uvicorn, so SSE timings are real)
+# while the LLM is a local StubOllama that answers each correction with the
+# recorded `corrected` text. Reports end-to-end turn latency, time to the
+# first correction_delta, the guardrail rerun rate, and how often the served
+# correction / bullets differ from the recorded baseline. Any config.py
+# setting (OLLAMA_MAX_CONCURRENCY, SSE_FLUSH_MS, ...) can be set in the
+# environment to compare runs; OLLAMA_URLS and DATASET_DIR are always
+# replaced so nothing reaches a real Ollama or the recorded dataset.
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+import types
+from collections import Counter, defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import uvicorn
+
+from benchmarks.corpus import dataset_rows, synthetic_pairs
+from benchmarks.stub_ollama import StubOllama
+
+_LEVELS = {"A1", "A2", "B1", "B2", "C1", "C2"}
+
+
+# ---- recorded sessions ----
+
+SYNTHETIC_TURNS = 5
+
+
+def load_sessions(dataset_dir: str, max_sessions: int = 0) -> List[dict]:
+    """Recorded turns grouped by session, in file order; synthetic sessions if there are none."""
+    sessions: Dict[str, dict] = {}
+    for row in dataset_rows(dataset_dir):
+        if not row.get("user_text") or not row.get("corrected"):
+            continue
+        sid = row.get("session_id") or "?"
+        session = sessions.setdefault(sid, {
+            "id": sid,
+            "level": row.get("level") if row.get("level") in _LEVELS else "C1",
+            "strictness": float(row.get("strictness", 0.8)),
+            "scenario_id": row.get("scenario_id") or "drive_through_A2",
+            "turns": [],
+        })
+        session["turns"].append((row["user_text"], row["corrected"]))
+    if not sessions:
+        # The stub answers by learner text, and the templates repeat: number every
+        # turn so all 200 stay distinct (the garbled side is the learner's text)
+        pairs = [(f"{garbled} ({i})", f"{clean} ({i})") for i, (clean, garbled) in enumerate(synthetic_pairs(200))]
+        for i in range(0, len(pairs), SYNTHETIC_TURNS):
+            sessions[f"synthetic-{i // SYNTHETIC_TURNS}"] = {
+                "id": f"synthetic-{i // SYNTHETIC_TURNS}", "level": "B1", "strictness": 0.8,
+                "scenario_id": "drive_through_A2", "turns": pairs[i:i + SYNTHETIC_TURNS],
+            }
+    out = list(sessions.values())
+    return out[:max_sessions] if max_sessions else out
+
+
+# ---- in-process servers ----
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@asynccontextmanager
+async def serving(app, port: int):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        if task.done():
+            task.result()  # surfaces bind errors
+        await asyncio.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await task
+
+
+class _OfflineFirestore:
+    """Accepts the router's Firestore writes and drops them."""
+
+    def __init__(self):
+        self.writes = 0
+
+    def collection(self, *_):
+        return self
+
+    def document(self, *_):
+        return self
+
+    def set(self, *_, **__):
+        self.writes += 1
+
+
+def _chat_app(user_id: str):
+    """
+    The chat router alone, mounted like app.main. Imported here because
+    config.py reads the environment at import time, and with Firestore
+    replaced so a replay never touches user documents.
+    """
+    offline = types.ModuleType("firebase.firebase_admin")
+    offline.db = _OfflineFirestore()
+    sys.modules["firebase.firebase_admin"] = offline
+
+    from fastapi import FastAPI
+    from auth.firebase_auth import get_current_user_id
+    from app.api.chat import correction_memory, llm_client, report, session_store
+    from app.api.chat.router import router, SCENARIOS, cancel_summaries
+
+    @asynccontextmanager
+    async def lifespan(app):
+        await llm_client.startup(warm_briefs=[card["brief"] for card in SCENARIOS.values()])
+        await session_store.startup()
+        await report.startup()
+        await correction_memory.startup()
+        try:
+            yield
+        finally:
+            await correction_memory.shutdown()
+            await report.shutdown()
+            await session_store.shutdown()
+            await cancel_summaries()
+            await llm_client.shutdown()
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(router, prefix="/api/chat")
+    app.dependency_overrides[get_current_user_id] = lambda: user_id
+    return app
+
+
+# ---- replay ----
+
+class TurnResult:
+    __slots__ = ("latency_s", "ttfd_s", "done_s", "corrected", "bullets", "error")
+
+    def __init__(self):
+        self.latency_s = 0.0
+        self.ttfd_s: Optional[float] = None   # first correction_delta (stream only)
+        self.done_s: Optional[float] = None   # corrections_done (stream only)
+        self.corrected = ""
+        self.bullets: List[str] = []
+        self.error: Optional[str] = None
+
+
+def _bullet_lines(corrections_md: str) -> List[str]:
+    return [line.strip() for line in (corrections_md or "").splitlines() if line.startswith("- **")]
+
+
+async def _chat_turn(client: httpx.AsyncClient, session_id: str, user_text: str) -> TurnResult:
+    result = TurnResult()
+    start = time.perf_counter()
+    resp = await client.post("/api/chat/chat", json={"session_id": session_id, "user_text": user_text})
+    result.latency_s = time.perf_counter() - start
+    if resp.status_code != 200:
+        result.error = f"http {resp.status_code}"
+        return result
+    data = resp.json()
+    md = data.get("corrections_md", "")
+    # Corrected version sits between the two headings built by corrections_markdown
+    result.corrected = md.split("#### Issues & Fixes")[0].replace("#### Corrected version", "").strip()
+    result.bullets = _bullet_lines(md)
+    return result
+
+
+async def _stream_turn(client: httpx.AsyncClient, session_id: str, user_text: str) -> TurnResult:
+    result = TurnResult()
+    start = time.perf_counter()
+    async with client.stream("POST", "/api/chat/stream", json={"session_id": session_id, "user_text": user_text}) as resp:
+        if resp.status_code != 200:
+            await resp.aread()
+            result.error = f"http {resp.status_code}"
+            result.latency_s = time.perf_counter() - start
+            return result
+        event = None
+        async for line in resp.aiter_lines():
+            if line.startswith("event:"):
+                event = line[6:].strip()
+                continue
+            if not line.startswith("data:"):
+                continue
+            elapsed = time.perf_counter() - start
+            data = json.loads(line[5:])
+            if event == "correction_delta" and result.ttfd_s is None:
+                result.ttfd_s = elapsed
+            elif event == "corrections_done":
+                result.done_s = elapsed
+                result.corrected = data.get("corrected", "")
+                result.bullets = _bullet_lines(data.get("corrections_md", ""))
+            elif event == "error" and result.error is None:
+                result.error = data.get("message", "error")
+    result.latency_s = time.perf_counter() - start
+    return result
+
+
+async def replay_session(client: httpx.AsyncClient, session: dict, mode: str, stats: dict) -> List[Tuple]:
+    from app.api.chat.session_store import get_session
+
+    resp = await client.post("/api/chat/session/start", json={
+        "level": session["level"], "strictness": session["strictness"], "scenario_id": session["scenario_id"],
+    })
+    resp.raise_for_status()
+    sid = resp.json()["session_id"]
+    turn = _chat_turn if mode == "chat" else _stream_turn
+    results = []
+    for user_text, recorded in session["turns"]:
+        results.append((user_text, recorded, await turn(client, sid, user_text)))
+    try:
+        s = await get_session(sid)
+        stats["turns"] += s.turns
+        stats["reruns"] += s.reruns
+    except KeyError:
+        pass  # expired or evicted during the replay
+    await client.post("/api/chat/session/end", json={"session_id": sid})
+    return results
+
+
+def _percentiles(values: List[float]) -> str:
+    if not values:
+        return "-"
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))] * 1000
+    return f"p50 {pick(0.50):7.1f}  p95 {pick(0.95):7.1f}  p99 {pick(0.99):7.1f} ms"
+
+
+def summarize(mode: str, results: List[Tuple], stats: dict, llm_stats: dict) -> dict:
+    from app.api.chat.analysis import TurnAnalysis, normalize_txt
+
+    turns = [r for _, _, r in results]
+    ok = [(u, c, r) for u, c, r in results if r.error is None]
+    corrected_diff = sum(normalize_txt(r.corrected) != normalize_txt(c) for u, c, r in ok)
+    bullets_diff = sum(r.bullets != TurnAnalysis(u, c).bullets() for u, c, r in ok)
+    return {
+        "mode": mode,
+        "turns": len(turns),
+        "errors": dict(Counter(r.error.split(":")[0] for r in turns if r.error)),
+        "latency_ms": _percentiles([r.latency_s for r in turns]),
+        "first_correction_delta_ms": _percentiles([r.ttfd_s for r in turns if r.ttfd_s is not None]),
+        "corrections_done_ms": _percentiles([r.done_s for r in turns if r.done_s is not None]),
+        "rerun_rate": round(stats["reruns"] / stats["turns"], 4) if stats["turns"] else 0.0,
+        "corrected_diff_rate": round(corrected_diff / len(ok), 4) if ok else 0.0,
+        "bullets_diff_rate": round(bullets_diff / len(ok), 4) if ok else 0.0,
+        "speculation": llm_stats.get("speculation", {}),
+        "memory": llm_stats.get("memory", {}),
+    }
+
+
+_MEMORY_COUNTERS = ("exact_hits", "near_hits", "near_rejected", "misses")
+
+
+async def run(args, sessions: List[dict], stub: StubOllama, stub_port: int, app_port: int) -> List[dict]:
+    from app.api.chat import llm_client
+
+    async with serving(stub.app(), stub_port), serving(_chat_app("replay"), app_port) as app_url:
+        limits = httpx.Limits(max_connections=args.concurrency * 2)
+        async with httpx.AsyncClient(base_url=app_url, timeout=None, limits=limits) as client:
+            reports = []
+            for mode in (("chat", "stream") if args.mode == "both" else (args.mode,)):
+                # Every mode starts cold so the second one is not served from the first one's cache
+                llm_client._correction_cache.clear()
+                gate = asyncio.Semaphore(args.concurrency)
+                stats: dict = defaultdict(int)
+                before = (await client.get("/api/chat/llm/stats")).json()
+
+                async def one(session):
+                    async with gate:
+                        return await replay_session(client, session, mode, stats)
+
+                results = [r for batch in await asyncio.gather(*(one(s) for s in sessions)) for r in batch]
+                after = (await client.get("/api/chat/llm/stats")).json()
+                spec = Counter(after.get("speculation", {}))
+                spec.subtract(before.get("speculation", {}))
+                memory = Counter({k: after["correction_memory"].get(k, 0) for k in _MEMORY_COUNTERS})
+                memory.subtract({k: before["correction_memory"].get(k, 0) for k in _MEMORY_COUNTERS})
+                reports.append(summarize(mode, results, stats, {"speculation": dict(spec), "memory": dict(memory)}))
+    return reports
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Replay recorded chat sessions against a stub Ollama")
+    parser.add_argument("--dataset", default=os.getenv("DATASET_DIR", "dataset"))
+    parser.add_argument("--mode", choices=("chat", "stream", "both"), default="both")
+    parser.add_argument("--sessions", type=int, default=0, help="replay at most this many sessions")
+    parser.add_argument("--concurrency", type=int, default=4, help="sessions replayed at once")
+    parser.add_argument("--prefill-ms", type=float, default=80.0)
+    parser.add_argument("--token-ms", type=float, default=20.0, help="stub latency per streamed token")
+    parser.add_argument("--stub-parallel", type=int, default=4, help="generations the stub runs at once")
+    parser.add_argument("--memory", help="serve from this correction memory file (see correction_memory build)")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--max-diff-rate", type=float, help="exit 1 if corrected/bullets differ more often")
+    args = parser.parse_args(argv)
+
+    # Must happen before the first app import (config.py reads these once)
+    stub_port, app_port = _free_port(), _free_port()
+    os.environ["OLLAMA_URLS"] = f"http://127.0.0.1:{stub_port}"
+    os.environ["DATASET_DIR"] = tempfile.mkdtemp(prefix="replay-dataset-")
+    os.environ["DATASET_SHARD_DIR"] = os.path.join(os.environ["DATASET_DIR"], "shards")
+    os.environ.setdefault("LLM_KEEPALIVE_INTERVAL_S", "0")
+    # An empty path keeps the memory off
+    os.environ["CORRECTION_MEMORY_PATH"] = os.path.abspath(args.memory) if args.memory else ""
+
+    sessions = load_sessions(args.dataset, args.sessions)
+    answers: Dict[str, str] = {}
+    ambiguous = set()
+    for session in sessions:
+        for user_text, corrected in session["turns"]:
+            if answers.setdefault(user_text, corrected) != corrected:
+                ambiguous.add(user_text)
+    stub = StubOllama(answers, args.prefill_ms, args.token_ms, args.stub_parallel)
+
+    reports = asyncio.run(run(args, sessions, stub, stub_port, app_port))
+
+    n_turns = sum(len(s["turns"]) for s in sessions)
+    print(f"sessions: {len(sessions)}  turns: {n_turns}  stub: prefill {args.prefill_ms} ms, "
+          f"{args.token_ms} ms/token, parallel {args.stub_parallel}")
+    if ambiguous:
+        # Recorded more than once with different corrections: the stub serves the first one
+        print(f"note: {len(ambiguous)} learner texts have conflicting recorded corrections")
+    for report in reports:
+        print(f"\n[{report['mode']}] {report['turns']} turns, errors: {report['errors'] or 'none'}")
+        print(f"  turn latency:          {report['latency_ms']}")
+        if report["mode"] == "stream":
+            print(f"  first correction delta {report['first_correction_delta_ms']}")
+            print(f"  corrections_done:      {report['corrections_done_ms']}")
+        print(f"  rerun rate:            {report['rerun_rate']:.1%}  speculation: {report['speculation']}")
+        print(f"  corrected differs:     {report['corrected_diff_rate']:.1%}")
+        print(f"  bullets differ:        {report['bullets_diff_rate']:.1%}")
+        if args.memory:
+            print(f"  correction memory:     {report['memory']}")
+    print(f"\nstub requests: {dict(stub.requests)}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "reports": reports, "stub": dict(stub.requests)}, f, indent=2)
+
+    if args.max_diff_rate is not None and any(
+        max(r["corrected_diff_rate"], r["bullets_diff_rate"]) > args.max_diff_rate for r in reports
+    ):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
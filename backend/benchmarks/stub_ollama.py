@@ -0,0 +1,112 @@
+# stub_ollama.py (a local stand-in for the Ollama HTTP API, used by benchmarks.replay)
+#
+# Serves /api/chat (plain and NDJSON streaming), /api/generate and /api/tags.
+# Corrections answer with the recorded `corrected` text for the learner text
+# found in the prompt (falling back to an echo); replies and rolling
+# summaries (the new turns, squashed onto one line) are canned. Latency
+# is modelled as one prefill delay plus a fixed delay per streamed token, with
+# at most `parallel` generations running at once like OLLAMA_NUM_PARALLEL.
+import asyncio
+import json
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_LEARNER_TEXT_RE = re.compile(r"Learner text:\s*<<<(.*?)>>>", re.DOTALL)
+_NEW_TURNS_RE = re.compile(r"New turns:\s*<<<(.*?)>>>", re.DOTALL)
+_TOKEN_RE = re.compile(r"\s*\S+")
+
+DEFAULT_REPLY = "Sure, that sounds good. What would you like to have with it?"
+
+
+def stream_tokens(text: str) -> List[str]:
+    """Word-sized chunks with their leading whitespace, roughly how Ollama streams."""
+    return _TOKEN_RE.findall(text or "")
+
+
+class StubOllama:
+    def __init__(
+        self,
+        answers: Optional[Dict[str, str]] = None,
+        prefill_ms: float = 80.0,
+        token_ms: float = 20.0,
+        parallel: int = 4,
+        reply: str = DEFAULT_REPLY,
+        model: str = "stub",
+    ):
+        self.answers = answers or {}
+        self.prefill_s = prefill_ms / 1000.0
+        self.token_s = token_ms / 1000.0
+        self.reply = reply
+        self.model = model
+        self.parallel = max(1, parallel)
+        self.requests: Counter = Counter()
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def answer(self, messages: List[dict]) -> str:
+        user = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+        m = _NEW_TURNS_RE.search(user)
+        if m is not None:
+            self.requests["summary"] += 1
+            return "The learner said: " + " ".join(m.group(1).split())[:200]
+        m = _LEARNER_TEXT_RE.search(user)
+        if m is None:
+            self.requests["reply"] += 1
+            return self.reply
+        text = m.group(1)
+        self.requests["correction"] += 1
+        if text not in self.answers:
+            self.requests["correction_echo"] += 1
+        return self.answers.get(text, text)
+
+    def _message(self, content: str, done: bool) -> dict:
+        return {
+            "model": self.model,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "message": {"role": "assistant", "content": content},
+            "done": done,
+        }
+
+    def app(self) -> FastAPI:
+        app = FastAPI(title="stub-ollama")
+
+        @app.get("/api/tags")
+        async def tags():
+            return {"models": [{"name": self.model, "model": self.model}]}
+
+        @app.post("/api/generate")
+        async def generate(request: Request):
+            # Only used for model loads / keep-alive pings (empty prompt)
+            self.requests["generate"] += 1
+            return {"model": self.model, "response": "", "done": True}
+
+        @app.post("/api/chat")
+        async def chat(request: Request):
+            body = await request.json()
+            tokens = stream_tokens(self.answer(body.get("messages") or []))
+            num_predict = (body.get("options") or {}).get("num_predict")
+            if num_predict:
+                tokens = tokens[:num_predict]
+            if self._slots is None:
+                self._slots = asyncio.Semaphore(self.parallel)
+
+            if not body.get("stream", True):
+                async with self._slots:
+                    await asyncio.sleep(self.prefill_s + self.token_s * len(tokens))
+                return JSONResponse(self._message("".join(tokens), True))
+
+            async def lines():
+                async with self._slots:
+                    await asyncio.sleep(self.prefill_s)
+                    for tok in tokens:
+                        yield (json.dumps(self._message(tok, False)) + "\n").encode("utf-8")
+                        await asyncio.sleep(self.token_s)
+                    yield (json.dumps(self._message("", True)) + "\n").encode("utf-8")
+
+            return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+        return app
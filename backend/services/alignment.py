@@ -0,0 +1,122 @@
+# alignment.py (token alignment shared by chat corrections and pronunciation scoring)
+import difflib
+import logging
+import os
+from collections import Counter
+from typing import Any, Dict, Hashable, List, NamedTuple, Sequence, Tuple
+
+from rapidfuzz.distance import Levenshtein
+
+# difflib:   SequenceMatcher opcodes, unchanged (default); distance/WER still come from rapidfuzz
+# rapidfuzz: C-level Levenshtein opcodes; opt-in only, since a different but
+#            equally short alignment can change the chat bullets
+#            (benchmarks/check_alignment.py reports how often)
+# verify:    runs both, serves difflib and counts/logs every opcode mismatch
+ALIGN_ENGINE = os.getenv("ALIGN_ENGINE", "difflib")
+
+Opcode = Tuple[str, int, int, int, int]
+
+_STATS: Counter = Counter()
+_log = logging.getLogger(__name__)
+
+
+class Alignment(NamedTuple):
+    opcodes: List[Opcode]   # difflib-style, including "equal" blocks
+    distance: int           # token Levenshtein distance (substitutions + deletions + insertions)
+    ref_len: int
+    hyp_len: int
+
+    @property
+    def matched(self) -> int:
+        return sum(i2 - i1 for tag, i1, i2, _, _ in self.opcodes if tag == "equal")
+
+    @property
+    def change_ratio(self) -> float:
+        """Share of tokens outside the equal blocks, relative to the longer side."""
+        if not self.ref_len:
+            return 0.0 if not self.hyp_len else 1.0
+        total = max(self.ref_len, self.hyp_len)
+        return (total - self.matched) / total
+
+    @property
+    def wer(self) -> float:
+        """Word error rate of hyp against ref (same definition as jiwer.wer)."""
+        if not self.ref_len:
+            return 0.0 if not self.hyp_len else 1.0
+        return self.distance / self.ref_len
+
+
+def _encode(a: Sequence[Hashable], b: Sequence[Hashable]) -> Tuple[List[int], List[int]]:
+    # Integer IDs keep the C comparison loop off Python string equality
+    vocab: Dict[Hashable, int] = {}
+    ids_a = [vocab.setdefault(t, len(vocab)) for t in a]
+    ids_b = [vocab.setdefault(t, len(vocab)) for t in b]
+    return ids_a, ids_b
+
+
+def _merge_gaps(raw: List[Opcode]) -> List[Opcode]:
+    """
+    Levenshtein opcodes split a gap into 1:1 replaces plus inserts/deletes.
+    Merge each run of non-equal opcodes into one block, the way difflib
+    reports the gap between two matching blocks.
+    """
+    ops: List[Opcode] = []
+    gap = None
+    for tag, i1, i2, j1, j2 in raw:
+        if tag == "equal":
+            if gap is not None:
+                ops.append(_gap_opcode(*gap))
+                gap = None
+            ops.append((tag, i1, i2, j1, j2))
+        elif gap is None:
+            gap = [i1, i2, j1, j2]
+        else:
+            gap[1], gap[3] = i2, j2
+    if gap is not None:
+        ops.append(_gap_opcode(*gap))
+    return ops
+
+
+def _gap_opcode(i1: int, i2: int, j1: int, j2: int) -> Opcode:
+    if i1 == i2:
+        return ("insert", i1, i2, j1, j2)
+    if j1 == j2:
+        return ("delete", i1, i2, j1, j2)
+    return ("replace", i1, i2, j1, j2)
+
+
+def _difflib_opcodes(a: Sequence[Hashable], b: Sequence[Hashable], autojunk: bool) -> List[Opcode]:
+    return difflib.SequenceMatcher(a=a, b=b, autojunk=autojunk).get_opcodes()
+
+
+def align(
+    ref: Sequence[Hashable],
+    hyp: Sequence[Hashable],
+    engine: str = "",
+    autojunk: bool = True,
+) -> Alignment:
+    """
+    Aligns two token sequences in one pass: opcodes, change ratio and WER.
+    autojunk only applies to the difflib engine (SequenceMatcher's heuristic).
+    """
+    engine = engine or ALIGN_ENGINE
+    ids_a, ids_b = _encode(ref, hyp)
+    _STATS[engine] += 1
+
+    if engine == "rapidfuzz":
+        raw = Levenshtein.opcodes(ids_a, ids_b).as_list()
+        distance = sum(max(i2 - i1, j2 - j1) for tag, i1, i2, j1, j2 in raw if tag != "equal")
+        return Alignment(_merge_gaps(raw), distance, len(ref), len(hyp))
+
+    opcodes = _difflib_opcodes(ref, hyp, autojunk)
+    if engine == "verify":
+        fast = _merge_gaps(Levenshtein.opcodes(ids_a, ids_b).as_list())
+        # difflib reports one empty equal block for two empty inputs
+        if fast != opcodes and (fast or opcodes != [("equal", 0, 0, 0, 0)]):
+            _STATS["verify_mismatches"] += 1
+            _log.warning("alignment mismatch ref=%r hyp=%r difflib=%r rapidfuzz=%r", ref, hyp, opcodes, fast)
+    return Alignment(opcodes, Levenshtein.distance(ids_a, ids_b), len(ref), len(hyp))
+
+
+def stats() -> Dict[str, Any]:
+    return {"engine": ALIGN_ENGINE, **_STATS}
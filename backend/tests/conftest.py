@@ -0,0 +1,10 @@
+# conftest.py (run from backend/: python -m pytest -q)
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# config.py reads the env once, on first import: keep test runs out of ./dataset
+os.environ.setdefault("DATASET_DIR", tempfile.mkdtemp(prefix="chat-tests-"))
+os.environ.setdefault("SESSION_BACKEND", "memory")
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from app.api.chat.scheduler import (
+    PRIORITY_CORRECTION,
+    PRIORITY_MINIMAL,
+    PRIORITY_REPLY,
+    PRIORITY_SUMMARY,
+    AdmissionScheduler,
+    LLMOverloaded,
+)
+
+
+def test_waiters_are_served_by_priority_then_fifo():
+    async def main():
+        sched = AdmissionScheduler("test", max_concurrency=1, max_queue=10, max_wait_s=None)
+        order = []
+
+        async def call(name, priority):
+            async with sched.slot(priority):
+                order.append(name)
+
+        await sched.acquire()   # hold the only slot while the queue fills
+        tasks = []
+        for name, priority in [
+            ("summary", PRIORITY_SUMMARY), ("reply-1", PRIORITY_REPLY), ("minimal", PRIORITY_MINIMAL),
+            ("correction", PRIORITY_CORRECTION), ("reply-2", PRIORITY_REPLY),
+        ]:
+            tasks.append(asyncio.create_task(call(name, priority)))
+            await asyncio.sleep(0)
+        sched.release()
+        await asyncio.gather(*tasks)
+        return order, sched.stats()
+
+    order, stats = asyncio.run(main())
+    assert order == ["correction", "reply-1", "reply-2", "minimal", "summary"]
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+
+
+def test_release_hands_the_slot_to_the_next_waiter():
+    async def main():
+        sched = AdmissionScheduler("test", max_concurrency=1, max_queue=10, max_wait_s=None)
+        await sched.acquire()
+        waiter = asyncio.create_task(sched.acquire())
+        await asyncio.sleep(0)
+        sched.release()
+        await waiter
+        # The slot moved to the waiter without ever being free for a newcomer
+        in_flight = sched.stats()["in_flight"]
+        sched.release()
+        return in_flight, sched.stats()
+
+    in_flight, stats = asyncio.run(main())
+    assert in_flight == 1
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0 and stats["admitted"] == 2
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def main():
+        sched = AdmissionScheduler("test", max_concurrency=1, max_queue=10, max_wait_s=None)
+        await sched.acquire()
+        first = asyncio.create_task(sched.acquire(PRIORITY_CORRECTION))
+        second = asyncio.create_task(sched.acquire(PRIORITY_SUMMARY))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.gather(first, return_exceptions=True)
+        sched.release()
+        await second
+        sched.release()
+        return sched.stats()
+
+    stats = asyncio.run(main())
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+
+
+def test_full_queue_and_deadline_are_shed():
+    async def main():
+        sched = AdmissionScheduler("test", max_concurrency=1, max_queue=1, max_wait_s=None)
+        await sched.acquire()
+        waiter = asyncio.create_task(sched.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloaded) as full:
+            sched.check_admission()
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+        deadline = asyncio.get_running_loop().time() + 0.01
+        with pytest.raises(LLMOverloaded) as late:
+            await sched.acquire(PRIORITY_REPLY, deadline)
+        sched.release()
+        return full.value, late.value, sched.stats()
+
+    full, late, stats = asyncio.run(main())
+    assert full.status_code == 429
+    assert late.status_code == 503
+    assert stats["shed_queue_full"] == 1 and stats["shed_timeout"] == 1
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
@@ -0,0 +1,137 @@
+import asyncio
+
+import pytest
+
+from app.api.chat.singleflight import SingleFlight
+
+
+class DeadlineError(Exception):
+    pass
+
+
+def test_follower_cancel_leaves_the_shared_call_running():
+    async def main():
+        flights = SingleFlight()
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return "answer"
+
+        leader = asyncio.create_task(flights.do("k", upstream))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("k", upstream))
+        await asyncio.sleep(0)
+        follower.cancel()
+        await asyncio.gather(follower, return_exceptions=True)
+        return await leader, len(calls), flights.stats()
+
+    result, calls, stats = asyncio.run(main())
+    assert result == "answer" and calls == 1
+    assert stats["leaders"] == 1 and stats["followers"] == 1 and stats["in_flight_plain"] == 0
+
+
+def test_last_waiter_leaving_cancels_the_shared_call():
+    async def main():
+        flights = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def upstream():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.create_task(flights.do("k", upstream)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for w in waiters:
+            w.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        return flights.stats()
+
+    stats = asyncio.run(main())
+    assert stats["in_flight_plain"] == 0
+
+
+def test_caller_deadlines():
+    async def main():
+        flights = SingleFlight(DeadlineError)
+        loop = asyncio.get_running_loop()
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "answer"
+
+        leader = asyncio.create_task(flights.do("k", upstream, loop.time() + 1))
+        await asyncio.sleep(0)
+        # Earlier deadline: joins, but gives up on its own schedule
+        hurried = asyncio.create_task(flights.do("k", upstream, loop.time() + 0.01))
+        # No deadline: the flight may be cut off before it is done, so it goes alone
+        patient = asyncio.create_task(flights.do("k", upstream, None))
+        results = await asyncio.gather(leader, hurried, patient, return_exceptions=True)
+        return results, len(calls), flights.stats()
+
+    (leader, hurried, patient), calls, stats = asyncio.run(main())
+    assert leader == "answer" and patient == "answer"
+    assert isinstance(hurried, DeadlineError)
+    assert calls == 2 and stats["bypassed"] == 1 and stats["followers"] == 1
+
+
+async def _tokens(closed: asyncio.Event, n: int = 1000):
+    try:
+        for i in range(n):
+            await asyncio.sleep(0.001)
+            yield str(i)
+    finally:
+        closed.set()
+
+
+def test_stream_fans_out_and_replays_to_late_subscribers():
+    async def main():
+        flights = SingleFlight()
+        closed = asyncio.Event()
+        first = flights.stream("k", lambda: _tokens(closed, 5))
+        second = flights.stream("k", lambda: _tokens(closed, 5))
+        a = [chunk async for chunk in first]
+        b = [chunk async for chunk in second]
+        return a, b, flights.stats()
+
+    a, b, stats = asyncio.run(main())
+    assert a == b == ["0", "1", "2", "3", "4"]
+    assert stats["leaders"] == 1 and stats["followers"] == 1 and stats["in_flight_streams"] == 0
+
+
+def test_stream_upstream_stops_when_the_last_subscriber_closes():
+    async def main():
+        flights = SingleFlight()
+        closed = asyncio.Event()
+        first = flights.stream("k", lambda: _tokens(closed))
+        # Handed out but never iterated: must not keep the upstream alive
+        flights.stream("k", lambda: _tokens(closed))
+        async for _ in first:
+            break
+        await first.aclose()
+        await asyncio.wait_for(closed.wait(), 1)
+        return flights.stats()
+
+    stats = asyncio.run(main())
+    assert stats["in_flight_streams"] == 0
+
+
+def test_stream_subscriber_deadline():
+    async def main():
+        flights = SingleFlight(DeadlineError)
+        closed = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        stream = flights.stream("k", lambda: _tokens(closed), loop.time() + 0.02)
+        with pytest.raises(DeadlineError):
+            async for _ in stream:
+                pass
+        await asyncio.wait_for(closed.wait(), 1)
+
+    asyncio.run(main())
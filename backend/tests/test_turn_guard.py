@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from app.api.chat.turn_guard import TurnGuard, TurnSuperseded
+
+
+def test_cancel_policy_supersedes_the_running_turn():
+    async def main():
+        guard = TurnGuard("cancel")
+        first = await guard.begin("s")
+        work = asyncio.create_task(asyncio.sleep(10))
+        first.attach(work)
+
+        second_task = asyncio.create_task(guard.begin("s"))
+        await asyncio.sleep(0)
+        # The new turn waits for the old one to unwind, which is already cancelled
+        assert first.superseded and not second_task.done()
+        await asyncio.gather(work, return_exceptions=True)
+        guard.end(first)
+        second = await second_task
+        guard.end(second)
+        return work, second, guard.stats()
+
+    work, second, stats = asyncio.run(main())
+    assert work.cancelled()
+    assert second.waited and not second.superseded
+    assert stats["superseded"] == 1 and stats["cancelled_work"] == 1 and stats["active"] == 0
+
+
+def test_queue_policy_waits_without_cancelling():
+    async def main():
+        guard = TurnGuard("queue")
+        first = await guard.begin("s")
+        work = asyncio.create_task(asyncio.sleep(0.01))
+        first.attach(work)
+
+        second_task = asyncio.create_task(guard.begin("s"))
+        await work
+        assert not second_task.done()
+        guard.end(first)
+        second = await second_task
+        guard.end(second)
+        return first, second, guard.stats()
+
+    first, second, stats = asyncio.run(main())
+    assert not first.superseded
+    assert second.waited
+    assert stats["queued"] == 1 and stats.get("superseded", 0) == 0 and stats["active"] == 0
+
+
+def test_waiting_turn_superseded_by_a_newer_one():
+    async def main():
+        guard = TurnGuard("cancel")
+        first = await guard.begin("s")
+        second_task = asyncio.create_task(guard.begin("s"))
+        await asyncio.sleep(0)
+        third_task = asyncio.create_task(guard.begin("s"))
+        await asyncio.sleep(0)
+        guard.end(first)
+        with pytest.raises(TurnSuperseded):
+            await second_task
+        third = await third_task
+        guard.end(third)
+        return guard.stats()
+
+    stats = asyncio.run(main())
+    assert stats["superseded"] == 2 and stats["active"] == 0
+
+
+def test_cancelled_waiter_still_releases_later_turns_in_order():
+    async def main():
+        guard = TurnGuard("queue")
+        first = await guard.begin("s")
+        second_task = asyncio.create_task(guard.begin("s"))
+        await asyncio.sleep(0)
+        third_task = asyncio.create_task(guard.begin("s"))
+        await asyncio.sleep(0)
+        # The client behind the second turn goes away while it is queued
+        second_task.cancel()
+        await asyncio.gather(second_task, return_exceptions=True)
+        await asyncio.sleep(0.01)
+        assert not third_task.done()   # first is still running
+        guard.end(first)
+        third = await asyncio.wait_for(third_task, 1)
+        guard.end(third)
+        return guard.stats()
+
+    stats = asyncio.run(main())
+    assert stats["active"] == 0
@@ -39,10 +39,10 @@ export const endSession = async (payload) => {
  * True streaming via SSE over POST fetch to /chat/stream.
  * onEvent is called with { type, data } where type is one of:
  *  - "correction_delta"   data: { text }
- *  - "corrections_done"  data: { corrections_md, corrected }
+ *  - "corrections_done"  data: { corrections_md, corrected, ops? }
  *  - "reply_delta"       data: { text }
  *  - "reply_done"        data: { text }
- *  - "error"             data: { message }
+ *  - "error"             data: { message, retry_after? }  (also sent for HTTP 429/503)
  */
 export async function chatTurnStream(payload, onEvent) {
   const user = auth.currentUser;
@@ -59,6 +59,21 @@ export async function chatTurnStream(payload, onEvent) {
     body: JSON.stringify(payload),
   });
 
+  if (res.status === 429 || res.status === 503) {
+    // Server is overloaded or has no LLM: retrying via /chat would only add load.
+    // Same shape as the stream's own llm_overloaded / llm_unavailable error events.
+    const body = await res.json().catch(() => ({}));
+    const kind = res.status === 429 ? "llm_overloaded" : "llm_unavailable";
+    onEvent?.({
+      type: "error",
+      data: {
+        message: `${kind}: ${body.detail || res.statusText}`,
+        retry_after: Number(res.headers.get("Retry-After")) || 1,
+      },
+    });
+    return;
+  }
+
   if (!res.ok || !res.body) {
     // fallback: non-streaming
     const { data } = await chatTurn(payload);
@@ -58,7 +58,8 @@ export default function ChatPage() {
           setLiveReply("");
           setIsStreaming(false);
         } else if (type === "error") {
-          setTurns((t) => [...t, { role: "system", text: `Error: ${data?.message || "stream error"}` }]);
+          const retry = data?.retry_after ? ` (try again in ${data.retry_after}s)` : "";
+          setTurns((t) => [...t, { role: "system", text: `Error: ${data?.message || "stream error"}${retry}` }]);
           setIsStreaming(false);
         }
       }